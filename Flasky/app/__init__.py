@@ -7,12 +7,13 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_pagedown import PageDown
 
 from config import config
+from .routing import RoutingSession
 
 pagedown = PageDown()
 bootstrap = Bootstrap()
 mail = Mail()
 moment = Moment()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
 
@@ -29,6 +30,34 @@ def create_app(config_name) -> Flask:
     login_manager.init_app(app)
     pagedown.init_app(app)
 
+    from .sqlite import configure_sqlite
+    configure_sqlite(app)
+
+    from .activity import LastSeenBuffer
+    app.extensions['last_seen'] = LastSeenBuffer(app)
+
+    from .metrics import Metrics
+    app.extensions['metrics'] = Metrics(app)
+
+    from .sampler import StackSampler
+    app.extensions['stack_sampler'] = StackSampler(app)
+
+    from .email import MailPool
+    app.extensions['mail_pool'] = MailPool(app)
+
+    from .rendering import Renderer
+    app.extensions['renderer'] = Renderer(app)
+
+    from .fragments import post_fragment, comment_fragment
+    app.add_template_global(post_fragment)
+    app.add_template_global(comment_fragment)
+
+    from .pagecache import PageCache
+    app.extensions['page_cache'] = PageCache(app)
+
+    from .querystats import QueryProfiler
+    app.extensions['query_profiler'] = QueryProfiler(app)
+
     # attach routes and custom error pages here
     from .main import bp as main_bp
     app.register_blueprint(main_bp)
@@ -0,0 +1,101 @@
+import atexit
+import threading
+import time
+import weakref
+from datetime import datetime
+
+import sqlalchemy as sa
+from flask import Flask, current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+from .sqlite import write_engine
+
+_buffers = weakref.WeakSet()
+
+
+class LastSeenBuffer:
+    """Collects ``User.last_seen`` updates and writes them in one bulk UPDATE.
+
+    A batch is written once ``FLASKY_LAST_SEEN_BATCH_SIZE`` users are pending
+    or ``FLASKY_LAST_SEEN_FLUSH_INTERVAL`` seconds have passed. The interval
+    is kept by a timer started with the first pending update, so a worker
+    that goes idle still writes its batch, and whatever is left is flushed
+    when the process exits. A user is written at most once per
+    ``FLASKY_LAST_SEEN_MIN_INTERVAL`` seconds.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self._pending = {}
+        self._written = {}
+        self._last_flush = time.monotonic()
+        self._timer = None
+        self._lock = threading.Lock()
+        _buffers.add(self)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def touch(self, user_id: int, when: datetime):
+        config = self.app.config
+        now = time.monotonic()
+        with self._lock:
+            written = self._written.get(user_id)
+            if written is not None and now - written < config['FLASKY_LAST_SEEN_MIN_INTERVAL']:
+                return
+            self._pending[user_id] = when
+            self._written[user_id] = now
+            due = len(self._pending) >= config['FLASKY_LAST_SEEN_BATCH_SIZE'] or \
+                now - self._last_flush >= config['FLASKY_LAST_SEEN_FLUSH_INTERVAL']
+            if not due and self._timer is None:
+                self._timer = threading.Timer(config['FLASKY_LAST_SEEN_FLUSH_INTERVAL'], flush_later,
+                                              (weakref.ref(self),))
+                self._timer.daemon = True
+                self._timer.start()
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            cutoff = self._last_flush - self.app.config['FLASKY_LAST_SEEN_MIN_INTERVAL']
+            self._written = {user_id: written for user_id, written in self._written.items()
+                             if written > cutoff}
+        if not pending:
+            return 0
+        from .models import User
+        users = User.__table__
+        stmt = sa.update(users).where(users.c.id == sa.bindparam('user_id')) \
+            .values(last_seen=sa.bindparam('seen'))
+        with self.app.app_context():
+            try:
+                with (write_engine() or db.engine).begin() as connection:
+                    connection.execute(stmt, [{'user_id': user_id, 'seen': seen}
+                                              for user_id, seen in pending.items()])
+            except SQLAlchemyError:
+                self.app.logger.exception('Could not write last_seen for %d users', len(pending))
+                return 0
+        return len(pending)
+
+
+def flush_later(ref: weakref.ref):
+    # the timer holds no strong reference, so a discarded app's buffer can still go away
+    buffer = ref()
+    if buffer is not None:
+        buffer.flush()
+
+
+def last_seen_buffer() -> LastSeenBuffer:
+    return current_app.extensions['last_seen']
+
+
+@atexit.register
+def flush_all():
+    for buffer in list(_buffers):
+        buffer.flush()
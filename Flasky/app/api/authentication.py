@@ -1,4 +1,4 @@
-from flask import g, jsonify
+from flask import g, jsonify, current_app
 from flask_httpauth import HTTPBasicAuth
 
 from . import bp
@@ -42,4 +42,4 @@ def get_token():
     if g.current_user.is_anonymous or g.token_used:
         return unauthorized('Invalid credentials')
     return jsonify({'token': g.current_user.generate_auth_token(),
-                    'expiration': 3600})
+                    'expiration': current_app.config['FLASKY_AUTH_TOKEN_EXPIRATION']})
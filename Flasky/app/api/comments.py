@@ -1,57 +1,66 @@
+import sqlalchemy as sa
 from flask import request, jsonify, current_app, url_for, g
 
 from . import bp
+from .conditional import conditional, page_etag, make_etag, newest, comment_signature
 from .decorators import permission_required
 from .. import db
 from ..models import Comment, Post, Permissions
+from ..pagination import paginate
 
 
 @bp.route('/comments/')
 def get_comments():
-    page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(Comment.query, Comment.timestamp, Comment.id,
+                          per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'])
     comments = pagination.items
-    prev = None
-    next = None
-    if pagination.has_prev:
-        prev = url_for('.get_comments', page=page - 1)
-    if pagination.has_next:
-        next = url_for('.get_comments', page=page + 1)
-    return jsonify({'comments': [comment.to_json() for comment in comments],
-                    'prev': prev,
-                    'next': next,
-                    'count': pagination.total})
+    # a count and the newest id change with every insert and delete
+    total, newest_id = db.session.execute(sa.select(sa.func.count(Comment.id), sa.func.max(Comment.id))).one()
+
+    def payload():
+        prev = None
+        next = None
+        if pagination.has_prev:
+            prev = url_for('.get_comments', **pagination.prev_args)
+        if pagination.has_next:
+            next = url_for('.get_comments', **pagination.next_args)
+        return {'comments': [comment.to_json() for comment in comments],
+                'prev': prev,
+                'next': next,
+                'count': total}
+
+    return conditional(page_etag(pagination, comment_signature, total, newest_id), payload,
+                       last_modified=newest(comments))
 
 
 @bp.route('/comments/<int:id>')
 def get_comment(id):
     comment = Comment.query.get_or_404(id)
-    return jsonify(comment.to_json())
+    return conditional(make_etag(request.path, *comment_signature(comment)), comment.to_json)
 
 
 @bp.route('/posts/<int:id>/comments/')
 def get_post_comments(id):
     post = Post.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.filter_by(post_id=post.id).order_by(Comment.timestamp.desc()).paginate(
-        page=page,
-        per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False
-    )
+    pagination = paginate(Comment.query.filter_by(post_id=post.id), Comment.timestamp, Comment.id,
+                          per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'])
     comments = pagination.items
-    prev = None
-    next = None
-    if pagination.has_prev:
-        prev = url_for('.get_post_comments', page=page - 1)
-    if pagination.has_next:
-        next = url_for('.get_post_comments', page=page + 1)
-    return jsonify({
-        'comments': [comment.to_json() for comment in comments],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total})
+
+    def payload():
+        prev = None
+        next = None
+        if pagination.has_prev:
+            prev = url_for('.get_post_comments', id=id, **pagination.prev_args)
+        if pagination.has_next:
+            next = url_for('.get_post_comments', id=id, **pagination.next_args)
+        return {
+            'comments': [comment.to_json() for comment in comments],
+            'prev': prev,
+            'next': next,
+            'count': post.comments_count}
+
+    return conditional(page_etag(pagination, comment_signature, post.comments_count), payload,
+                       last_modified=newest(comments))
 
 
 @bp.route('/posts/<int:id>/comments/', methods=['POST'])
@@ -59,7 +68,7 @@ def get_post_comments(id):
 def new_post_comment(id):
     post = Post.query.get_or_404(id)
     comment = Comment.from_json(request.json)
-    comment.author = g.current_user
+    comment.author_id = g.current_user.id
     comment.post = post
     db.session.add(comment)
     db.session.commit()
@@ -0,0 +1,45 @@
+import hashlib
+from datetime import datetime
+from typing import Callable, Optional
+
+from flask import current_app, jsonify, request
+
+
+def make_etag(*parts) -> str:
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def page_etag(pagination, signature: Callable, *extra) -> str:
+    """ETag of one page of a collection, built from its rows' signatures."""
+    return make_etag(request.path, request.args.get('after'), request.args.get('before'),
+                     request.args.get('page'), pagination.has_prev, pagination.has_next,
+                     [signature(item) for item in pagination.items], *extra)
+
+
+def newest(items, attribute: str = 'timestamp') -> Optional[datetime]:
+    return max((getattr(item, attribute) for item in items), default=None)
+
+
+def conditional(etag: str, payload: Callable[[], dict],
+                last_modified: Optional[datetime] = None):
+    """Answer ``If-None-Match`` with a 304 before ``payload`` is ever built."""
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(payload())
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+def post_signature(post) -> tuple:
+    return post.id, post.version, post.comments_count
+
+
+def comment_signature(comment) -> tuple:
+    return comment.id, comment.version
+
+
+def user_signature(user) -> tuple:
+    return user.id, user.username, user.name, user.moment_since, user.last_seen, user.post_count
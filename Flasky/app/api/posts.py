@@ -1,29 +1,51 @@
-from flask import jsonify, request, g, url_for
+import sqlalchemy as sa
+from flask import jsonify, request, g, url_for, current_app, Response, stream_with_context
 
 from . import bp
+from .conditional import conditional, make_etag, post_signature
 from .decorators import permission_required
 from .errors import forbidden
 from .. import db
 from ..models import Post, Permissions
 
 
+def wants_stream() -> bool:
+    if request.args.get('stream', 0, type=int):
+        return True
+    return request.accept_mimetypes.best_match(
+        ['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+
+def stream_posts():
+    query = sa.select(Post).order_by(Post.id).execution_options(
+        yield_per=current_app.config['FLASKY_STREAM_CHUNK_SIZE'])
+    for post in db.session.scalars(query):
+        yield current_app.json.dumps(post.to_json()) + '\n'
+
+
 @bp.route('/posts/')
 def get_posts():
-    posts = Post.query.all()
-    return jsonify({'posts': [post.to_json() for post in posts]})
+    if wants_stream():
+        return Response(stream_with_context(stream_posts()), mimetype='application/x-ndjson')
+    stamp = db.session.execute(sa.select(sa.func.count(Post.id), sa.func.max(Post.id),
+                                         sa.func.sum(Post.version), sa.func.sum(Post.comments_count),
+                                         sa.func.max(Post.timestamp))).one()
+    return conditional(make_etag(request.path, *stamp[:4]),
+                       lambda: {'posts': [post.to_json() for post in Post.query.all()]},
+                       last_modified=stamp[4])
 
 
 @bp.route('/posts/<int:id>')
 def get_post(id):
     post = Post.query.get_or_404(id)
-    return jsonify(post.to_json())
+    return conditional(make_etag(request.path, *post_signature(post)), post.to_json)
 
 
 @bp.route('/posts/', methods=['POST'])
 @permission_required(Permissions.WRITE.value)
 def new_post():
     post = Post.from_json(request.json)
-    post.author = g.current_user
+    post.author_id = g.current_user.id
     db.session.add(post)
     db.session.commit()
     return jsonify(post.to_json()), 201, {'Location': url_for('api.get_post', id=post.id)}
@@ -33,7 +55,7 @@ def new_post():
 @permission_required(Permissions.WRITE.value)
 def edit_post(id):
     post = Post.query.get_or_404(id)
-    if not g.current_user == post.author and not g.current_user.can(Permissions.ADMIN.value):
+    if g.current_user.id != post.author_id and not g.current_user.can(Permissions.ADMIN.value):
         return forbidden('Insufficient permissions')
     post.body = request.json.get('body', post.body)
     db.session.add(post)
@@ -1,54 +1,84 @@
-from flask import request, current_app, url_for, jsonify
+import io
+
+import sqlalchemy as sa
+from flask import current_app, url_for, request, jsonify
 
 from . import bp
-from ..models import User, Post
+from .conditional import conditional, page_etag, make_etag, newest, post_signature, user_signature
+from .decorators import permission_required
+from .errors import bad_request
+from .. import db, importer
+from ..models import User, Post, Timeline, Permissions
+from ..pagination import paginate
+
+IMPORT_FORMATS = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson'}
 
 
 @bp.route('/users/<int:id>')
 def get_user(id):
     user = User.query.get_or_404(id)
-    return jsonify(user.to_json())
+    return conditional(make_etag(request.path, *user_signature(user)), user.to_json)
 
 
 @bp.route('/users/<int:id>/posts/')
 def get_user_posts(id):
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(user.posts, Post.timestamp, Post.id,
+                          per_page=current_app.config['FLASKY_POSTS_PER_PAGE'])
     posts = pagination.items
-    prev = None
-    next = None
-    if pagination.has_prev:
-        prev = url_for('api.get_user_posts', id=id, page=page - 1)
-    if pagination.has_next:
-        next = url_for('api.get_user_posts', id=id, page=page + 1)
-    return jsonify({
-        'posts': [post.to_json() for post in posts],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+
+    def payload():
+        prev = None
+        next = None
+        if pagination.has_prev:
+            prev = url_for('api.get_user_posts', id=id, **pagination.prev_args)
+        if pagination.has_next:
+            next = url_for('api.get_user_posts', id=id, **pagination.next_args)
+        return {
+            'posts': [post.to_json() for post in posts],
+            'prev': prev,
+            'next': next,
+            'count': user.post_count
+        }
+
+    return conditional(page_etag(pagination, post_signature, user.post_count), payload,
+                       last_modified=newest(posts))
 
 
 @bp.route('/users/<int:id>/timeline/')
 def get_user_followed_posts(id):
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed_posts.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(user.timeline_posts, Timeline.timestamp, Timeline.post_id,
+                          per_page=current_app.config['FLASKY_POSTS_PER_PAGE'])
     posts = pagination.items
-    prev = None
-    next = None
-    if pagination.has_prev:
-        prev = url_for('api.get_user_followed_posts', id=id, page=page - 1)
-    if pagination.has_next:
-        next = url_for('api.get_user_followed_posts', id=id, page=page + 1)
-    return jsonify({
-        'posts': [post.to_json() for post in posts],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    total, newest_entry = db.session.execute(sa.select(sa.func.count(), sa.func.max(Timeline.timestamp))
+                                             .where(Timeline.user_id == user.id)).one()
+
+    def payload():
+        prev = None
+        next = None
+        if pagination.has_prev:
+            prev = url_for('api.get_user_followed_posts', id=id, **pagination.prev_args)
+        if pagination.has_next:
+            next = url_for('api.get_user_followed_posts', id=id, **pagination.next_args)
+        return {
+            'posts': [post.to_json() for post in posts],
+            'prev': prev,
+            'next': next,
+            'count': total
+        }
+
+    return conditional(page_etag(pagination, post_signature, total, newest_entry),
+                       payload, last_modified=newest(posts))
+
+
+@bp.route('/users/import', methods=['POST'])
+@permission_required(Permissions.ADMIN.value)
+def import_users():
+    format = IMPORT_FORMATS.get(request.mimetype)
+    if format is None:
+        return bad_request('Content-Type must be text/csv or application/x-ndjson')
+    stream = io.TextIOWrapper(request.stream, encoding=request.mimetype_params.get('charset', 'utf-8'),
+                              newline='')
+    # no process pool per request, the request's worker hashes the passwords itself
+    return jsonify(importer.import_users(stream, format, workers=1))
@@ -42,9 +42,10 @@ def register():
                     username=form.username.data,
                     password=form.password.data)
         db.session.add(user)
-        db.session.commit()
+        db.session.flush()
         token = user.generate_confirmation_token()
         send_email(user.email, ' Confirm Your Account', 'auth/email/confirm', user=user, token=token)
+        db.session.commit()
         flash('A confirmation email has been sent to you by email.')
         return redirect(url_for('main.index'))
     return render_template('auth/register.html', form=form)
@@ -70,7 +71,7 @@ def before_request():
         if not current_user.confirmed \
                 and request.endpoint \
                 and request.blueprint != 'auth' \
-                and request.endpoint != 'static':
+                and request.endpoint not in ('static', 'main.avatar'):
             return redirect(url_for('auth.unconfirmed'))
 
 
@@ -87,6 +88,7 @@ def resend_confirmation():
     token = current_user.generate_confirmation_token()
     send_email(current_user.email, ' Confirm Your Account',
                'auth/email/confirm', user=current_user, token=token)
+    db.session.commit()
     flash('A new confirmation email has been sent to you by email.')
     return redirect(url_for('main.index'))
 
@@ -118,6 +120,7 @@ def reset_password_request():
             token = user.generate_confirmation_token()
             send_email(user.email, ' Reset Your Password', '/auth/email/reset_password',
                        user=user, token=token)
+            db.session.commit()
             flash('An email with instructions to reset your password has been '
                   'sent to you.')
         return redirect(url_for('auth.login'))
@@ -149,6 +152,7 @@ def change_email_request():
             token = current_user.generate_email_change_token(new_email)
             send_email(new_email, ' Confirm Your New Email', 'auth/email/change_email',
                        user=current_user, token=token)
+            db.session.commit()
             flash('An email with instructions to confirm your new email '
                   'address has been sent to you.')
             return redirect(url_for('main.index'))
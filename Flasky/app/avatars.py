@@ -0,0 +1,96 @@
+import os
+import struct
+import tempfile
+import zlib
+from functools import lru_cache
+from typing import Optional
+
+from flask import current_app
+
+GRAVATAR_URL = 'http://www.gravatar.com/avatar'
+SECURE_GRAVATAR_URL = 'https://secure.gravatar.com/avatar'
+# the sizes the templates ask for, every other size is served as the next one up
+SIZES = (18, 32, 40, 64, 100, 128, 256, 512)
+
+
+@lru_cache(maxsize=4096)
+def gravatar_url(hash: str, size: int, default: str, rating: str, secure: bool) -> str:
+    return '{url}/{hash}?s={size}&d={default}&r={rating}'.format(
+        url=SECURE_GRAVATAR_URL if secure else GRAVATAR_URL,
+        hash=hash, size=size, default=default, rating=rating)
+
+
+def avatar_size(size: int) -> int:
+    return next((s for s in SIZES if s >= size), SIZES[-1])
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + \
+        struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def identicon(hash: str, size: int) -> bytes:
+    """Render a 5x5 mirrored identicon for an MD5 ``hash`` as an RGB PNG."""
+    digest = bytes.fromhex(hash)
+    foreground = bytes((digest[0] // 2 + 64, digest[1] // 2 + 64, digest[2] // 2 + 64))
+    background = b'\xf0\xf0\xf0'
+    cells = [[(digest[row * 3 + min(col, 4 - col)] >> row) & 1 for col in range(5)]
+             for row in range(5)]
+
+    padding = size // 12
+    inner = size - 2 * padding
+    blank = b'\x00' + background * size
+    rows = []
+    for row in cells:
+        line = bytearray(b'\x00')
+        for x in range(size):
+            inside = padding <= x < padding + inner
+            line += foreground if inside and row[(x - padding) * 5 // inner] else background
+        rows.append(bytes(line))
+    scanlines = [rows[(y - padding) * 5 // inner] if padding <= y < padding + inner else blank
+                 for y in range(size)]
+
+    header = struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', header) + \
+        png_chunk(b'IDAT', zlib.compress(b''.join(scanlines), 9)) + png_chunk(b'IEND', b'')
+
+
+def avatar_directory() -> str:
+    return current_app.config['FLASKY_AVATAR_DIR'] or os.path.join(current_app.instance_path, 'avatars')
+
+
+def cached_identicon(hash: str, size: int) -> Optional[str]:
+    """Return the path of the identicon if it was generated before."""
+    path = os.path.join(avatar_directory(), f'{hash}-{size}.png')
+    return path if os.path.exists(path) else None
+
+
+def identicon_file(hash: str, size: int) -> str:
+    """Generate the identicon into the cache directory and return its path.
+
+    Only call this for hashes of real users. The directory holds at most
+    ``FLASKY_AVATAR_CACHE_FILES`` files, the oldest are removed first.
+    """
+    directory = avatar_directory()
+    path = os.path.join(directory, f'{hash}-{size}.png')
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(identicon(hash, size))
+    os.replace(tmp, path)
+    evict(directory, current_app.config['FLASKY_AVATAR_CACHE_FILES'])
+    return path
+
+
+def evict(directory: str, limit: int):
+    with os.scandir(directory) as entries:
+        files = [entry for entry in entries if entry.name.endswith('.png')]
+    if len(files) <= limit:
+        return
+    files.sort(key=lambda entry: entry.stat().st_mtime)
+    # make room for a tenth of the limit so that not every new file rescans the directory
+    for entry in files[:len(files) - limit * 9 // 10]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
@@ -1,22 +1,257 @@
-from threading import Thread
+import atexit
+import queue
+import smtplib
+import threading
+import weakref
+from datetime import datetime, timezone
 
-from flask import current_app, render_template
+import sqlalchemy.orm as so
+from flask import Flask, current_app, has_app_context, render_template
 from flask_mail import Message
+from sqlalchemy import event
 
-from . import mail
+from . import db, mail
 
+_pools = weakref.WeakSet()
+_stop = object()
 
-def send_async_mail(app, msg):
-    with app.app_context():
-        mail.send(msg)
 
+class MailPool:
+    """A bounded queue of outgoing messages served by a few worker threads.
 
-def send_email(to, subject, template, **kwargs) -> Thread:
-    msg = Message(current_app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + subject,
-                  sender=current_app.config['FLASKY_MAIL_SENDER'], recipients=[to])
-    msg.body = render_template(template + '.txt', **kwargs)
-    msg.html = render_template(template + '.html', **kwargs)
-    app = current_app._get_current_object()
-    thr = Thread(target=send_async_mail, args=(app, msg))
-    thr.start()
-    return thr
+    Each worker keeps one SMTP connection open while it has work and sends
+    up to ``FLASKY_MAIL_BATCH_SIZE`` queued messages per wake-up over it.
+    After ``FLASKY_MAIL_IDLE_TIMEOUT`` idle seconds it closes the connection
+    and exits. When the queue stays full for ``FLASKY_MAIL_QUEUE_TIMEOUT``
+    seconds the message is sent from the calling thread instead.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.queue = queue.Queue(app.config['FLASKY_MAIL_QUEUE_SIZE'])
+        self.sent = 0
+        self.failed = 0
+        self.spilled = 0
+        self.batches = 0
+        self.connections = 0
+        self._workers = []
+        self._lock = threading.Lock()
+        _pools.add(self)
+
+    @property
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    def submit(self, msg: Message):
+        self._start()
+        try:
+            self.queue.put(msg, timeout=self.app.config['FLASKY_MAIL_QUEUE_TIMEOUT'])
+        except queue.Full:
+            with self._lock:
+                self.spilled += 1
+            self._send_now(msg)
+        else:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            while len(self._workers) < self.app.config['FLASKY_MAIL_WORKERS']:
+                worker = threading.Thread(target=self._work, daemon=True,
+                                          name=f'mail-{len(self._workers)}')
+                worker.start()
+                self._workers.append(worker)
+
+    def _retire(self) -> bool:
+        with self._lock:
+            if not self.queue.empty():
+                return False
+            self._workers.remove(threading.current_thread())
+            return True
+
+    def _send_now(self, msg: Message):
+        with self.app.app_context():
+            try:
+                mail.send(msg)
+            except Exception:
+                self._count(failed=1)
+                self.app.logger.exception('Could not send mail to %s', msg.recipients)
+            else:
+                self._count(sent=1, connections=1)
+
+    def _count(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def _work(self):
+        with self.app.app_context():
+            connection = None
+            try:
+                while True:
+                    try:
+                        msg = self.queue.get(timeout=self.app.config['FLASKY_MAIL_IDLE_TIMEOUT'])
+                    except queue.Empty:
+                        if self._retire():
+                            return
+                        continue
+                    batch = [msg]
+                    while msg is not _stop and len(batch) < self.app.config['FLASKY_MAIL_BATCH_SIZE']:
+                        try:
+                            msg = self.queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        batch.append(msg)
+                    messages = [msg for msg in batch if msg is not _stop]
+                    if messages:
+                        connection = self._send_batch(connection, messages)
+                    for _ in batch:
+                        self.queue.task_done()
+                    if len(messages) < len(batch):
+                        with self._lock:
+                            self._workers.remove(threading.current_thread())
+                        return
+            finally:
+                self._close(connection)
+
+    def _send_batch(self, connection, messages: list):
+        self._count(batches=1)
+        for msg in messages:
+            for attempt in range(2):
+                try:
+                    if connection is None:
+                        connection = mail.connect().__enter__()
+                        self._count(connections=1)
+                    connection.send(msg)
+                except (smtplib.SMTPException, OSError):
+                    connection = self._close(connection)
+                    if attempt:
+                        self._count(failed=1)
+                        self.app.logger.exception('Could not send mail to %s', msg.recipients)
+                except Exception:
+                    self._count(failed=1)
+                    self.app.logger.exception('Could not send mail to %s', msg.recipients)
+                    break
+                else:
+                    self._count(sent=1)
+                    break
+        return connection
+
+    @staticmethod
+    def _close(connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+        return None
+
+    def join(self):
+        self.queue.join()
+
+    def close(self):
+        workers = list(self._workers)
+        for _ in workers:
+            self.queue.put(_stop)
+        for worker in workers:
+            worker.join()
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.queue_depth,
+            'max_queue': self.queue.maxsize,
+            'workers': len(self._workers),
+            'sent': self.sent,
+            'failed': self.failed,
+            'spilled': self.spilled,
+            'batches': self.batches,
+            'connections': self.connections,
+        }
+
+
+def mail_pool() -> MailPool:
+    return current_app.extensions['mail_pool']
+
+
+@atexit.register
+def close_all():
+    for pool in list(_pools):
+        pool.close()
+
+
+def send_email(to, subject, template, **kwargs) -> None:
+    """Send a message once the current transaction commits, or now without one.
+
+    With ``FLASKY_MAIL_OUTBOX`` enabled the rendered message is written to
+    the outbox table in that same transaction and ``flask mail-drain``
+    sends it; otherwise it is handed to the mail pool after the commit.
+    Messages of a transaction that is rolled back or closed without a
+    commit are discarded with a warning.
+    """
+    subject = current_app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + subject
+    body = render_template(template + '.txt', **kwargs)
+    html = render_template(template + '.html', **kwargs)
+    in_transaction = db.session().in_transaction()
+    if current_app.config['FLASKY_MAIL_OUTBOX']:
+        from .models import Outbox
+        db.session.add(Outbox(recipient=to, subject=subject, body=body, html=html))
+        if not in_transaction:
+            db.session.commit()
+        return
+    msg = Message(subject, sender=current_app.config['FLASKY_MAIL_SENDER'], recipients=[to])
+    msg.body = body
+    msg.html = html
+    if in_transaction:
+        db.session.info.setdefault('mail', []).append(msg)
+    else:
+        mail_pool().submit(msg)
+
+
+def drain_outbox(batch_size: int) -> tuple[int, int]:
+    """Claim one batch of outbox rows and send it over a single SMTP session."""
+    from .models import Outbox
+    rows = Outbox.claim(batch_size)
+    if not rows:
+        db.session.rollback()
+        return 0, 0
+    sent = 0
+    pending = list(rows)
+    connection = None
+    try:
+        connection = mail.connect().__enter__()
+        while pending:
+            row = pending.pop(0)
+            try:
+                connection.send(row.to_message())
+            except Exception as e:
+                row.failed(e)
+                current_app.logger.exception('Could not send outbox message %d', row.id)
+            else:
+                row.sent_at = datetime.now(timezone.utc)
+                sent += 1
+    except (smtplib.SMTPException, OSError) as e:
+        for row in pending:
+            row.failed(e)
+        current_app.logger.exception('Could not connect to the mail server')
+    finally:
+        MailPool._close(connection)
+        db.session.commit()
+    return sent, len(rows) - sent
+
+
+@event.listens_for(so.Session, 'after_commit')
+def submit_mail(session: so.Session):
+    messages = session.info.pop('mail', None)
+    if messages and has_app_context():
+        for msg in messages:
+            mail_pool().submit(msg)
+
+
+@event.listens_for(so.Session, 'after_transaction_end')
+def discard_mail(session: so.Session, transaction: so.SessionTransaction):
+    # after_commit has taken the messages of a committed transaction already
+    if transaction.parent is not None:
+        return
+    messages = session.info.pop('mail', None)
+    if messages and has_app_context():
+        current_app.logger.warning('Discarded %d email(s) to %s: their transaction was not committed',
+                                   len(messages), ', '.join(r for msg in messages for r in msg.recipients))
@@ -1,42 +1,13 @@
-from random import randint
+from .seed import Seeder
 
-from faker import Faker
-from sqlalchemy.exc import IntegrityError
 
-from . import db
-from .models import User, Post, Role
+def users(count=100, seed=None):
+    seeder = Seeder(seed, workers=1)
+    seeder.users(count)
+    seeder.finish()
 
 
-def users(count=100):
-    Role.insert_roles()
-    fake = Faker()
-    i = 0
-    while i < count:
-        u = User(
-            email=fake.email(),
-            username=fake.user_name(),
-            password='password',
-            confirmed=True,
-            name=fake.name(),
-            location=fake.city(),
-            about_me=fake.text(),
-            moment_since=fake.past_date(),
-            role_id=1)
-        db.session.add(u)
-        try:
-            db.session.commit()
-            i += 1
-        except IntegrityError:
-            db.session.rollback()
-
-
-def posts(count=100):
-    fake = Faker()
-    user_count = User.query.count()
-    for i in range(count):
-        u = User.query.offset(randint(0, user_count - 1)).first()
-        p = Post(body=fake.text(),
-                 timestamp=fake.past_date(),
-                 author=u)
-        db.session.add(p)
-    db.session.commit()
+def posts(count=100, seed=None):
+    seeder = Seeder(seed, workers=1)
+    seeder.posts(count)
+    seeder.finish()
@@ -0,0 +1,43 @@
+from flask import current_app, render_template, request
+from flask_login import current_user
+from markupsafe import Markup
+
+from .caching import get_cache
+
+
+def fragment_cache():
+    return get_cache('fragments', current_app.config['FLASKY_FRAGMENT_CACHE_SIZE'])
+
+
+def viewer_class(author_id: int) -> str:
+    if current_user.is_authenticated and current_user.id == author_id:
+        return 'author'
+    if current_user.is_administrator():
+        return 'admin'
+    return 'viewer'
+
+
+def cached_fragment(key: tuple, template: str, **context) -> Markup:
+    """Render ``template`` once per ``key`` and serve the cached markup afterwards."""
+    cache = fragment_cache()
+    html = cache.get(key)
+    if html is None:
+        html = Markup(render_template(template, **context))
+        cache.set(key, html)
+    return html
+
+
+def post_fragment(post) -> Markup:
+    viewer = viewer_class(post.author_id)
+    key = ('post', post.id, post.version, post.comments_count,
+           post.author.username, post.author.avatar_hash, request.scheme, viewer,
+           request.full_path if viewer != 'viewer' else None)
+    return cached_fragment(key, '_post.html', post=post)
+
+
+def comment_fragment(comment, moderate: bool = False, page_args: dict | None = None) -> Markup:
+    page_args = page_args or {}
+    key = ('comment', comment.id, comment.version,
+           comment.author.username, comment.author.avatar_hash, request.scheme, bool(moderate),
+           tuple(sorted(page_args.items())) if moderate else None)
+    return cached_fragment(key, '_comment.html', comment=comment, moderate=moderate, page_args=page_args)
@@ -0,0 +1,227 @@
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import IO, Iterable, Iterator, Optional
+
+import sqlalchemy as sa
+from email_validator import EmailNotValidError, validate_email
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from . import db
+from .models import Role, User, Follow
+
+USERNAME = re.compile(r'^[A-Za-z][A-Za-z0-9_.]*$')
+MAX_ERRORS = 100
+TRUE = ['true', 'on', '1', 'yes']
+FALSE = ['false', 'off', '0', 'no', '']
+
+
+def read_csv(stream: IO[str]) -> Iterator[tuple[int, Optional[dict]]]:
+    reader = csv.DictReader(stream)
+    for record in reader:
+        yield reader.line_num, record
+
+
+def read_ndjson(stream: IO[str]) -> Iterator[tuple[int, Optional[dict]]]:
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+def hash_passwords(passwords: list[str]) -> list[str]:
+    return [generate_password_hash(password) for password in passwords]
+
+
+class UserImporter:
+    """Creates users from CSV or NDJSON records in bulk.
+
+    Every record needs an ``email``, a ``username`` and a ``password`` and
+    may set ``name``, ``location``, ``about_me``, ``role`` (a role name,
+    the default role otherwise) and ``confirmed``; all are strings, except
+    ``confirmed``, which may also be a boolean. Records are handled in chunks
+    of ``FLASKY_IMPORT_CHUNK_SIZE``: the chunk is validated against itself
+    and with one query against the existing users, its passwords are hashed
+    by a pool of ``workers`` processes (``FLASKY_IMPORT_WORKERS`` by default,
+    with one the calling thread hashes them), and the users and their
+    self-follows are written with two multi-row INSERTs in the chunk's own
+    transaction, which runs on the writer's connection from the check on. If
+    another writer takes one of the names in between, the chunk is retried
+    one user at a time. This skips ``User.__init__`` and the ORM events, so
+    the follow counters are written directly. Invalid records are reported
+    with their line number and skipped.
+    """
+
+    def __init__(self, chunk_size: Optional[int] = None, workers: Optional[int] = None):
+        config = current_app.config
+        self.chunk_size = chunk_size or config['FLASKY_IMPORT_CHUNK_SIZE']
+        self.workers = workers or config['FLASKY_IMPORT_WORKERS'] or os.cpu_count() or 1
+        self.admin_email = config['FLASKY_ADMIN']
+        db.session().start_writing()
+        self.roles = {role.name: role.id for role in Role.query}
+        self.default_role = db.session.scalar(sa.select(Role.id).where(Role.default.is_(True)))
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self._pool = None
+
+    def __enter__(self) -> 'UserImporter':
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def error(self, line: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'line': line, 'message': message})
+
+    def hash(self, passwords: list[str]) -> list[str]:
+        if self.workers == 1 or len(passwords) < 2:
+            return hash_passwords(passwords)
+        if self._pool is None:
+            # web workers run threads of their own, so don't fork them
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        size = -(-len(passwords) // self.workers)
+        return list(itertools.chain.from_iterable(
+            self._pool.map(hash_passwords, [passwords[i:i + size] for i in range(0, len(passwords), size)])))
+
+    def check(self, record) -> Optional[str]:
+        if not isinstance(record, dict):
+            return 'record is not an object'
+        for field in ('email', 'username', 'password'):
+            if not isinstance(record.get(field), str) or not record[field].strip():
+                return f'{field} is required'
+        for field in ('name', 'location', 'about_me', 'role'):
+            if not isinstance(record.get(field), (str, type(None))):
+                return f'{field} must be a string'
+        confirmed = record.get('confirmed')
+        if not isinstance(confirmed, (bool, type(None))) and \
+                not (isinstance(confirmed, str) and confirmed.strip().lower() in TRUE + FALSE):
+            return 'confirmed must be true or false'
+        for field in ('email', 'username', 'name', 'location'):
+            if len(str(record.get(field) or '')) > 64:
+                return f'{field} is longer than 64 characters'
+        try:
+            validate_email(record['email'].strip(), check_deliverability=False)
+        except EmailNotValidError as e:
+            return f'invalid email: {e}'
+        if not USERNAME.match(record['username'].strip()):
+            return 'usernames must have only letters, numbers, dots or underscores'
+        if record.get('role') and record['role'] not in self.roles:
+            return f'unknown role {record["role"]}'
+        return None
+
+    def role_id(self, record: dict) -> Optional[int]:
+        if record.get('role'):
+            return self.roles[record['role']]
+        if record['email'] == self.admin_email:
+            return self.roles.get('Administrator', self.default_role)
+        return self.default_role
+
+    def import_chunk(self, chunk: list[tuple[int, Optional[dict]]]):
+        valid = []
+        emails = set()
+        usernames = set()
+        for line, record in chunk:
+            message = self.check(record)
+            if message is None:
+                record = {key: value.strip() if isinstance(value, str) else value
+                          for key, value in record.items()}
+                if record['email'] in emails:
+                    message = 'duplicate email'
+                elif record['username'] in usernames:
+                    message = 'duplicate username'
+            if message is not None:
+                self.error(line, message)
+                continue
+            emails.add(record['email'])
+            usernames.add(record['username'])
+            valid.append((line, record))
+        if not valid:
+            return
+        # check and insert in one transaction on the connection that writes
+        db.session().start_writing()
+        taken_emails, taken_usernames = self.taken(emails, usernames)
+        records = []
+        for line, record in valid:
+            if record['email'] in taken_emails:
+                self.error(line, 'email already registered')
+            elif record['username'] in taken_usernames:
+                self.error(line, 'username already in use')
+            else:
+                records.append((line, record))
+        if not records:
+            db.session.rollback()
+            return
+
+        password_hashes = self.hash([record['password'] for _, record in records])
+        now = datetime.now(timezone.utc)
+        rows = [{
+            'email': record['email'], 'username': record['username'], 'password_hash': password_hash,
+            'confirmed': str(record.get('confirmed', '')).lower() in TRUE,
+            'name': record.get('name') or None, 'location': record.get('location') or None,
+            'about_me': record.get('about_me') or None, 'moment_since': now, 'last_seen': now,
+            'avatar_hash': hashlib.md5(record['email'].lower().encode()).hexdigest(),
+            'role_id': self.role_id(record), 'follower_count': 1, 'following_count': 1,
+        } for (_, record), password_hash in zip(records, password_hashes)]
+        try:
+            count = self.insert(rows, now)
+            db.session.commit()
+        except IntegrityError:
+            # another writer took one of the names since the check above, find out which row by row
+            db.session.rollback()
+            for (line, _), row in zip(records, rows):
+                db.session().start_writing()
+                try:
+                    self.insert([row], now)
+                    db.session.commit()
+                except IntegrityError:
+                    db.session.rollback()
+                    self.error(line, 'email or username already registered')
+                else:
+                    self.imported += 1
+        else:
+            self.imported += count
+
+    @staticmethod
+    def taken(emails: set[str], usernames: set[str]) -> tuple[set[str], set[str]]:
+        return (set(db.session.scalars(sa.select(User.email).where(User.email.in_(emails)))),
+                set(db.session.scalars(sa.select(User.username).where(User.username.in_(usernames)))))
+
+    @staticmethod
+    def insert(rows: list[dict], now: datetime) -> int:
+        ids = db.session.scalars(sa.insert(User.__table__).returning(
+            User.__table__.c.id, sort_by_parameter_order=True), rows).all()
+        db.session.execute(sa.insert(Follow.__table__),
+                           [{'follower_id': id, 'followed_id': id, 'timestamp': now} for id in ids])
+        return len(ids)
+
+    def run(self, records: Iterable[tuple[int, Optional[dict]]]) -> dict:
+        records = iter(records)
+        while chunk := list(itertools.islice(records, self.chunk_size)):
+            self.import_chunk(chunk)
+        return {'imported': self.imported, 'failed': self.failed, 'errors': self.errors}
+
+
+def import_users(stream: IO[str], format: str, chunk_size: Optional[int] = None,
+                 workers: Optional[int] = None) -> dict:
+    """Import the users of a CSV or NDJSON ``stream``, see ``UserImporter``."""
+    with UserImporter(chunk_size, workers) as importer:
+        return importer.run(READERS[format](stream))
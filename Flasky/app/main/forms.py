@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms.fields import StringField, SubmitField
-from wtforms.validators import DataRequired
+from wtforms.fields import FloatField, StringField, SubmitField
+from wtforms.validators import DataRequired, NumberRange
 from flask_pagedown.fields import PageDownField
 
 
@@ -16,4 +16,8 @@ class PostForm(FlaskForm):
 
 class CommentForm(FlaskForm):
     body = StringField('', validators=[DataRequired()])
-    submit = SubmitField('Submit')
\ No newline at end of file
+    submit = SubmitField('Submit')
+
+
+class ProfileWindowForm(FlaskForm):
+    seconds = FloatField('Seconds', default=60.0, validators=[NumberRange(min=0)])
@@ -1,16 +1,31 @@
-from flask import render_template, redirect, url_for, request, current_app, flash, abort, make_response, Response
+import io
+import re
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import render_template, redirect, url_for, request, current_app, flash, abort, make_response, Response, \
+    jsonify, send_file
 from flask_login import current_user, login_required
-from flask_sqlalchemy.record_queries import get_recorded_queries
+from flask_wtf.csrf import generate_csrf
 
 from . import bp
-from .forms import PostForm, CommentForm
+from .forms import PostForm, CommentForm, ProfileWindowForm
 from .services import is_safe_url
 from .. import db
-from ..decorators import permission_required
-from ..models import Permissions, Post, Comment
+from ..avatars import avatar_size, cached_identicon, identicon, identicon_file
+from ..decorators import permission_required, admin_required
+from ..email import mail_pool
+from ..models import Permissions, Post, Comment, Timeline, Outbox, User
+from ..pagecache import cached_page
+from ..pagination import paginate, request_page_args
+from ..metrics import metrics
+from ..querystats import query_profiler
+from ..sampler import stack_sampler
+from ..rendering import renderer
 
 
 @bp.route('/', methods=['GET', 'POST'])
+@cached_page('posts', 'comments', 'users')
 def index():
     form = PostForm()
     if current_user.can(Permissions.WRITE.value) and form.validate_on_submit():
@@ -19,23 +34,23 @@ def index():
         db.session.add(post)
         db.session.commit()
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
     show_followed = False
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get('show_followed', ''))
     if show_followed:
-        query = current_user.followed_posts
+        pagination = paginate(current_user.timeline_posts.options(so.joinedload(Post.author)),
+                              Timeline.timestamp, Timeline.post_id,
+                              per_page=current_app.config['FLASKY_POSTS_PER_PAGE'])
     else:
-        query = Post.query
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+        pagination = paginate(Post.query.options(so.joinedload(Post.author)), Post.timestamp, Post.id,
+                              per_page=current_app.config['FLASKY_POSTS_PER_PAGE'])
     posts = pagination.items
     return render_template('index.html', form=form, posts=posts,
                            pagination=pagination, show_followed=show_followed)
 
 
 @bp.route('/post/<int:id>', methods=['GET', 'POST'])
+@cached_page('posts', 'comments', 'users')
 def post(id):
     post = Post.query.get_or_404(id)
     form = CommentForm()
@@ -51,13 +66,9 @@ def post(id):
         flash('Your comment has been published.')
         return redirect(url_for('.post', id=post.id, page=-1))
 
-    page = request.args.get('page', 1, type=int)
-    if page == -1:
-        page = (post.comments.count() - 1) // current_app.config['FLASKY_COMMENTS_PER_PAGE'] + 1
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page=page,
-        per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(post.comments.options(so.joinedload(Comment.author)), Comment.timestamp, Comment.id,
+                          per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
+                          ascending=True)
     comments = pagination.items
     return render_template('post.html', posts=[post], form=form,
                            comments=comments, pagination=pagination)
@@ -105,13 +116,11 @@ def show_followed():
 @login_required
 @permission_required(Permissions.MODERATE.value)
 def moderate():
-    page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(Comment.query.options(so.joinedload(Comment.author)), Comment.timestamp, Comment.id,
+                          per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'])
     comments = pagination.items
     return render_template('moderate.html', comments=comments,
-                           pagination=pagination, page=page)
+                           pagination=pagination, page_args=pagination.page_args)
 
 
 @bp.route('/moderate/enable/<int:id>')
@@ -122,8 +131,7 @@ def moderate_enable(id):
     comment.disabled = False
     db.session.add(comment)
     db.session.commit()
-    return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+    return redirect(url_for('.moderate', **request_page_args()))
 
 
 @bp.route('/moderate/disable/<int:id>')
@@ -134,8 +142,78 @@ def moderate_disable(id):
     comment.disabled = True
     db.session.add(comment)
     db.session.commit()
-    return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+    return redirect(url_for('.moderate', **request_page_args()))
+
+
+@bp.route('/avatar/<hash>')
+def avatar(hash):
+    if not re.fullmatch('[0-9a-f]{32}', hash):
+        abort(404)
+    size = avatar_size(request.args.get('s', 100, type=int))
+    max_age = current_app.config['FLASKY_AVATAR_MAX_AGE']
+    path = cached_identicon(hash, size)
+    if path is None:
+        # only the avatars of real users are written to disk
+        if db.session.scalar(sa.select(User.id).where(User.avatar_hash == hash).limit(1)) is None:
+            return send_file(io.BytesIO(identicon(hash, size)), mimetype='image/png', max_age=max_age)
+        path = identicon_file(hash, size)
+    return send_file(path, mimetype='image/png', max_age=max_age)
+
+
+@bp.route('/admin/caches')
+@login_required
+@admin_required
+def cache_stats():
+    caches = current_app.extensions.get('flasky_caches', {})
+    return jsonify({name: cache.stats() for name, cache in caches.items()})
+
+
+@bp.route('/admin/render')
+@login_required
+@admin_required
+def render_stats():
+    return jsonify(renderer().stats())
+
+
+@bp.route('/admin/mail')
+@login_required
+@admin_required
+def mail_stats():
+    stats = mail_pool().stats()
+    if current_app.config['FLASKY_MAIL_OUTBOX']:
+        stats['outbox_pending'] = Outbox.pending_count()
+    return jsonify(stats)
+
+
+@bp.route('/admin/queries')
+@login_required
+@admin_required
+def query_stats():
+    sort = request.args.get('sort', 'total')
+    if sort not in ('total', 'calls', 'mean', 'p95', 'p99', 'max'):
+        abort(400)
+    return jsonify(query_profiler().report(sort, request.args.get('limit', 50, type=int)))
+
+
+@bp.route('/admin/profile', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def stack_profile():
+    sampler = stack_sampler()
+    form = ProfileWindowForm()
+    if request.method == 'POST':
+        if not form.validate_on_submit():
+            abort(400)
+        sampler.open_window(form.seconds.data)
+    return jsonify({'window_until': sampler.window_until(), 'endpoints': sampler.endpoints(),
+                    'csrf_token': generate_csrf()})
+
+
+@bp.route('/metrics')
+def metrics_exposition():
+    if not metrics().enabled:
+        abort(404)
+    return Response(metrics().exposition(), mimetype='text/plain; version=0.0.4')
 
 
 @bp.route('/shutdown')
@@ -148,13 +226,3 @@ def server_shutdown():
     shutdown()
     return 'Shutting down...'
 
-
-@bp.after_app_request
-def after_request(response):
-    for query in get_recorded_queries():
-        if query.duration >= current_app.config['FLASKY_SLOW_DB_QUERY_TIME']:
-            current_app.logger.warning(
-                'Slow query: %s\nParameters: %s\nDuration: %fs\nContext: %s\n' %
-                (query.statement, query.parameters, query.duration,
-                 query.context))
-    return response
\ No newline at end of file
@@ -0,0 +1,228 @@
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import weakref
+from typing import Iterable
+
+from flask import Flask, Response, current_app, g, request, before_render_template, template_rendered
+
+_registries = weakref.WeakSet()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+HISTOGRAMS = {
+    'flasky_request_duration_seconds': ('Request latency by endpoint.', LATENCY_BUCKETS),
+    'flasky_request_db_seconds': ('Time spent executing SQL per request.', LATENCY_BUCKETS),
+    'flasky_request_queries': ('SQL statements executed per request.', QUERY_BUCKETS),
+    'flasky_template_render_seconds': ('Template render time, including nested templates.', LATENCY_BUCKETS),
+}
+COUNTERS = {
+    'flasky_requests_total': 'Requests by endpoint, method and status.',
+}
+GAUGES = {
+    'flasky_mail_queue_depth': 'Messages waiting in the mail queue.',
+}
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(labels: Iterable[tuple]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    """Request, database, template and mail metrics in Prometheus text format.
+
+    Enabled with ``FLASKY_METRICS``. Every worker keeps its own counters and
+    histograms and writes them to ``metrics-<pid>.json`` in
+    ``FLASKY_METRICS_DIR`` every ``FLASKY_METRICS_INTERVAL`` seconds and at
+    exit; ``/metrics`` adds up the files of all workers. Counters and
+    histograms of exited workers are kept so the totals never go backwards,
+    gauges only count live processes.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.enabled = app.config['FLASKY_METRICS']
+        self.directory = app.config['FLASKY_METRICS_DIR'] or os.path.join(app.instance_path, 'metrics')
+        self._histograms = {}
+        self._counters = {}
+        self._last_dump = time.monotonic()
+        self._lock = threading.Lock()
+        if self.enabled:
+            app.before_request(self.start_request)
+            app.after_request(self.end_request)
+            before_render_template.connect(self.start_template, app)
+            template_rendered.connect(self.end_template, app)
+            _registries.add(self)
+
+    def observe(self, name: str, labels: tuple, value: float):
+        buckets = HISTOGRAMS[name][1]
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def inc(self, name: str, labels: tuple, value: float = 1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+
+    def start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.db_time = 0.0
+        g.db_queries = 0
+
+    def end_request(self, response: Response) -> Response:
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        endpoint = (('endpoint', request.endpoint or 'none'),)
+        self.observe('flasky_request_duration_seconds',
+                     endpoint + (('method', request.method),), time.perf_counter() - start)
+        self.observe('flasky_request_db_seconds', endpoint, g.get('db_time', 0.0))
+        self.observe('flasky_request_queries', endpoint, g.get('db_queries', 0))
+        self.inc('flasky_requests_total',
+                 endpoint + (('method', request.method), ('status', response.status_code)))
+        now = time.monotonic()
+        with self._lock:
+            due = now - self._last_dump >= self.app.config['FLASKY_METRICS_INTERVAL']
+            if due:
+                self._last_dump = now
+        if due:
+            self.dump()
+        return response
+
+    def start_template(self, app: Flask, template, context, **extra):
+        g.setdefault('template_starts', []).append(time.perf_counter())
+
+    def end_template(self, app: Flask, template, context, **extra):
+        starts = g.get('template_starts')
+        if starts:
+            self.observe('flasky_template_render_seconds', (('template', template.name),),
+                         time.perf_counter() - starts.pop())
+
+    def gauges(self) -> list:
+        pool = self.app.extensions.get('mail_pool')
+        return [['flasky_mail_queue_depth', [], pool.queue_depth if pool is not None else 0]]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'histograms': [[name, list(labels), list(buckets), total, count]
+                               for (name, labels), (buckets, total, count) in self._histograms.items()],
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'gauges': self.gauges(),
+            }
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+
+    def dump(self):
+        data = self.snapshot()
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            os.remove(path)
+
+    def collect(self) -> list[dict]:
+        self.dump()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def exposition(self) -> str:
+        """Render the metrics of every worker in the Prometheus text format."""
+        histograms = {}
+        counters = {}
+        gauges = {}
+        for snapshot in self.collect():
+            for name, labels, buckets, total, count in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+                merged[1] += total
+                merged[2] += count
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            if snapshot['pid'] == os.getpid() or pid_alive(snapshot['pid']):
+                for name, labels, value in snapshot['gauges']:
+                    key = (name, tuple(map(tuple, labels)))
+                    gauges[key] = gauges.get(key, 0) + value
+
+        lines = []
+        for name, (help, bounds) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+            for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, value in zip(bounds, buckets):
+                    cumulative += value
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {total}')
+                lines.append(f'{name}_count{format_labels(labels)} {count}')
+        for name, help in COUNTERS.items():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} counter']
+            lines += [f'{name}{format_labels(labels)} {value}'
+                      for (metric, labels), value in sorted(counters.items()) if metric == name]
+        for name, help in GAUGES.items():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+            lines += [f'{name}{format_labels(labels)} {value}'
+                      for (metric, labels), value in sorted(gauges.items()) if metric == name]
+        return '\n'.join(lines) + '\n'
+
+
+def metrics() -> Metrics:
+    return current_app.extensions['metrics']
+
+
+@atexit.register
+def dump_all():
+    for registry in list(_registries):
+        try:
+            registry.dump()
+        except OSError:
+            pass
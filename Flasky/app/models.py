@@ -1,19 +1,22 @@
 import hashlib
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from enum import Enum
 from typing import Optional
 
-import bleach
 import sqlalchemy as sa
 import sqlalchemy.orm as so
-from flask import current_app, request, url_for
+from flask import current_app, request, url_for, has_app_context
 from flask_login import UserMixin, AnonymousUserMixin
+from flask_mail import Message
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
-from markdown import markdown
 from sqlalchemy import DateTime, event
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from . import db, login_manager
+from .activity import last_seen_buffer
+from .avatars import gravatar_url, avatar_size
+from .caching import get_cache
+from .rendering import render_body, POST_TAGS, COMMENT_TAGS
 from .exceptions import ValidationError
 
 
@@ -25,9 +28,38 @@ class Permissions(Enum):
     ADMIN = 16
 
 
+def user_cache():
+    return get_cache('users', current_app.config['FLASKY_USER_CACHE_SIZE'],
+                     current_app.config['FLASKY_USER_CACHE_TTL'])
+
+
+def token_versions():
+    return get_cache('token_versions', current_app.config['FLASKY_TOKEN_VERSIONS_SIZE'],
+                     current_app.config['FLASKY_TOKEN_VERSIONS_TTL'])
+
+
 @login_manager.user_loader
 def user_load(user_id):
-    return User.query.get(int(user_id))
+    cache = user_cache()
+    snapshot = cache.get(int(user_id))
+    if snapshot is not None:
+        return User.from_snapshot(snapshot)
+    user = db.session.get(User, int(user_id), options=[so.joinedload(User.role)])
+    if user is not None:
+        cache.set(user.id, user.snapshot())
+    return user
+
+
+def column_values(obj) -> dict:
+    return {attr.key: getattr(obj, attr.key) for attr in so.class_mapper(type(obj)).column_attrs}
+
+
+def detached_instance(cls, values: dict):
+    obj = so.class_mapper(cls).class_manager.new_instance()
+    for key, value in values.items():
+        so.attributes.set_committed_value(obj, key, value)
+    so.make_transient_to_detached(obj)
+    return obj
 
 
 class Role(db.Model):
@@ -79,10 +111,26 @@ class Role(db.Model):
             db.session.add(role)
         db.session.commit()
 
+    @staticmethod
+    def on_changed(mapper, connection, target: 'Role'):
+        if has_app_context():
+            user_cache().clear()
+            token_versions().clear()
+
+    @staticmethod
+    def on_deleted(mapper, connection, target: 'Role'):
+        if has_app_context():
+            user_cache().clear()
+            token_versions().clear()
+
     def __repr__(self):
         return f'<Role "{self.name}">'
 
 
+event.listen(Role, 'after_update', Role.on_changed)
+event.listen(Role, 'after_delete', Role.on_deleted)
+
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
@@ -99,7 +147,12 @@ class User(UserMixin, db.Model):
     last_seen: so.Mapped[datetime] = so.mapped_column(DateTime(timezone=True),
                                                       default=lambda: datetime.now(tz=timezone.utc))
 
-    avatar_hash: so.Mapped[Optional[str]] = so.mapped_column(sa.String(32))
+    avatar_hash: so.Mapped[Optional[str]] = so.mapped_column(sa.String(32), index=True)
+
+    post_count: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
+    comment_count: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
+    follower_count: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
+    following_count: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
 
     role_id: so.Mapped[Optional[int]] = so.mapped_column(sa.ForeignKey('roles.id'))
     role: so.Mapped[Optional[Role]] = so.relationship(Role, back_populates='users')
@@ -122,7 +175,6 @@ class User(UserMixin, db.Model):
         if self.email is not None and self.avatar_hash is None:
             self.avatar_hash = self.gravatar_hash()
         self.follow(self)
-        db.session.commit()
 
     def __set_role(self):
         if self.role is None:
@@ -217,6 +269,38 @@ class User(UserMixin, db.Model):
         self.__set_role()
         return True
 
+    def snapshot(self) -> dict:
+        return {
+            'user': column_values(self),
+            'role': column_values(self.role) if self.role is not None else None,
+        }
+
+    @staticmethod
+    def from_snapshot(snapshot: dict) -> 'User':
+        user = detached_instance(User, snapshot['user'])
+        role = detached_instance(Role, snapshot['role']) if snapshot['role'] is not None else None
+        so.attributes.set_committed_value(user, 'role', role)
+        return db.session.merge(user, load=False)
+
+    @staticmethod
+    def invalidate_cache(id: int):
+        if has_app_context():
+            user_cache().delete(id)
+
+    @staticmethod
+    def on_updated(mapper, connection, target: 'User'):
+        changed = {attr.key for attr in sa.inspect(target).attrs if attr.history.has_changes()}
+        if changed - {'last_seen'}:
+            User.invalidate_cache(target.id)
+        if changed & {'password_hash', 'confirmed', 'role_id'} and has_app_context():
+            token_versions().delete(target.id)
+
+    @staticmethod
+    def on_deleted(mapper, connection, target: 'User'):
+        User.invalidate_cache(target.id)
+        if has_app_context():
+            token_versions().delete(target.id)
+
     def can(self, perm: int) -> bool:
         return self.role is not None and self.role.has_permission(perm)
 
@@ -224,22 +308,21 @@ class User(UserMixin, db.Model):
         return self.can(Permissions.ADMIN.value)
 
     def ping(self):
-        self.last_seen = datetime.now(timezone.utc)
-        db.session.add(self)
-        db.session.commit()
+        now = datetime.now(timezone.utc)
+        loaded = sa.inspect(self).dict.get('last_seen')
+        if loaded is not None and loaded.tzinfo is None:
+            now = now.replace(tzinfo=None)
+        so.attributes.set_committed_value(self, 'last_seen', now)
+        last_seen_buffer().touch(self.id, now)
 
     def gravatar_hash(self):
         return hashlib.md5(self.email.lower().encode()).hexdigest()
 
     def gravatar(self, size=100, default='identicon', rating='g'):
-        if request.is_secure:
-            url = 'https://secure.gravatar.com/avatar'
-        else:
-            url = 'http://www.gravatar.com/avatar'
-
         hash = self.avatar_hash or self.gravatar_hash()
-        return '{url}/{hash}?s={size}&d={default}&r={rating}'.format(
-            url=url, hash=hash, size=size, default=default, rating=rating)
+        if current_app.config['FLASKY_LOCAL_AVATARS']:
+            return url_for('main.avatar', hash=hash, s=avatar_size(size))
+        return gravatar_url(hash, size, default, rating, request.is_secure)
 
     def follow(self, user):
         if not self.is_following(user):
@@ -266,6 +349,29 @@ class User(UserMixin, db.Model):
     def followed_posts(self):
         return Post.query.join(Follow, Follow.follower_id == self.id).filter(Follow.followed_id == Post.author_id)
 
+    @property
+    def timeline_posts(self):
+        return Post.query.join(Timeline, Timeline.post_id == Post.id).filter(Timeline.user_id == self.id)
+
+    @staticmethod
+    def increment(connection, id: int, *columns: str, delta: int = 1):
+        connection.execute(sa.update(User).where(User.id == id).values(
+            {name: getattr(User, name) + delta for name in columns}))
+        User.invalidate_cache(id)
+
+    @staticmethod
+    def recount():
+        db.session.execute(sa.update(User).values(
+            post_count=sa.select(sa.func.count(Post.id))
+            .where(Post.author_id == User.id).scalar_subquery(),
+            comment_count=sa.select(sa.func.count(Comment.id))
+            .where(Comment.author_id == User.id).scalar_subquery(),
+            follower_count=sa.select(sa.func.count(Follow.follower_id))
+            .where(Follow.followed_id == User.id).scalar_subquery(),
+            following_count=sa.select(sa.func.count(Follow.followed_id))
+            .where(Follow.follower_id == User.id).scalar_subquery(),
+        ).execution_options(synchronize_session=False))
+
     @staticmethod
     def add_self_follows():
         for user in User.query.all():
@@ -274,20 +380,50 @@ class User(UserMixin, db.Model):
                 db.session.add(user)
         db.session.commit()
 
+    @staticmethod
+    def version_stamp(password_hash: str, confirmed: bool, role_id: Optional[int]) -> str:
+        stamp = f'{password_hash}:{confirmed}:{role_id}'
+        return hashlib.sha256(stamp.encode()).hexdigest()[:16]
+
+    def token_version(self) -> str:
+        return User.version_stamp(self.password_hash, self.confirmed, self.role_id)
+
+    @staticmethod
+    def token_state(id: int) -> tuple[Optional[str], Optional[int]]:
+        """The version stamp and role permissions a token of user ``id`` must carry."""
+        row = db.session.execute(
+            sa.select(User.password_hash, User.confirmed, User.role_id, Role.permissions)
+            .outerjoin(Role, Role.id == User.role_id).where(User.id == id)).first()
+        if row is None:
+            return None, None
+        return User.version_stamp(row.password_hash, row.confirmed, row.role_id), row.permissions or 0
+
     def generate_auth_token(self):
         s = URLSafeTimedSerializer(secret_key=current_app.config['SECRET_KEY'])
-        return s.dumps({'id': self.id})
+        version = self.token_version()
+        permissions = self.role.permissions if self.role is not None else 0
+        token_versions().set(self.id, (version, permissions))
+        return s.dumps({'id': self.id,
+                        'role': self.role_id,
+                        'perm': permissions,
+                        'confirmed': self.confirmed,
+                        'ver': version})
 
     @staticmethod
-    def verify_auth_token(token: str | bytes, expiration: int = 3600):
+    def verify_auth_token(token: str | bytes, expiration: Optional[int] = None):
         s = URLSafeTimedSerializer(secret_key=current_app.config['SECRET_KEY'])
+        if expiration is None:
+            expiration = current_app.config['FLASKY_AUTH_TOKEN_EXPIRATION']
         try:
             data = s.loads(token.encode(), max_age=expiration)
+            user = TokenUser(data)
         except (SignatureExpired, BadSignature):
             return None
         except Exception:
             return None
-        return User.query.get(data['id'])
+        if not user.is_current():
+            return None
+        return user
 
     def to_json(self) -> dict:
         json_user = {
@@ -299,7 +435,7 @@ class User(UserMixin, db.Model):
             'posts_url': url_for('api.get_user_posts', id=self.id),
             'followed_posts_url': url_for('api.get_user_followed_posts',
                                           id=self.id),
-            'post_count': self.posts.count(),
+            'post_count': self.post_count,
         }
         return json_user
 
@@ -307,6 +443,10 @@ class User(UserMixin, db.Model):
         return f'<User "{self.username}">'
 
 
+event.listen(User, 'after_update', User.on_updated)
+event.listen(User, 'after_delete', User.on_deleted)
+
+
 class AnonymousUser(AnonymousUserMixin):
     def can(self, permissions: int) -> bool:
         return False
@@ -318,6 +458,42 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
+class TokenUser:
+    """The user named by an API token, built from its signed claims.
+
+    A token is current while its version stamp, derived from the user's
+    password hash, confirmation and role, and its permissions match the
+    database. Each worker caches what it read for
+    ``FLASKY_TOKEN_VERSIONS_TTL`` seconds, so a change made by another
+    worker revokes the token everywhere within that time; the worker that
+    made the change drops its entry at once. Deleted users have no stamp and
+    none of their tokens are current.
+    """
+    is_anonymous = False
+    is_authenticated = True
+
+    def __init__(self, claims: dict):
+        self.id = int(claims['id'])
+        self.role_id = claims['role']
+        self.permissions = int(claims['perm'])
+        self.confirmed = bool(claims['confirmed'])
+        self.version = claims['ver']
+
+    def is_current(self) -> bool:
+        versions = token_versions()
+        state = versions.get(self.id)
+        if state is None:
+            state = User.token_state(self.id)
+            versions.set(self.id, state)
+        return state == (self.version, self.permissions)
+
+    def can(self, perm: int) -> bool:
+        return self.permissions & perm == perm
+
+    def is_administrator(self) -> bool:
+        return self.can(Permissions.ADMIN.value)
+
+
 class Post(db.Model):
     __tablename__ = 'posts'
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
@@ -326,19 +502,37 @@ class Post(db.Model):
     timestamp: so.Mapped[datetime] = so.mapped_column(DateTime(timezone=True),
                                                       default=lambda: datetime.now(timezone.utc))
     author_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('users.id'))
+    comments_count: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
+    version: so.Mapped[int] = so.mapped_column(default=1, server_default='1',
+                                               onupdate=sa.text('version + 1'))
 
     comments: so.DynamicMapped['Comment'] = so.relationship('Comment', foreign_keys='Comment.post_id',
                                                             back_populates='post',
                                                             lazy='dynamic', cascade='all, delete-orphan')
 
+    __table_args__ = (
+        sa.Index('ix_posts_timestamp_id', 'timestamp', 'id'),
+        sa.Index('ix_posts_author_id_timestamp_id', 'author_id', 'timestamp', 'id'),
+    )
+
     @staticmethod
     def on_changed_body(target: 'Post', value: str, oldvalue: str, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
-                        'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-                        'h1', 'h2', 'h3', 'p']
-        target.html_body = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, strip=True))
+        render_body(target, value, POST_TAGS)
+
+    @staticmethod
+    def on_inserted(mapper, connection, target: 'Post'):
+        User.increment(connection, target.author_id, 'post_count')
+
+    @staticmethod
+    def on_deleted(mapper, connection, target: 'Post'):
+        User.increment(connection, target.author_id, 'post_count', delta=-1)
+
+    @staticmethod
+    def recount():
+        db.session.execute(sa.update(Post).values(
+            comments_count=sa.select(sa.func.count(Comment.id))
+            .where(Comment.post_id == Post.id).scalar_subquery(),
+        ).execution_options(synchronize_session=False))
 
     @staticmethod
     def from_json(json_post: dict) -> 'Post':
@@ -355,7 +549,7 @@ class Post(db.Model):
             'timestamp': self.timestamp,
             'author_url': url_for('api.get_user', id=self.author_id),
             'comments_url': url_for('api.get_comments', id=self.id),
-            'comments_count': self.comments.count()
+            'comments_count': self.comments_count
         }
         return json_post
 
@@ -364,6 +558,8 @@ class Post(db.Model):
 
 
 event.listen(Post.body, 'set', Post.on_changed_body)
+event.listen(Post, 'after_insert', Post.on_inserted)
+event.listen(Post, 'after_delete', Post.on_deleted)
 
 
 class Follow(db.Model):
@@ -376,10 +572,105 @@ class Follow(db.Model):
     follower: so.Mapped[User] = so.relationship(User, foreign_keys=[follower_id], back_populates='followed')
     followed: so.Mapped[User] = so.relationship(User, foreign_keys=[followed_id], back_populates='followers')
 
+    __table_args__ = (
+        sa.Index('ix_follows_followed_id_timestamp', 'followed_id', 'timestamp', 'follower_id'),
+        sa.Index('ix_follows_follower_id_timestamp', 'follower_id', 'timestamp', 'followed_id'),
+    )
+
+    @staticmethod
+    def on_inserted(mapper, connection, target: 'Follow'):
+        User.increment(connection, target.followed_id, 'follower_count')
+        User.increment(connection, target.follower_id, 'following_count')
+
+    @staticmethod
+    def on_deleted(mapper, connection, target: 'Follow'):
+        User.increment(connection, target.followed_id, 'follower_count', delta=-1)
+        User.increment(connection, target.follower_id, 'following_count', delta=-1)
+
     def __repr__(self):
         return f'<Follow "follower={self.follower_id} | followed={self.followed_id}">'
 
 
+event.listen(Follow, 'after_insert', Follow.on_inserted)
+event.listen(Follow, 'after_delete', Follow.on_deleted)
+
+
+class Timeline(db.Model):
+    __tablename__ = 'timeline'
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), primary_key=True)
+    post_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Post.id), primary_key=True)
+    timestamp: so.Mapped[datetime] = so.mapped_column(DateTime(timezone=True))
+
+    __table_args__ = (
+        sa.Index('ix_timeline_user_id_timestamp', 'user_id', 'timestamp', 'post_id'),
+    )
+
+    @staticmethod
+    def expected_entries():
+        return sa.select(Follow.follower_id, Post.id, Post.timestamp) \
+            .join(Follow, Follow.followed_id == Post.author_id)
+
+    @staticmethod
+    def on_post_inserted(mapper, connection, target: Post):
+        connection.execute(sa.insert(Timeline).from_select(
+            ['user_id', 'post_id', 'timestamp'],
+            Timeline.expected_entries().where(Post.id == target.id)))
+
+    @staticmethod
+    def on_post_deleted(mapper, connection, target: Post):
+        connection.execute(sa.delete(Timeline).where(Timeline.post_id == target.id))
+
+    @staticmethod
+    def on_follow_inserted(mapper, connection, target: Follow):
+        connection.execute(sa.insert(Timeline).from_select(
+            ['user_id', 'post_id', 'timestamp'],
+            sa.select(sa.literal(target.follower_id), Post.id, Post.timestamp)
+            .where(Post.author_id == target.followed_id)))
+
+    @staticmethod
+    def on_follow_deleted(mapper, connection, target: Follow):
+        connection.execute(sa.delete(Timeline).where(
+            Timeline.user_id == target.follower_id,
+            Timeline.post_id.in_(sa.select(Post.id).where(Post.author_id == target.followed_id))))
+
+    @staticmethod
+    def rebuild() -> int:
+        db.session.execute(sa.delete(Timeline))
+        result = db.session.execute(sa.insert(Timeline).from_select(
+            ['user_id', 'post_id', 'timestamp'], Timeline.expected_entries()))
+        db.session.commit()
+        return result.rowcount
+
+    @staticmethod
+    def check() -> dict[str, int]:
+        expected = Timeline.expected_entries().subquery()
+        missing = sa.select(sa.func.count()).select_from(expected).outerjoin(
+            Timeline, sa.and_(Timeline.user_id == expected.c.follower_id,
+                              Timeline.post_id == expected.c.id)
+        ).where(Timeline.post_id.is_(None))
+        extra = sa.select(sa.func.count()).select_from(Timeline).outerjoin(
+            expected, sa.and_(Timeline.user_id == expected.c.follower_id,
+                              Timeline.post_id == expected.c.id)
+        ).where(expected.c.id.is_(None))
+        stale = sa.select(sa.func.count()).select_from(Timeline).join(
+            Post, Post.id == Timeline.post_id
+        ).where(Timeline.timestamp != Post.timestamp)
+        return {
+            'missing': db.session.scalar(missing),
+            'extra': db.session.scalar(extra),
+            'stale': db.session.scalar(stale),
+        }
+
+    def __repr__(self):
+        return f'<Timeline "user={self.user_id} | post={self.post_id}">'
+
+
+event.listen(Post, 'after_insert', Timeline.on_post_inserted)
+event.listen(Post, 'before_delete', Timeline.on_post_deleted)
+event.listen(Follow, 'after_insert', Timeline.on_follow_inserted)
+event.listen(Follow, 'after_delete', Timeline.on_follow_deleted)
+
+
 class Comment(db.Model):
     __tablename__ = 'comments'
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
@@ -388,19 +679,34 @@ class Comment(db.Model):
     timestamp: so.Mapped[datetime] = so.mapped_column(DateTime(timezone=True),
                                                       default=lambda: datetime.now(timezone.utc))
     disabled: so.Mapped[bool] = so.mapped_column(default=False)
+    version: so.Mapped[int] = so.mapped_column(default=1, server_default='1',
+                                               onupdate=sa.text('version + 1'))
     author_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id))
     post_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Post.id))
 
     author: so.Mapped[User] = so.relationship(User, foreign_keys=author_id, back_populates='comments')
     post: so.Mapped[Post] = so.relationship(Post, foreign_keys=post_id, back_populates='comments')
 
+    __table_args__ = (
+        sa.Index('ix_comments_timestamp_id', 'timestamp', 'id'),
+        sa.Index('ix_comments_post_id_timestamp_id', 'post_id', 'timestamp', 'id'),
+    )
+
     @staticmethod
     def on_change_body(target: 'Comment', value: str, oldvalue: str, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong']
-        target.html_body = bleach.linkify(
-            bleach.clean(markdown(
-                value, output_format='html'
-            ), tags=allowed_tags, strip=True))
+        render_body(target, value, COMMENT_TAGS)
+
+    @staticmethod
+    def on_inserted(mapper, connection, target: 'Comment'):
+        User.increment(connection, target.author_id, 'comment_count')
+        connection.execute(sa.update(Post).where(Post.id == target.post_id).values(
+            comments_count=Post.comments_count + 1))
+
+    @staticmethod
+    def on_deleted(mapper, connection, target: 'Comment'):
+        User.increment(connection, target.author_id, 'comment_count', delta=-1)
+        connection.execute(sa.update(Post).where(Post.id == target.post_id).values(
+            comments_count=Post.comments_count - 1))
 
     def to_json(self) -> dict:
         json_comment = {
@@ -425,3 +731,56 @@ class Comment(db.Model):
 
 
 event.listen(Comment.body, 'set', Comment.on_change_body)
+event.listen(Comment, 'after_insert', Comment.on_inserted)
+event.listen(Comment, 'after_delete', Comment.on_deleted)
+
+
+class Outbox(db.Model):
+    __tablename__ = 'outbox'
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    recipient: so.Mapped[str] = so.mapped_column(sa.String(64))
+    subject: so.Mapped[str] = so.mapped_column(sa.String(128))
+    body: so.Mapped[str] = so.mapped_column(sa.Text)
+    html: so.Mapped[str] = so.mapped_column(sa.Text)
+    timestamp: so.Mapped[datetime] = so.mapped_column(DateTime(timezone=True),
+                                                      default=lambda: datetime.now(timezone.utc))
+    attempts: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
+    sent_at: so.Mapped[Optional[datetime]] = so.mapped_column(DateTime(timezone=True))
+    last_error: so.Mapped[Optional[str]] = so.mapped_column(sa.Text)
+    retry_at: so.Mapped[Optional[datetime]] = so.mapped_column(DateTime(timezone=True))
+
+    __table_args__ = (
+        sa.Index('ix_outbox_sent_at_id', 'sent_at', 'id'),
+    )
+
+    @staticmethod
+    def claim(batch_size: int) -> list['Outbox']:
+        return db.session.scalars(
+            sa.select(Outbox)
+            .where(Outbox.sent_at.is_(None),
+                   Outbox.attempts < current_app.config['FLASKY_MAIL_MAX_ATTEMPTS'],
+                   sa.or_(Outbox.retry_at.is_(None), Outbox.retry_at <= datetime.now(timezone.utc)))
+            .order_by(Outbox.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)).all()
+
+    @staticmethod
+    def pending_count() -> int:
+        return db.session.scalar(sa.select(sa.func.count(Outbox.id)).where(Outbox.sent_at.is_(None)))
+
+    def failed(self, error: Exception):
+        # back off exponentially, so a bad message or a down server isn't claimed again at once
+        self.attempts += 1
+        self.last_error = str(error)
+        self.retry_at = datetime.now(timezone.utc) + \
+            timedelta(seconds=current_app.config['FLASKY_MAIL_RETRY_DELAY'] * 2 ** (self.attempts - 1))
+
+    def to_message(self) -> Message:
+        msg = Message(self.subject, sender=current_app.config['FLASKY_MAIL_SENDER'],
+                      recipients=[self.recipient])
+        msg.body = self.body
+        msg.html = self.html
+        return msg
+
+    def __repr__(self):
+        return f'<Outbox "{self.id}">'
@@ -0,0 +1,105 @@
+import threading
+from itertools import chain
+from typing import Callable
+
+import sqlalchemy.orm as so
+from flask import Flask, Response, current_app, g, has_app_context, request, session
+from sqlalchemy import event
+
+from .caching import get_cache
+
+
+def cached_page(*tags: str) -> Callable:
+    """Mark a view as cacheable for anonymous visitors.
+
+    ``tags`` are the table names the page is built from; a commit touching
+    any of them invalidates the cached copies.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        func.page_cache_tags = tags
+        return func
+
+    return decorator
+
+
+class PageCache:
+    """Full-page cache for anonymous GET requests.
+
+    Enabled with ``FLASKY_PAGE_CACHE``. Pages are served from a
+    ``before_request`` hook registered ahead of every other one, keyed by
+    host, scheme, path and query string plus the generation of each tag of
+    the page. Committing a change to a tagged table bumps its generation.
+    Requests carrying a session or remember cookie are never cached, and
+    neither are responses that set a cookie or touch the session.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.cache = get_cache('pages', app.config['FLASKY_PAGE_CACHE_SIZE'],
+                               app.config['FLASKY_PAGE_CACHE_TTL'], app=app)
+        self._generations = {}
+        self._lock = threading.Lock()
+        app.before_request(self.serve)
+        app.after_request(self.store)
+
+    def invalidate(self, *tags: str):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def _key(self, tags: tuple) -> tuple:
+        generations = tuple(self._generations.get(tag, 0) for tag in tags)
+        return request.host, request.scheme, request.full_path, generations
+
+    def _bypass(self) -> bool:
+        config = self.app.config
+        return request.method not in ('GET', 'HEAD') or \
+            config['SESSION_COOKIE_NAME'] in request.cookies or \
+            config.get('REMEMBER_COOKIE_NAME', 'remember_token') in request.cookies
+
+    def serve(self):
+        if not self.app.config['FLASKY_PAGE_CACHE']:
+            return None
+        view = self.app.view_functions.get(request.endpoint)
+        tags = getattr(view, 'page_cache_tags', None)
+        if tags is None or self._bypass():
+            return None
+        key = self._key(tags)
+        entry = self.cache.get(key)
+        if entry is None:
+            g.page_cache_key = key
+            return None
+        status, headers, body = entry
+        return Response(body, status, headers)
+
+    def store(self, response: Response) -> Response:
+        key = g.pop('page_cache_key', None)
+        if key is None or response.status_code != 200 or response.is_streamed or \
+                response.direct_passthrough or 'Set-Cookie' in response.headers or session.modified:
+            return response
+        self.cache.set(key, (response.status_code, list(response.headers.items()), response.get_data()))
+        return response
+
+
+def page_cache() -> PageCache:
+    return current_app.extensions['page_cache']
+
+
+@event.listens_for(so.Session, 'after_flush')
+def collect_page_tags(session: so.Session, flush_context):
+    tags = session.info.setdefault('page_tags', set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        tags.add(obj.__tablename__)
+
+
+@event.listens_for(so.Session, 'after_commit')
+def invalidate_pages(session: so.Session):
+    tags = session.info.pop('page_tags', None)
+    if tags and has_app_context() and 'page_cache' in current_app.extensions:
+        page_cache().invalidate(*tags)
+
+
+@event.listens_for(so.Session, 'after_rollback')
+def discard_page_tags(session: so.Session):
+    session.info.pop('page_tags', None)
@@ -0,0 +1,161 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Callable, Optional
+
+import sqlalchemy as sa
+from flask import abort, request
+
+CURSOR_ARGS = ('page', 'before', 'after')
+
+
+def default_key(item) -> tuple:
+    return item.timestamp, item.id
+
+
+def encode_cursor(key: tuple) -> str:
+    timestamp, id = key
+    raw = json.dumps([timestamp.isoformat(), id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode((token + '=' * (-len(token) % 4)).encode())
+        timestamp, id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(id)
+    except (ValueError, TypeError, binascii.Error):
+        abort(400)
+
+
+def request_page_args() -> dict:
+    return {arg: request.args[arg] for arg in CURSOR_ARGS if arg in request.args}
+
+
+class KeysetPagination:
+    """Paginate on a ``(timestamp, id)`` key instead of an OFFSET.
+
+    ``before`` and ``after`` are opaque cursors naming the first and last row
+    of the neighbouring page, so every page is a single indexed range scan
+    no matter how deep it is. The total is only counted when it is read.
+    """
+
+    def __init__(self, query, columns: tuple, per_page: int,
+                 key: Optional[Callable] = None, before: Optional[str] = None,
+                 after: Optional[str] = None, ascending: bool = False,
+                 last: bool = False):
+        self._query = query
+        self._key = key or default_key
+        self._total = None
+        self.per_page = per_page
+        self.before = before
+        self.after = after
+        self.last = last
+
+        backwards = before is not None or last
+        keys = sa.tuple_(*columns)
+        if after is not None:
+            cursor = self._cursor_values(columns, after)
+            query = query.filter(keys > cursor if ascending else keys < cursor)
+        elif before is not None:
+            cursor = self._cursor_values(columns, before)
+            query = query.filter(keys < cursor if ascending else keys > cursor)
+        fetch_ascending = ascending != backwards
+        query = query.order_by(*[column.asc() if fetch_ascending else column.desc()
+                                 for column in columns])
+        items = query.limit(per_page + 1).all()
+        more = len(items) > per_page
+        items = items[:per_page]
+        if backwards:
+            items.reverse()
+            self.has_prev = more
+            self.has_next = before is not None and bool(items)
+        else:
+            self.has_prev = after is not None and bool(items)
+            self.has_next = more
+        self.items = items
+
+    @staticmethod
+    def _cursor_values(columns: tuple, token: str):
+        return sa.tuple_(*[sa.literal(value, type_=column.type)
+                           for column, value in zip(columns, decode_cursor(token))])
+
+    @property
+    def prev_cursor(self) -> Optional[str]:
+        return encode_cursor(self._key(self.items[0])) if self.has_prev else None
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        return encode_cursor(self._key(self.items[-1])) if self.has_next else None
+
+    @property
+    def prev_args(self) -> dict:
+        return {'before': self.prev_cursor}
+
+    @property
+    def next_args(self) -> dict:
+        return {'after': self.next_cursor}
+
+    @property
+    def page_args(self) -> dict:
+        if self.after is not None:
+            return {'after': self.after}
+        if self.before is not None:
+            return {'before': self.before}
+        if self.last:
+            return {'page': -1}
+        return {}
+
+    @property
+    def total(self) -> int:
+        if self._total is None:
+            self._total = self._query.order_by(None).count()
+        return self._total
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class OffsetPagination:
+    """Classic page-number pagination, kept for ``?page=N`` links."""
+
+    def __init__(self, query, columns: tuple, page: int, per_page: int, ascending: bool = False):
+        self._pagination = query.order_by(
+            *[column.asc() if ascending else column.desc() for column in columns]
+        ).paginate(page=page, per_page=per_page, error_out=False)
+
+    def __getattr__(self, name):
+        return getattr(self._pagination, name)
+
+    def __iter__(self):
+        return iter(self._pagination.items)
+
+    @property
+    def prev_args(self) -> dict:
+        return {'page': self.page - 1}
+
+    @property
+    def next_args(self) -> dict:
+        return {'page': self.page + 1}
+
+    @property
+    def page_args(self) -> dict:
+        return {'page': self.page}
+
+
+def paginate(query, *columns, per_page: int, key: Optional[Callable] = None,
+             ascending: bool = False):
+    """Paginate ``query`` ordered by ``columns`` (a timestamp and a unique id).
+
+    Requests carrying ``before``/``after`` cursors, or no pagination argument
+    at all, are served with keyset pagination. ``page=-1`` selects the last
+    page, any other ``page`` number falls back to OFFSET pagination.
+    """
+    page = request.args.get('page', type=int)
+    if page is not None and page != -1:
+        return OffsetPagination(query, columns, page, per_page, ascending=ascending)
+    return KeysetPagination(query, columns, per_page, key=key,
+                            before=request.args.get('before'),
+                            after=request.args.get('after'),
+                            ascending=ascending, last=page == -1)
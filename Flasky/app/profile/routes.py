@@ -1,4 +1,5 @@
-from flask import url_for, redirect, render_template, flash, current_app, request
+import sqlalchemy.orm as so
+from flask import url_for, redirect, render_template, flash, current_app
 from flask_login import current_user, login_required
 
 from . import bp
@@ -6,15 +7,16 @@ from .forms import EditProfileForm, EditProfileAdminForm
 from .. import db
 from ..decorators import admin_required, permission_required
 from ..models import User, Role, Post, Permissions, Follow
+from ..pagecache import cached_page
+from ..pagination import paginate
 
 
 @bp.route('/user/<username>')
+@cached_page('users', 'posts', 'comments', 'follows')
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(user.posts, Post.timestamp, Post.id,
+                          per_page=current_app.config['FLASKY_POSTS_PER_PAGE'])
     posts = pagination.items
     return render_template('profile/user.html', user=user, posts=posts,
                            pagination=pagination)
@@ -105,11 +107,10 @@ def followers(username: str):
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('main.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = Follow.query.filter_by(followed_id=user.id).paginate(page=page,
-                                                                      per_page=current_app.config[
-                                                                          'FLASKY_FOLLOWERS_PER_PAGE'],
-                                                                      error_out=False)
+    pagination = paginate(Follow.query.filter_by(followed_id=user.id).options(so.joinedload(Follow.follower)),
+                          Follow.timestamp, Follow.follower_id,
+                          per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
+                          key=lambda follow: (follow.timestamp, follow.follower_id))
     follows = [{'user': item.follower, 'timestamp': item.timestamp}
                for item in pagination.items]
     return render_template('profile/followers.html', user=user, title='Followers of',
@@ -122,11 +123,10 @@ def followed_by(username):
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = Follow.query.filter_by(follower_id=user.id).paginate(page=page,
-                                                                      per_page=current_app.config[
-                                                                          'FLASKY_FOLLOWERS_PER_PAGE'],
-                                                                      error_out=False)
+    pagination = paginate(Follow.query.filter_by(follower_id=user.id).options(so.joinedload(Follow.followed)),
+                          Follow.timestamp, Follow.followed_id,
+                          per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
+                          key=lambda follow: (follow.timestamp, follow.followed_id))
     follows = [{'user': item.followed, 'timestamp': item.timestamp}
                for item in pagination.items]
     return render_template('profile/followers.html', user=user, title="Followed by",
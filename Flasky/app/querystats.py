@@ -0,0 +1,248 @@
+import atexit
+import glob
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from flask import Flask, current_app, g, has_request_context
+from sqlalchemy import event
+
+from . import db
+
+_profilers = weakref.WeakSet()
+
+LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\bIN \(\?(?:, \?)*\)', re.IGNORECASE), 'IN (...)'),
+    (re.compile(r'(\(\?(?:, \?)*\))(?:, \1)+'), r'\1, ...'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(statement: str) -> str:
+    """Normalize a statement so every execution of the same query shares a key."""
+    for pattern, replacement in LITERALS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class QueryStats:
+    """Counters of one fingerprint plus a bounded reservoir of durations."""
+
+    __slots__ = ('count', 'total', 'max', 'samples')
+
+    def __init__(self, count: int = 0, total: float = 0.0, max: float = 0.0,
+                 samples: Optional[list] = None):
+        self.count = count
+        self.total = total
+        self.max = max
+        self.samples = samples or []
+
+    def add(self, duration: float, reservoir: int):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        if len(self.samples) < reservoir:
+            self.samples.append(duration)
+        else:
+            slot = random.randrange(self.count)
+            if slot < reservoir:
+                self.samples[slot] = duration
+
+    def merge(self, other: 'QueryStats', reservoir: int):
+        samples = self.samples + other.samples
+        if len(samples) > reservoir:
+            # weigh each side's durations by the number of executions they stand for
+            weights = [self.count / len(self.samples)] * len(self.samples) + \
+                [other.count / len(other.samples)] * len(other.samples)
+            samples = random.choices(samples, weights=weights, k=reservoir)
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.samples = samples
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'total': self.total, 'max': self.max, 'samples': self.samples}
+
+
+class QueryProfiler:
+    """Times executed statements and aggregates a sample of them by fingerprint.
+
+    Every statement is timed, which costs two clock reads, and the ones that
+    take ``FLASKY_SLOW_DB_QUERY_TIME`` seconds or more are logged. A
+    ``FLASKY_QUERY_SAMPLE_RATE`` fraction of them is also profiled; with no
+    rate, slow query time or metrics no listener is attached at all. The
+    hook is the dialect's ``do_execute`` rather than the cursor execute
+    events, which make SQLAlchemy take a slower path for every statement.
+    With ``FLASKY_METRICS`` every statement is added to the request's
+    ``g.db_time`` and ``g.db_queries``. At most ``FLASKY_QUERY_PROFILE_SIZE``
+    fingerprints are kept, least recently seen first out, each with
+    ``FLASKY_QUERY_PROFILE_RESERVOIR`` durations for the percentiles. Every
+    ``FLASKY_QUERY_PROFILE_INTERVAL`` seconds, and at exit, a process that
+    has served requests writes its numbers to ``queries-<pid>.json`` in
+    ``FLASKY_QUERY_PROFILE_DIR`` so ``flask queries`` can merge all workers;
+    CLI commands never write one.
+    """
+
+    def __init__(self, app: Flask):
+        # engine listeners outlive requests, so keep no reference to the app itself
+        self.config = app.config
+        self.logger = app.logger
+        self.rate = app.config['FLASKY_QUERY_SAMPLE_RATE']
+        self.per_request = app.config['FLASKY_METRICS']
+        self.slow = app.config['FLASKY_SLOW_DB_QUERY_TIME']
+        self.directory = app.config['FLASKY_QUERY_PROFILE_DIR'] or \
+            os.path.join(app.instance_path, 'query-profiles')
+        self._stats = OrderedDict()
+        self._last_dump = time.monotonic()
+        self._lock = threading.Lock()
+        # only processes that serve requests write snapshots, not CLI commands
+        self.serving = False
+        if self.rate > 0 or self.per_request or self.slow:
+            with app.app_context():
+                engines = list(db.engines.values())
+            if 'sqlite_writer' in app.extensions:
+                engines.append(app.extensions['sqlite_writer'])
+            for engine in engines:
+                event.listen(engine, 'do_execute', self._execute)
+                event.listen(engine, 'do_executemany', self._executemany)
+            _profilers.add(self)
+
+    def _execute(self, cursor, statement, parameters, context):
+        start = time.perf_counter()
+        context.dialect.do_execute(cursor, statement, parameters, context)
+        self._timed(statement, time.perf_counter() - start, parameters)
+        return True
+
+    def _executemany(self, cursor, statement, parameters, context):
+        start = time.perf_counter()
+        context.dialect.do_executemany(cursor, statement, parameters, context)
+        self._timed(statement, time.perf_counter() - start, None)
+        return True
+
+    def _timed(self, statement: str, duration: float, parameters):
+        if has_request_context():
+            self.serving = True
+            if self.per_request:
+                g.db_time = g.get('db_time', 0.0) + duration
+                g.db_queries = g.get('db_queries', 0) + 1
+        if self.slow and duration >= self.slow:
+            self.logger.warning('Slow query: %s\nParameters: %s\nDuration: %fs\n',
+                                statement, parameters, duration)
+        if random.random() < self.rate:
+            self.record(statement, duration)
+
+    def record(self, statement: str, duration: float):
+        config = self.config
+        key = fingerprint(statement)
+        now = time.monotonic()
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = QueryStats()
+                while len(self._stats) > config['FLASKY_QUERY_PROFILE_SIZE']:
+                    self._stats.popitem(last=False)
+            else:
+                self._stats.move_to_end(key)
+            stats.add(duration, config['FLASKY_QUERY_PROFILE_RESERVOIR'])
+            due = now - self._last_dump >= config['FLASKY_QUERY_PROFILE_INTERVAL']
+            if due:
+                self._last_dump = now
+        if due and self.serving:
+            self.dump()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'rate': self.rate,
+                    'queries': {key: stats.to_dict() for key, stats in self._stats.items()}}
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f'queries-{os.getpid()}.json')
+
+    def dump(self):
+        data = self.snapshot()
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+        for path in glob.glob(os.path.join(self.directory, 'queries-*.json')):
+            os.remove(path)
+
+    def report(self, sort: str = 'total', limit: Optional[int] = None) -> dict:
+        """Merge the snapshots of every process into one report."""
+        snapshots = [self.snapshot()] if self._stats else []
+        for path in glob.glob(os.path.join(self.directory, 'queries-*.json')):
+            if path == self.path:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        rows = sorted(merge(snapshots, self.config['FLASKY_QUERY_PROFILE_RESERVOIR']),
+                      key=lambda row: row[sort], reverse=True)
+        return {'processes': len(snapshots), 'queries': rows[:limit]}
+
+
+def merge(snapshots: Iterable[dict], reservoir: int) -> list[dict]:
+    """Add up per-process snapshots, scaling sampled counts back to executions."""
+    merged = {}
+    calls = {}
+    for snapshot in snapshots:
+        rate = snapshot['rate'] or 1.0
+        for key, data in snapshot['queries'].items():
+            stats = QueryStats(**data)
+            calls[key] = calls.get(key, 0.0) + stats.count / rate
+            if key in merged:
+                merged[key].merge(stats, reservoir)
+            else:
+                merged[key] = stats
+    return [{
+        'fingerprint': key,
+        'calls': round(calls[key]),
+        'samples': stats.count,
+        'total': stats.total / stats.count * calls[key],
+        'mean': stats.total / stats.count,
+        'p50': percentile(stats.samples, 0.50),
+        'p95': percentile(stats.samples, 0.95),
+        'p99': percentile(stats.samples, 0.99),
+        'max': stats.max,
+    } for key, stats in merged.items()]
+
+
+def query_profiler() -> QueryProfiler:
+    return current_app.extensions['query_profiler']
+
+
+@atexit.register
+def dump_all():
+    for profiler in list(_profilers):
+        if not profiler.serving or not profiler._stats:
+            continue
+        try:
+            profiler.dump()
+        except OSError:
+            pass
@@ -0,0 +1,209 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from bleach.linkifier import LinkifyFilter
+from bleach.sanitizer import Cleaner
+from flask import Flask, current_app, has_app_context
+from markdown import Markdown
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+from .caching import get_cache
+from .sqlite import write_engine
+
+
+POST_TAGS = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
+             'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
+             'h1', 'h2', 'h3', 'p']
+COMMENT_TAGS = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong']
+
+_local = threading.local()
+
+
+class RenderEngine:
+    """A Markdown converter and a linkifying sanitizer for one tag profile.
+
+    Sanitizing and linkifying share a single HTML parse. Instances are not
+    thread-safe, use ``engine()`` to get the one owned by the current thread.
+    """
+
+    def __init__(self, tags: list[str]):
+        self.markdown = Markdown(output_format='html')
+        self.cleaner = Cleaner(tags=frozenset(tags), strip=True, filters=[LinkifyFilter])
+
+    def render(self, value: str) -> str:
+        return self.cleaner.clean(self.markdown.reset().convert(value))
+
+
+def engine(tags: list[str]) -> RenderEngine:
+    engines = getattr(_local, 'engines', None)
+    if engines is None:
+        engines = _local.engines = {}
+    profile = tuple(tags)
+    render_engine = engines.get(profile)
+    if render_engine is None:
+        render_engine = engines[profile] = RenderEngine(tags)
+    return render_engine
+
+
+def render_markdown(value: str, tags: list[str]) -> str:
+    return engine(tags).render(value)
+
+
+def render_key(value: str, tags: list[str]) -> str:
+    digest = hashlib.sha256(' '.join(sorted(tags)).encode())
+    digest.update(b'\0')
+    digest.update(value.encode())
+    return digest.hexdigest()
+
+
+class Renderer:
+    """Renders ``html_body`` for posts and comments, optionally off the request.
+
+    With ``FLASKY_ASYNC_RENDER`` enabled the body is stored with an empty
+    ``html_body`` and rendered by a pool of ``FLASKY_RENDER_WORKERS`` threads
+    once the transaction commits. When ``FLASKY_RENDER_QUEUE_SIZE`` jobs are
+    already waiting the committing thread renders the body itself.
+
+    Rendered HTML is cached under a hash of the body and its allowed tags,
+    so identical bodies are only rendered once and changing a tag list
+    simply stops matching the old entries.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.enabled = app.config['FLASKY_ASYNC_RENDER']
+        self.max_queue = app.config['FLASKY_RENDER_QUEUE_SIZE']
+        self.cache = get_cache('render', app.config['FLASKY_RENDER_CACHE_SIZE'], app=app)
+        self.rendered = 0
+        self.inline = 0
+        self.failed = 0
+        self.render_time = 0.0
+        self.max_render_time = 0.0
+        self._depth = 0
+        self._executor = None
+        self._idle = threading.Condition()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._depth
+
+    def render(self, value: str, tags: list[str]) -> str:
+        key = render_key(value, tags)
+        html = self.cache.get(key)
+        if html is not None:
+            return html
+        start = time.perf_counter()
+        html = render_markdown(value, tags)
+        elapsed = time.perf_counter() - start
+        self.cache.set(key, html)
+        with self._idle:
+            self.rendered += 1
+            self.render_time += elapsed
+            self.max_render_time = max(self.max_render_time, elapsed)
+        return html
+
+    def set_body(self, target, value: str, tags: list[str]):
+        if not self.enabled:
+            target.html_body = self.render(value, tags)
+            return
+        html = self.cache.get(render_key(value, tags))
+        if html is not None:
+            target.html_body = html
+            target.__dict__.pop('_render_tags', None)
+            return
+        target.html_body = ''
+        target._render_tags = tags
+
+    def submit(self, jobs: list):
+        for job in jobs:
+            with self._idle:
+                queued = self._depth < self.max_queue
+                if queued:
+                    self._depth += 1
+                else:
+                    self.inline += 1
+            if not queued:
+                self.run(*job)
+                continue
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.app.config['FLASKY_RENDER_WORKERS'],
+                                                    thread_name_prefix='render')
+            self._executor.submit(self._work, job)
+
+    def _work(self, job: tuple):
+        try:
+            self.run(*job)
+        finally:
+            with self._idle:
+                self._depth -= 1
+                self._idle.notify_all()
+
+    def run(self, table: sa.Table, id: int, body: str, tags: list[str]):
+        try:
+            html = self.render(body, tags)
+            with self.app.app_context():
+                with (write_engine() or db.engine).begin() as connection:
+                    connection.execute(sa.update(table).where(table.c.id == id, table.c.body == body)
+                                       .values(html_body=html, version=table.c.version + 1))
+            if 'page_cache' in self.app.extensions:
+                self.app.extensions['page_cache'].invalidate(table.name)
+        except (SQLAlchemyError, ValueError):
+            with self._idle:
+                self.failed += 1
+            self.app.logger.exception('Could not render %s %d', table.name, id)
+
+    def join(self, timeout: float | None = None) -> bool:
+        with self._idle:
+            return self._idle.wait_for(lambda: self._depth == 0, timeout)
+
+    def stats(self) -> dict:
+        return {
+            'async': self.enabled,
+            'queue_depth': self._depth,
+            'max_queue': self.max_queue,
+            'rendered': self.rendered,
+            'inline': self.inline,
+            'failed': self.failed,
+            'render_time': self.render_time,
+            'max_render_time': self.max_render_time,
+            'avg_render_time': self.render_time / self.rendered if self.rendered else 0.0,
+            'cache': self.cache.stats(),
+        }
+
+
+def renderer() -> Renderer:
+    return current_app.extensions['renderer']
+
+
+def render_body(target, value: str, tags: list[str]):
+    if has_app_context():
+        renderer().set_body(target, value, tags)
+    else:
+        target.html_body = render_markdown(value, tags)
+
+
+@event.listens_for(so.Session, 'after_flush')
+def collect_render_jobs(session: so.Session, flush_context):
+    for obj in list(session.new) + list(session.dirty):
+        tags = obj.__dict__.pop('_render_tags', None)
+        if tags is not None:
+            session.info.setdefault('render_jobs', []).append(
+                (obj.__table__, obj.id, obj.body, tags))
+
+
+@event.listens_for(so.Session, 'after_commit')
+def submit_render_jobs(session: so.Session):
+    jobs = session.info.pop('render_jobs', None)
+    if jobs and has_app_context():
+        renderer().submit(jobs)
+
+
+@event.listens_for(so.Session, 'after_rollback')
+def discard_render_jobs(session: so.Session):
+    session.info.pop('render_jobs', None)
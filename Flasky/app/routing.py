@@ -0,0 +1,81 @@
+import random
+import time
+
+import sqlalchemy as sa
+from flask import current_app, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+from .sqlite import write_engine
+
+STICKY_KEY = '_primary_until'
+
+
+def replica_keys() -> list[str]:
+    return [key for key in current_app.config['SQLALCHEMY_BINDS'] if key.startswith('replica')]
+
+
+def reads_from_replica() -> bool:
+    if not has_request_context() or request.method not in ('GET', 'HEAD'):
+        return False
+    return session.get(STICKY_KEY, 0) < time.time()
+
+
+class RoutingSession(Session):
+    """Send the reads of GET requests to a replica and everything else to the primary.
+
+    Replicas are the ``replicaN`` binds built from ``FLASKY_REPLICA_URIS``.
+    Flushes and DML always use the primary, and so does the rest of a
+    transaction once it has written. After a commit that wrote something
+    the user's session sticks to the primary for
+    ``FLASKY_REPLICA_STICKY_SECONDS`` so they read their own writes.
+
+    When SQLite tuning opened a writer engine, flushes, DML and whatever
+    follows them in the transaction use it instead of the primary.
+    """
+
+    def start_writing(self):
+        """Route the rest of the transaction as if it had written already, so
+        reads that a later write depends on share the writer's connection."""
+        self.info['wrote'] = True
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if isinstance(clause, sa.sql.dml.UpdateBase):
+            self.info['wrote'] = True
+        if bind is None:
+            if self.info.get('flushing') or self.info.get('wrote'):
+                writer = write_engine()
+                if writer is not None:
+                    return writer
+            elif reads_from_replica():
+                keys = replica_keys()
+                if keys:
+                    return self._db.engines[random.choice(keys)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def mark_flushing(db_session: RoutingSession, flush_context, instances):
+    db_session.info['flushing'] = True
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def mark_written(db_session: RoutingSession, flush_context):
+    db_session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_flush_postexec')
+def end_flushing(db_session: RoutingSession, flush_context):
+    db_session.info.pop('flushing', None)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def stick_to_primary(db_session: RoutingSession):
+    if db_session.info.pop('wrote', False) and has_request_context() and replica_keys():
+        session[STICKY_KEY] = time.time() + current_app.config['FLASKY_REPLICA_STICKY_SECONDS']
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_written(db_session: RoutingSession):
+    db_session.info.pop('wrote', None)
+    db_session.info.pop('flushing', None)
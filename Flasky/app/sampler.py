@@ -0,0 +1,232 @@
+import atexit
+import glob
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from collections import Counter
+
+from flask import Flask, current_app, g, request
+from flask_login import current_user
+
+_samplers = weakref.WeakSet()
+
+
+def frame_label(code, module: str) -> str:
+    return f'{module}:{code.co_qualname}'
+
+
+class StackSampler:
+    """Samples the stacks of selected requests into collapsed-stack files.
+
+    A request is profiled when an administrator sends the
+    ``FLASKY_PROFILE_HEADER`` header, for one request in
+    ``FLASKY_PROFILE_SAMPLE_EVERY`` when that is set, or for every request
+    while a profiling window opened with ``flask profile-window`` or
+    ``POST /admin/profile`` is running. While profiled requests are in
+    flight a daemon thread reads their stacks from ``sys._current_frames()``
+    every ``FLASKY_PROFILE_INTERVAL`` seconds; it exits when none are left,
+    so requests that are not profiled only pay for the checks above.
+
+    Whether the sender of the header is an administrator is only known once
+    the request has been authenticated, by session cookie or by the API's
+    credentials, so such a request is sampled on approval: its stacks are
+    kept apart and only added to the endpoint's when it ends and the user
+    turns out to be an administrator.
+
+    Samples are written to ``<endpoint>-<pid>.folded`` in
+    ``FLASKY_PROFILE_DIR``, one ``frame;frame;frame count`` line per stack,
+    the input format of ``flamegraph.pl`` and speedscope.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.directory = app.config['FLASKY_PROFILE_DIR'] or os.path.join(app.instance_path, 'profiles')
+        self.samples = {}
+        self._active = {}
+        self._unapproved = {}
+        self._labels = {}
+        self._window_until = 0.0
+        self._window_checked = 0.0
+        self._thread = None
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        app.before_request(self.start_request)
+        app.teardown_request(self.end_request)
+        _samplers.add(self)
+
+    @property
+    def window_path(self) -> str:
+        return os.path.join(self.directory, 'window')
+
+    def open_window(self, seconds: float) -> float:
+        """Profile every request of every worker for the next ``seconds``,
+        at most ``FLASKY_PROFILE_MAX_WINDOW``."""
+        until = time.time() + min(seconds, self.app.config['FLASKY_PROFILE_MAX_WINDOW'])
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(until))
+        os.replace(tmp, self.window_path)
+        self._window_checked = 0.0
+        return until
+
+    def window_until(self) -> float:
+        # every worker re-reads the shared window file at most once a second
+        now = time.monotonic()
+        if now - self._window_checked >= 1.0:
+            self._window_checked = now
+            try:
+                with open(self.window_path) as f:
+                    self._window_until = float(f.read())
+            except (OSError, ValueError):
+                self._window_until = 0.0
+        return self._window_until
+
+    def wanted(self) -> bool:
+        every = self.app.config['FLASKY_PROFILE_SAMPLE_EVERY']
+        if every and random.randrange(every) == 0:
+            return True
+        return self.window_until() > time.time()
+
+    @staticmethod
+    def requested_by_administrator() -> bool:
+        # g.current_user is set before the API checks the password, flask_httpauth_user only after
+        user = g.current_user if g.get('flask_httpauth_user') is not None else current_user
+        return user.is_authenticated and user.is_administrator()
+
+    def start_request(self):
+        if request.endpoint is None:
+            return
+        ident = threading.get_ident()
+        if self.wanted():
+            unapproved = None
+        elif self.app.config['FLASKY_PROFILE_HEADER'] in request.headers:
+            unapproved = Counter()
+        else:
+            return
+        with self._lock:
+            self._active[ident] = request.endpoint
+            if unapproved is not None:
+                self._unapproved[ident] = unapproved
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='stack-sampler')
+                self._thread.start()
+
+    def end_request(self, exc=None):
+        if not self._active:
+            return
+        ident = threading.get_ident()
+        with self._lock:
+            endpoint = self._active.pop(ident, None)
+            unapproved = self._unapproved.pop(ident, None)
+        if unapproved and self.requested_by_administrator():
+            with self._lock:
+                self.samples.setdefault(endpoint, Counter()).update(unapproved)
+
+    def _run(self):
+        interval = self.app.config['FLASKY_PROFILE_INTERVAL']
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    break
+                active = dict(self._active)
+            frames = sys._current_frames()
+            for ident, endpoint in active.items():
+                frame = frames.get(ident)
+                if frame is not None and ident != me:
+                    self._add(ident, endpoint, self._collapse(frame))
+            del frames
+            if time.monotonic() - self._last_flush >= self.app.config['FLASKY_PROFILE_FLUSH_INTERVAL']:
+                self.flush()
+            time.sleep(interval)
+        self.flush()
+
+    def _collapse(self, frame) -> str:
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = frame_label(code, frame.f_globals.get('__name__', '?'))
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        return ';'.join(labels)
+
+    def _add(self, ident: int, endpoint: str, stack: str):
+        with self._lock:
+            if self._active.get(ident) != endpoint:
+                return
+            unapproved = self._unapproved.get(ident)
+            if unapproved is not None:
+                unapproved[stack] += 1
+            else:
+                self.samples.setdefault(endpoint, Counter())[stack] += 1
+
+    def path(self, endpoint: str) -> str:
+        return os.path.join(self.directory, f'{endpoint}-{os.getpid()}.folded')
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        with self._lock:
+            samples = {endpoint: dict(stacks) for endpoint, stacks in self.samples.items()}
+        if not samples:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for endpoint, stacks in samples.items():
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.writelines(f'{stack} {count}\n' for stack, count in stacks.items())
+            os.replace(tmp, self.path(endpoint))
+
+    def collapsed(self, endpoint: str) -> Counter:
+        """Add up the samples of ``endpoint`` written by every worker."""
+        self.flush()
+        stacks = Counter()
+        for path in glob.glob(os.path.join(self.directory, f'{glob.escape(endpoint)}-*.folded')):
+            with open(path) as f:
+                for line in f:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    if stack:
+                        stacks[stack] += int(count)
+        return stacks
+
+    def endpoints(self) -> dict[str, int]:
+        self.flush()
+        totals = Counter()
+        for path in glob.glob(os.path.join(self.directory, '*-*.folded')):
+            endpoint = os.path.basename(path).rsplit('-', 1)[0]
+            with open(path) as f:
+                totals[endpoint] += sum(int(line.rpartition(' ')[2]) for line in f if line.strip())
+        return dict(totals)
+
+    def reset(self):
+        """Discard the collected stacks and close an open profiling window."""
+        with self._lock:
+            self.samples.clear()
+        for path in glob.glob(os.path.join(self.directory, '*.folded')) + [self.window_path]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._window_until = 0.0
+        self._window_checked = 0.0
+
+
+def stack_sampler() -> StackSampler:
+    return current_app.extensions['stack_sampler']
+
+
+@atexit.register
+def flush_all():
+    for sampler in list(_samplers):
+        try:
+            sampler.flush()
+        except OSError:
+            pass
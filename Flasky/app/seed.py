@@ -0,0 +1,274 @@
+import hashlib
+import itertools
+import os
+import random
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import sqlalchemy as sa
+from faker import Faker
+from werkzeug.security import generate_password_hash
+
+from . import db
+from .models import Role, User, Post, Comment, Follow, Timeline
+from .rendering import POST_TAGS, COMMENT_TAGS, render_markdown
+
+MARKUP = ['**{}**', '_{}_', '`{}`', '[{}](http://example.com/{})', 'http://example.com/{}']
+
+
+def render_chunk(bodies: list[str], tags: list[str]) -> list[str]:
+    return [render_markdown(body, tags) for body in bodies]
+
+
+def chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def aware(value: datetime) -> datetime:
+    # SQLite hands timestamps back without their UTC offset
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def zipf_weights(count: int, exponent: float) -> list[float]:
+    return list(itertools.accumulate(1.0 / (rank + 1) ** exponent for rank in range(count)))
+
+
+class Seeder:
+    """Bulk generator of fake users, follows, posts and comments.
+
+    Rows are built in Python and written with Core ``executemany`` inserts of
+    ``batch_size`` rows, so none of the per-row ORM events run; the timeline
+    and the denormalized counters are rebuilt once by ``finish()``. Authors,
+    followed users and commented posts are drawn from Zipf distributions and
+    the number of users each user follows from a Pareto one, which gives the
+    long-tailed graph of a real site. The seeder counts what it inserts, so
+    ``finish()`` only adds those deltas to the counters instead of
+    recounting every user.
+
+    Bodies are a few paragraphs drawn from a corpus of ``corpus_size``
+    generated paragraphs. The corpus is rendered once, by a pool of
+    ``workers`` processes, and since Markdown renders paragraphs
+    independently a body's ``html_body`` is the join of its paragraphs'
+    HTML, so rows cost no rendering at all. The same ``seed`` and ``now``
+    produce the same rows, apart from the salt of the password hash every
+    seeded user shares; their password is ``password``.
+    """
+
+    def __init__(self, seed: int = 0, batch_size: int = 5000, workers: Optional[int] = None,
+                 now: Optional[datetime] = None, corpus_size: int = 2000):
+        self.random = random.Random(seed)
+        self.fake = Faker()
+        self.fake.seed_instance(seed)
+        self.batch_size = batch_size
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.now = now or datetime.now(timezone.utc)
+        self.words = self.fake.words(2000)
+        # usernames are built from these, keep them to letters
+        self.first_names = [name for name in (self.fake.first_name() for _ in range(500)) if name.isalpha()]
+        self.last_names = [name for name in (self.fake.last_name() for _ in range(500)) if name.isalpha()]
+        self.cities = [self.fake.city() for _ in range(500)]
+        self.corpus_size = corpus_size
+        self._corpora = {}
+        self.user_ids = []
+        self.counts = {}
+        self.deltas = defaultdict(Counter)
+        self._pool = None
+
+    def __enter__(self) -> 'Seeder':
+        if self.workers > 1:
+            self._pool = ProcessPoolExecutor(self.workers)
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def render(self, bodies: list[str], tags: list[str]) -> list[str]:
+        if self._pool is None:
+            return render_chunk(bodies, tags)
+        size = max(1, len(bodies) // (self.workers * 4))
+        return list(itertools.chain.from_iterable(
+            self._pool.map(render_chunk, chunks(bodies, size), itertools.repeat(tags))))
+
+    def insert(self, table: sa.Table, rows: list[dict]):
+        for batch in chunks(rows, self.batch_size):
+            db.session.execute(sa.insert(table), batch)
+        self.counts[table.name] = self.counts.get(table.name, 0) + len(rows)
+
+    def next_id(self, column: sa.Column) -> int:
+        return (db.session.scalar(sa.select(sa.func.max(column))) or 0) + 1
+
+    def between(self, start: datetime, end: datetime) -> datetime:
+        return start + (end - start) * self.random.random()
+
+    def text(self, words: int, markup: float = 0.1) -> str:
+        tokens = self.random.choices(self.words, k=words)
+        for i, token in enumerate(tokens):
+            if self.random.random() < markup:
+                tokens[i] = self.random.choice(MARKUP).format(token, token)
+        sentences = []
+        while tokens:
+            length = self.random.randint(6, 16)
+            sentence, tokens = tokens[:length], tokens[length:]
+            sentences.append(' '.join(sentence).capitalize() + '.')
+        return ' '.join(sentences)
+
+    def corpus(self, tags: list[str], words: tuple[int, int]) -> tuple[list[str], list[str]]:
+        """Paragraphs of ``words`` words and their HTML rendered for ``tags``."""
+        key = (tuple(tags), words)
+        if key not in self._corpora:
+            paragraphs = [self.text(self.random.randint(*words)) for _ in range(self.corpus_size)]
+            self._corpora[key] = paragraphs, self.render(paragraphs, tags)
+        return self._corpora[key]
+
+    def bodies(self, count: int, tags: list[str], words: tuple[int, int],
+               paragraphs: tuple[int, int]) -> list[tuple[str, str]]:
+        texts, htmls = self.corpus(tags, words)
+        # Markdown joins blocks with a newline; bleach leaves a blank line where it strips a <p>
+        separator = '\n' if 'p' in tags else '\n\n'
+        bodies = []
+        for _ in range(count):
+            picked = self.random.choices(range(len(texts)), k=self.random.randint(*paragraphs))
+            bodies.append(('\n\n'.join(texts[i] for i in picked), separator.join(htmls[i] for i in picked)))
+        return bodies
+
+    def users(self, count: int) -> list[int]:
+        Role.insert_roles()
+        role_id = db.session.scalar(sa.select(Role.id).where(Role.default.is_(True)))
+        password_hash = generate_password_hash('password')
+        first_id = self.next_id(User.id)
+        users = []
+        follows = []
+        for id in range(first_id, first_id + count):
+            first, last = self.random.choice(self.first_names), self.random.choice(self.last_names)
+            username = f'{first.lower()}.{last.lower()}{id}'
+            email = f'{username}@example.com'
+            since = self.between(self.now - timedelta(days=3 * 365), self.now)
+            users.append({
+                'id': id, 'email': email, 'username': username, 'password_hash': password_hash,
+                'confirmed': True, 'name': f'{first} {last}', 'location': self.random.choice(self.cities),
+                'about_me': self.text(self.random.randint(4, 16), markup=0), 'moment_since': since,
+                'last_seen': self.between(since, self.now),
+                'avatar_hash': hashlib.md5(email.encode()).hexdigest(), 'role_id': role_id,
+                'follower_count': 1, 'following_count': 1,
+            })
+            follows.append({'follower_id': id, 'followed_id': id, 'timestamp': since})
+        self.insert(User.__table__, users)
+        self.insert(Follow.__table__, follows)
+        db.session.commit()
+        self.user_ids.extend(user['id'] for user in users)
+        return self.user_ids[-count:]
+
+    def load_users(self) -> dict[int, datetime]:
+        return {id: aware(since) for id, since in db.session.execute(sa.select(User.id, User.moment_since))}
+
+    def follows(self, mean: float = 20.0, alpha: float = 2.0, exponent: float = 1.0) -> int:
+        """Let every user created by this seeder follow about ``mean`` others."""
+        since = self.load_users()
+        everyone = sorted(since)
+        self.random.shuffle(everyone)
+        weights = zipf_weights(len(everyone), exponent)
+        scale = mean * (alpha - 1) / alpha
+        rows = []
+        inserted = 0
+        for follower_id in self.user_ids:
+            degree = min(len(everyone) - 1, int(scale * self.random.paretovariate(alpha)))
+            targets = set(self.random.choices(everyone, cum_weights=weights, k=degree))
+            targets.discard(follower_id)
+            self.deltas[User.following_count][follower_id] += len(targets)
+            inserted += len(targets)
+            for followed_id in sorted(targets):
+                self.deltas[User.follower_count][followed_id] += 1
+                start = max(since[follower_id], since[followed_id])
+                rows.append({'follower_id': follower_id, 'followed_id': followed_id,
+                             'timestamp': self.between(start, self.now)})
+            if len(rows) >= self.batch_size:
+                self.insert(Follow.__table__, rows)
+                rows = []
+        self.insert(Follow.__table__, rows)
+        db.session.commit()
+        return inserted
+
+    def posts(self, count: int, exponent: float = 1.1) -> int:
+        since = self.load_users()
+        authors = sorted(since)
+        self.random.shuffle(authors)
+        weights = zipf_weights(len(authors), exponent)
+        next_id = self.next_id(Post.id)
+        for size in self.batch_sizes(count):
+            rows = []
+            for author_id, (body, html) in zip(self.random.choices(authors, cum_weights=weights, k=size),
+                                               self.bodies(size, POST_TAGS, (8, 60), (1, 4))):
+                rows.append({'id': next_id, 'body': body, 'html_body': html,
+                             'timestamp': self.between(since[author_id], self.now),
+                             'author_id': author_id})
+                next_id += 1
+                self.deltas[User.post_count][author_id] += 1
+            self.insert(Post.__table__, rows)
+            db.session.commit()
+        return count
+
+    def comments(self, count: int, exponent: float = 1.1) -> int:
+        since = self.load_users()
+        authors = sorted(since)
+        self.random.shuffle(authors)
+        author_weights = zipf_weights(len(authors), exponent)
+        posted = {id: aware(timestamp) for id, timestamp in db.session.execute(sa.select(Post.id, Post.timestamp))}
+        posts = sorted(posted)
+        self.random.shuffle(posts)
+        post_weights = zipf_weights(len(posts), exponent)
+        for size in self.batch_sizes(count):
+            rows = []
+            for post_id, author_id, (body, html) in zip(
+                    self.random.choices(posts, cum_weights=post_weights, k=size),
+                    self.random.choices(authors, cum_weights=author_weights, k=size),
+                    self.bodies(size, COMMENT_TAGS, (3, 30), (1, 2))):
+                start = max(posted[post_id], since[author_id])
+                rows.append({'body': body, 'html_body': html,
+                             'timestamp': self.between(start, self.now),
+                             'disabled': self.random.random() < 0.01,
+                             'author_id': author_id, 'post_id': post_id})
+                self.deltas[User.comment_count][author_id] += 1
+                self.deltas[Post.comments_count][post_id] += 1
+            self.insert(Comment.__table__, rows)
+            db.session.commit()
+        return count
+
+    def batch_sizes(self, count: int):
+        while count > 0:
+            yield min(count, self.batch_size)
+            count -= self.batch_size
+
+    def finish(self):
+        """Apply the counter deltas and rebuild the timeline, which the bulk inserts bypassed."""
+        for column, deltas in self.deltas.items():
+            table = column.class_.__table__
+            update = sa.update(table).where(table.c.id == sa.bindparam('row_id')) \
+                .values({column.key: column + sa.bindparam('delta')})
+            rows = [{'row_id': id, 'delta': delta} for id, delta in sorted(deltas.items())]
+            for batch in chunks(rows, self.batch_size):
+                db.session.execute(update, batch)
+        for id in self.deltas[User.post_count].keys() | self.deltas[User.comment_count].keys() | \
+                self.deltas[User.follower_count].keys():
+            User.invalidate_cache(id)
+        self.deltas.clear()
+        db.session.commit()
+        self.counts['timeline'] = Timeline.rebuild()
+
+    def run(self, users: int = 0, posts: int = 0, comments: int = 0,
+            follows: float = 20.0) -> dict[str, float]:
+        timings = {}
+        for step, work in (('users', lambda: self.users(users) if users else None),
+                           ('follows', lambda: self.follows(follows) if users else None),
+                           ('posts', lambda: self.posts(posts) if posts else None),
+                           ('comments', lambda: self.comments(comments) if comments else None),
+                           ('finish', self.finish)):
+            start = time.perf_counter()
+            work()
+            timings[step] = time.perf_counter() - start
+        return timings
@@ -0,0 +1,68 @@
+from typing import Callable, Optional
+
+import sqlalchemy as sa
+from flask import Flask, current_app, has_app_context
+from sqlalchemy import event
+
+
+def is_sqlite_file(url: sa.engine.URL) -> bool:
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def set_pragmas(config) -> Callable:
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA journal_mode={config["FLASKY_SQLITE_JOURNAL_MODE"]}')
+        cursor.execute(f'PRAGMA synchronous={config["FLASKY_SQLITE_SYNCHRONOUS"]}')
+        cursor.execute(f'PRAGMA mmap_size={int(config["FLASKY_SQLITE_MMAP_SIZE"])}')
+        cursor.execute(f'PRAGMA busy_timeout={int(config["FLASKY_SQLITE_BUSY_TIMEOUT"])}')
+        cursor.close()
+
+    return on_connect
+
+
+def autocommit(dbapi_connection, connection_record):
+    # let SQLAlchemy emit BEGIN itself instead of the driver's lazy deferred one
+    dbapi_connection.isolation_level = None
+
+
+def begin_immediate(connection):
+    connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def configure_sqlite(app: Flask):
+    """Tune file-backed SQLite engines and open the process's writer engine.
+
+    With ``FLASKY_SQLITE_TUNING``, off by default, every SQLite file
+    connection switches to WAL with ``synchronous=NORMAL``, a memory map and
+    a busy timeout, so readers never wait for the writer. Writes, the
+    background ones of the last_seen buffer and the renderer included, go to
+    a separate engine with a single connection whose transactions start
+    with ``BEGIN IMMEDIATE``: threads of one worker queue on that connection
+    and workers queue on the database lock for ``FLASKY_SQLITE_BUSY_TIMEOUT``
+    milliseconds, instead of upgrading read transactions and failing with
+    "database is locked".
+    """
+    if not app.config['FLASKY_SQLITE_TUNING']:
+        return
+    from . import db
+    with app.app_context():
+        engines = dict(db.engines)
+    for engine in engines.values():
+        if is_sqlite_file(engine.url):
+            event.listen(engine, 'connect', set_pragmas(app.config))
+    primary = engines[None]
+    if is_sqlite_file(primary.url):
+        writer = sa.create_engine(primary.url, pool_size=1, max_overflow=0,
+                                  pool_timeout=app.config['FLASKY_SQLITE_BUSY_TIMEOUT'] / 1000)
+        event.listen(writer, 'connect', set_pragmas(app.config))
+        event.listen(writer, 'connect', autocommit)
+        event.listen(writer, 'begin', begin_immediate)
+        app.extensions['sqlite_writer'] = writer
+
+
+def write_engine() -> Optional[sa.Engine]:
+    """The engine writes should use, or None to use the default bind."""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('sqlite_writer')
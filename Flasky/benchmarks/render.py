@@ -0,0 +1,49 @@
+"""Per-body cost of rendering Markdown into sanitized, linkified HTML.
+
+Compares the original pipeline (a new Markdown converter, bleach.clean and
+a second parse in bleach.linkify for every body) with the thread-local
+engine in app.rendering. Run from the Flasky directory:
+
+    python -m benchmarks.render [--number N]
+"""
+import argparse
+import timeit
+
+import bleach
+from markdown import markdown
+
+from app.rendering import POST_TAGS, COMMENT_TAGS, render_markdown
+
+BODIES = {
+    'short': 'thanks!',
+    'comment': 'Nice one, see **https://example.com/docs** and _this_ <script>alert(1)</script>',
+    'post': '\n\n'.join([
+        '# Release notes',
+        'We shipped *keyset pagination* and `counters`, details at http://example.com/blog.',
+        '\n'.join(f'- item {i} with [a link](http://example.com/{i})' for i in range(10)),
+        '> quoted text with <b>bold</b> and <iframe src="x"></iframe>',
+        '    code block\n    second line',
+    ] * 5),
+}
+
+
+def legacy(value: str, tags: list[str]) -> str:
+    return bleach.linkify(bleach.clean(markdown(value, output_format='html'), tags=tags, strip=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f'{"body":<10}{"profile":<10}{"legacy us":>12}{"engine us":>12}{"speedup":>10}')
+    for name, body in BODIES.items():
+        for profile, tags in (('post', POST_TAGS), ('comment', COMMENT_TAGS)):
+            assert legacy(body, tags) == render_markdown(body, tags), (name, profile)
+            before = timeit.timeit(lambda: legacy(body, tags), number=args.number) / args.number
+            after = timeit.timeit(lambda: render_markdown(body, tags), number=args.number) / args.number
+            print(f'{name:<10}{profile:<10}{before * 1e6:>12.1f}{after * 1e6:>12.1f}{before / after:>9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Read and write throughput of a SQLite file shared by N worker processes.
+
+Every worker is a separate process with its own app, like a gunicorn sync
+worker. It loops for a fixed time, reading the first page of the home
+timeline or, for a --write-ratio share of its iterations, loading an author
+and committing a new post. Each worker count runs twice: with the driver
+defaults (FLASKY_SQLITE_TUNING off) and with WAL, the tuned pragmas and the
+single-connection writer engine. Run from the Flasky directory:
+
+    python -m benchmarks.sqlite_concurrency [--workers 1 2 4 8] [--seconds 5]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from unittest import mock
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from config import TestingConfig
+
+
+def make_app(uri: str, tuned: bool):
+    from app import create_app
+    with mock.patch.multiple(TestingConfig, SQLALCHEMY_DATABASE_URI=uri, FLASKY_SQLITE_TUNING=tuned):
+        return create_app('testing')
+
+
+def seed(uri: str, tuned: bool, posts: int):
+    from app import db
+    from app.models import Role, User, Post
+    app = make_app(uri, tuned)
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        authors = [User(email=f'user{i}@example.com', username=f'user{i}', password='cat') for i in range(10)]
+        db.session.add_all(authors)
+        db.session.commit()
+        db.session.add_all([Post(body=f'post {i}', author=random.choice(authors)) for i in range(posts)])
+        db.session.commit()
+
+
+def work(uri: str, tuned: bool, seconds: float, write_ratio: float, results):
+    from app import db
+    from app.models import User, Post
+    app = make_app(uri, tuned)
+    reads = writes = errors = 0
+    latencies = []
+    with app.app_context():
+        author_ids = db.session.scalars(sa.select(User.id)).all()
+        db.session.commit()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                if random.random() < write_ratio:
+                    # like a request: load the current user, then write
+                    author = db.session.get(User, random.choice(author_ids))
+                    db.session.add(Post(body='benchmark post', author=author))
+                    db.session.commit()
+                    writes += 1
+                else:
+                    db.session.scalars(sa.select(Post).options(so.joinedload(Post.author))
+                                       .order_by(Post.timestamp.desc(), Post.id.desc()).limit(10)).all()
+                    db.session.commit()
+                    reads += 1
+            except sa.exc.OperationalError:
+                db.session.rollback()
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+        db.session.remove()
+    latencies.sort()
+    results.put((reads, writes, errors, latencies[int(len(latencies) * 0.99)] if latencies else 0.0))
+
+
+def run(workers: int, tuned: bool, seconds: float, write_ratio: float, posts: int) -> tuple:
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = 'sqlite:///' + os.path.join(tmp, 'bench.sqlite')
+        seed(uri, tuned, posts)
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        processes = [context.Process(target=work, args=(uri, tuned, seconds, write_ratio, results))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    reads = sum(total[0] for total in totals)
+    writes = sum(total[1] for total in totals)
+    errors = sum(total[2] for total in totals)
+    p99 = max(total[3] for total in totals)
+    return reads / seconds, writes / seconds, errors, p99
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--posts', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f'{"workers":>8}{"mode":>9}{"reads/s":>10}{"writes/s":>10}{"errors":>8}{"p99 ms":>9}')
+    for workers in args.workers:
+        for tuned in (False, True):
+            reads, writes, errors, p99 = run(workers, tuned, args.seconds, args.write_ratio, args.posts)
+            print(f'{workers:>8}{"tuned" if tuned else "default":>9}{reads:>10.0f}{writes:>10.0f}'
+                  f'{errors:>8}{p99 * 1000:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
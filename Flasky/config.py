@@ -17,12 +17,66 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     FLASKY_MAIL_SUBJECT_PREFIX = '[Flasky]'
     FLASKY_MAIL_SENDER = os.environ.get('FLASKY_MAIL_SENDER')
+    FLASKY_MAIL_OUTBOX = os.environ.get('FLASKY_MAIL_OUTBOX', 'false').lower() in ['true', 'on', '1']
+    FLASKY_MAIL_MAX_ATTEMPTS = int(os.environ.get('FLASKY_MAIL_MAX_ATTEMPTS', '5'))
+    FLASKY_MAIL_RETRY_DELAY = int(os.environ.get('FLASKY_MAIL_RETRY_DELAY', '60'))
+    FLASKY_MAIL_WORKERS = int(os.environ.get('FLASKY_MAIL_WORKERS', '2'))
+    FLASKY_MAIL_QUEUE_SIZE = int(os.environ.get('FLASKY_MAIL_QUEUE_SIZE', '100'))
+    FLASKY_MAIL_QUEUE_TIMEOUT = float(os.environ.get('FLASKY_MAIL_QUEUE_TIMEOUT', '0.5'))
+    FLASKY_MAIL_BATCH_SIZE = int(os.environ.get('FLASKY_MAIL_BATCH_SIZE', '20'))
+    FLASKY_MAIL_IDLE_TIMEOUT = int(os.environ.get('FLASKY_MAIL_IDLE_TIMEOUT', '30'))
     FLASKY_POSTS_PER_PAGE = 10
     FLASKY_FOLLOWERS_PER_PAGE = 40
     FLASKY_COMMENTS_PER_PAGE = 20
+    FLASKY_STREAM_CHUNK_SIZE = 1000
+    FLASKY_USER_CACHE_SIZE = int(os.environ.get('FLASKY_USER_CACHE_SIZE', '1024'))
+    FLASKY_USER_CACHE_TTL = int(os.environ.get('FLASKY_USER_CACHE_TTL', '60'))
+    FLASKY_AUTH_TOKEN_EXPIRATION = int(os.environ.get('FLASKY_AUTH_TOKEN_EXPIRATION', '3600'))
+    FLASKY_TOKEN_VERSIONS_SIZE = int(os.environ.get('FLASKY_TOKEN_VERSIONS_SIZE', '100000'))
+    FLASKY_TOKEN_VERSIONS_TTL = int(os.environ.get('FLASKY_TOKEN_VERSIONS_TTL', '5'))
+    FLASKY_ASYNC_RENDER = os.environ.get('FLASKY_ASYNC_RENDER', 'false').lower() in ['true', 'on', '1']
+    FLASKY_RENDER_WORKERS = int(os.environ.get('FLASKY_RENDER_WORKERS', '2'))
+    FLASKY_RENDER_QUEUE_SIZE = int(os.environ.get('FLASKY_RENDER_QUEUE_SIZE', '100'))
+    FLASKY_RENDER_CACHE_SIZE = int(os.environ.get('FLASKY_RENDER_CACHE_SIZE', '4096'))
+    FLASKY_FRAGMENT_CACHE_SIZE = int(os.environ.get('FLASKY_FRAGMENT_CACHE_SIZE', '2048'))
+    FLASKY_PAGE_CACHE = os.environ.get('FLASKY_PAGE_CACHE', 'false').lower() in ['true', 'on', '1']
+    FLASKY_PAGE_CACHE_TTL = int(os.environ.get('FLASKY_PAGE_CACHE_TTL', '10'))
+    FLASKY_PAGE_CACHE_SIZE = int(os.environ.get('FLASKY_PAGE_CACHE_SIZE', '512'))
+    FLASKY_LOCAL_AVATARS = os.environ.get('FLASKY_LOCAL_AVATARS', 'false').lower() in ['true', 'on', '1']
+    FLASKY_AVATAR_DIR = os.environ.get('FLASKY_AVATAR_DIR')
+    FLASKY_AVATAR_MAX_AGE = 365 * 24 * 3600
+    FLASKY_AVATAR_CACHE_FILES = int(os.environ.get('FLASKY_AVATAR_CACHE_FILES', '100000'))
+    FLASKY_LAST_SEEN_MIN_INTERVAL = int(os.environ.get('FLASKY_LAST_SEEN_MIN_INTERVAL', '60'))
+    FLASKY_LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('FLASKY_LAST_SEEN_FLUSH_INTERVAL', '10'))
+    FLASKY_LAST_SEEN_BATCH_SIZE = int(os.environ.get('FLASKY_LAST_SEEN_BATCH_SIZE', '100'))
+    FLASKY_IMPORT_CHUNK_SIZE = int(os.environ.get('FLASKY_IMPORT_CHUNK_SIZE', '1000'))
+    FLASKY_IMPORT_WORKERS = int(os.environ.get('FLASKY_IMPORT_WORKERS', '0'))
+
+    FLASKY_REPLICA_URIS = [uri for uri in os.environ.get('FLASKY_REPLICA_URIS', '').split(',') if uri]
+    SQLALCHEMY_BINDS = {f'replica{i}': uri for i, uri in enumerate(FLASKY_REPLICA_URIS)}
+    FLASKY_REPLICA_STICKY_SECONDS = int(os.environ.get('FLASKY_REPLICA_STICKY_SECONDS', '10'))
+
+    FLASKY_SQLITE_TUNING = os.environ.get('FLASKY_SQLITE_TUNING', 'false').lower() in ['true', 'on', '1']
+    FLASKY_SQLITE_JOURNAL_MODE = os.environ.get('FLASKY_SQLITE_JOURNAL_MODE', 'WAL')
+    FLASKY_SQLITE_SYNCHRONOUS = os.environ.get('FLASKY_SQLITE_SYNCHRONOUS', 'NORMAL')
+    FLASKY_SQLITE_MMAP_SIZE = int(os.environ.get('FLASKY_SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+    FLASKY_SQLITE_BUSY_TIMEOUT = int(os.environ.get('FLASKY_SQLITE_BUSY_TIMEOUT', '5000'))
 
-    SQLALCHEMY_RECORD_QUERIES = True
     FLASKY_SLOW_DB_QUERY_TIME = 0.5
+    FLASKY_QUERY_SAMPLE_RATE = float(os.environ.get('FLASKY_QUERY_SAMPLE_RATE', '0.01'))
+    FLASKY_QUERY_PROFILE_SIZE = int(os.environ.get('FLASKY_QUERY_PROFILE_SIZE', '500'))
+    FLASKY_QUERY_PROFILE_RESERVOIR = int(os.environ.get('FLASKY_QUERY_PROFILE_RESERVOIR', '256'))
+    FLASKY_QUERY_PROFILE_INTERVAL = int(os.environ.get('FLASKY_QUERY_PROFILE_INTERVAL', '30'))
+    FLASKY_QUERY_PROFILE_DIR = os.environ.get('FLASKY_QUERY_PROFILE_DIR')
+    FLASKY_METRICS = os.environ.get('FLASKY_METRICS', 'false').lower() in ['true', 'on', '1']
+    FLASKY_METRICS_DIR = os.environ.get('FLASKY_METRICS_DIR')
+    FLASKY_METRICS_INTERVAL = int(os.environ.get('FLASKY_METRICS_INTERVAL', '10'))
+    FLASKY_PROFILE_DIR = os.environ.get('FLASKY_PROFILE_DIR')
+    FLASKY_PROFILE_HEADER = 'X-Flasky-Profile'
+    FLASKY_PROFILE_SAMPLE_EVERY = int(os.environ.get('FLASKY_PROFILE_SAMPLE_EVERY', '0'))
+    FLASKY_PROFILE_INTERVAL = float(os.environ.get('FLASKY_PROFILE_INTERVAL', '0.005'))
+    FLASKY_PROFILE_FLUSH_INTERVAL = int(os.environ.get('FLASKY_PROFILE_FLUSH_INTERVAL', '10'))
+    FLASKY_PROFILE_MAX_WINDOW = int(os.environ.get('FLASKY_PROFILE_MAX_WINDOW', '600'))
 
     @staticmethod
     def init_app(app):
@@ -31,6 +85,7 @@ class Config:
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    FLASKY_QUERY_SAMPLE_RATE = float(os.environ.get('FLASKY_QUERY_SAMPLE_RATE', '1'))
     SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL') or \
                               'sqlite:///' + os.path.join(basedir, 'data-dev2.sqlite')
 
@@ -38,6 +93,8 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     TESTING = True
     WTF_CSRF_ENABLED = False
+    FLASKY_MAIL_IDLE_TIMEOUT = 0
+    FLASKY_QUERY_SAMPLE_RATE = 0
     SERVER_NAME = 'localhost'
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
                               'sqlite://'
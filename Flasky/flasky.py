@@ -8,12 +8,19 @@ if os.environ.get('FLASK_COVERAGE'):
     COV.start()
 
 import sys
+import time
+from datetime import timezone
 import click
 
 from flask_migrate import Migrate, upgrade
 
-from app import create_app, db
-from app.models import User, Role, Permissions, Post, Comment
+from app import create_app, db, importer
+from app.email import drain_outbox
+from app.models import User, Role, Permissions, Post, Comment, Timeline, Outbox
+from app.metrics import metrics
+from app.querystats import query_profiler
+from app.sampler import stack_sampler
+from app.seed import Seeder
 
 app = create_app(os.environ.get('FLASK_CONFIG') or 'default')
 migrate = Migrate(app, db, directory=os.path.join(os.path.dirname(__file__), 'migrations'))
@@ -21,7 +28,8 @@ migrate = Migrate(app, db, directory=os.path.join(os.path.dirname(__file__), 'mi
 
 @app.shell_context_processor
 def make_shell_context() -> dict:
-    return dict(db=db, User=User, Role=Role, Permissions=Permissions, Post=Post, Comment=Comment)
+    return dict(db=db, User=User, Role=Role, Permissions=Permissions, Post=Post, Comment=Comment,
+                Timeline=Timeline, Outbox=Outbox)
 
 
 @app.cli.command()
@@ -60,6 +68,138 @@ def profile(length, profile_dir):
     app.run(debug=True)
 
 
+@app.cli.command('profile-window')
+@click.option('--seconds', default=60.0, help='How long every worker samples its requests.')
+def profile_window(seconds):
+    """Sample the stacks of every request in all running workers for a while."""
+    stack_sampler().open_window(seconds)
+    print(f'Profiling for {seconds:g} seconds, stacks go to {stack_sampler().directory}.')
+
+
+@app.cli.command()
+@click.argument('endpoint', required=False)
+@click.option('--reset', is_flag=True, help='Discard the collected stacks.')
+def flamegraph(endpoint, reset):
+    """Print the collapsed stacks sampled for an endpoint, for flamegraph.pl."""
+    sampler = stack_sampler()
+    if reset:
+        sampler.reset()
+        print('Stack samples discarded.')
+    elif endpoint is None:
+        for name, count in sorted(sampler.endpoints().items(), key=lambda item: -item[1]):
+            print(f'{count:>8}  {name}')
+    else:
+        for stack, count in sorted(sampler.collapsed(endpoint).items()):
+            print(f'{stack} {count}')
+
+
+@app.cli.command('rebuild-timeline')
+def rebuild_timeline():
+    """Rebuild the materialized home timelines from follows and posts."""
+    count = Timeline.rebuild()
+    print(f'Timeline rebuilt: {count} entries.')
+
+
+@app.cli.command('check-timeline')
+def check_timeline():
+    """Compare the materialized home timelines against follows and posts."""
+    report = Timeline.check()
+    for key, value in report.items():
+        print(f'{key}: {value}')
+    if any(report.values()):
+        print('Timeline is inconsistent, run "flask rebuild-timeline" to repair it.')
+        sys.exit(1)
+    print('Timeline is consistent.')
+
+
+@app.cli.command()
+def recount():
+    """Recompute the denormalized post, comment and follow counters."""
+    User.recount()
+    Post.recount()
+    db.session.commit()
+    print('Counters recomputed.')
+
+
+@app.cli.command()
+@click.option('--users', default=1000, help='Number of users to create.')
+@click.option('--posts', default=10000, help='Number of posts to create.')
+@click.option('--comments', default=20000, help='Number of comments to create.')
+@click.option('--follows', default=20.0, help='Average number of users each new user follows.')
+@click.option('--seed', default=0, help='Seed of the random generators.')
+@click.option('--batch-size', default=5000, help='Number of rows per INSERT.')
+@click.option('--workers', default=None, type=int, help='Processes rendering the Markdown bodies.')
+@click.option('--now', default=None, type=click.DateTime(),
+              help='UTC time the dataset ends at, fix it to reproduce a dataset exactly.')
+def seed(users, posts, comments, follows, seed, batch_size, workers, now):
+    """Fill the database with a reproducible fake dataset."""
+    if now is not None:
+        now = now.replace(tzinfo=timezone.utc)
+    with Seeder(seed, batch_size, workers, now) as seeder:
+        timings = seeder.run(users, posts, comments, follows)
+    elapsed = sum(timings.values())
+    rows = sum(seeder.counts.values())
+    for step, seconds in timings.items():
+        print(f'{step:>10} {seconds:>8.2f}s')
+    print(f'{rows} rows in {elapsed:.2f}s ({rows / elapsed:.0f} rows/s), ' +
+          ', '.join(f'{count} {table}' for table, count in seeder.counts.items()))
+
+
+@app.cli.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format_', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='Format of the file, guessed from its extension by default.')
+@click.option('--chunk-size', default=None, type=int, help='Number of users written per transaction.')
+@click.option('--workers', default=None, type=int, help='Processes hashing the passwords.')
+def import_users(path, format_, chunk_size, workers):
+    """Create the users listed in a CSV or NDJSON file."""
+    if format_ is None:
+        format_ = 'csv' if path.endswith('.csv') else 'ndjson'
+    with open(path, encoding='utf-8', newline='') as f:
+        report = importer.import_users(f, format_, chunk_size, workers)
+    for error in report['errors']:
+        print(f'line {error["line"]}: {error["message"]}')
+    print(f'{report["imported"]} users imported, {report["failed"]} failed.')
+
+
+@app.cli.command('mail-drain')
+@click.option('--batch-size', default=50, help='Number of messages sent per SMTP session.')
+@click.option('--loop', is_flag=True, help='Keep polling the outbox for new messages.')
+@click.option('--interval', default=5.0, help='Seconds to wait between polls with --loop.')
+def mail_drain(batch_size, loop, interval):
+    """Send the messages waiting in the mail outbox."""
+    total_sent = total_failed = 0
+    while True:
+        sent, failed = drain_outbox(batch_size)
+        total_sent += sent
+        total_failed += failed
+        # failed rows back off, so an empty claim means nothing is due right now
+        if not sent + failed:
+            if not loop:
+                break
+            time.sleep(interval)
+    print(f'Outbox drained: {total_sent} sent, {total_failed} failed.')
+
+
+@app.cli.command()
+@click.option('--sort', default='total', type=click.Choice(['total', 'calls', 'mean', 'p95', 'p99', 'max']),
+              help='Column the statements are ordered by.')
+@click.option('--limit', default=20, help='Number of statements to show.')
+@click.option('--reset', is_flag=True, help='Discard the collected statistics.')
+def queries(sort, limit, reset):
+    """Show the sampled query statistics of every worker process."""
+    if reset:
+        query_profiler().reset()
+        print('Query statistics discarded.')
+        return
+    report = query_profiler().report(sort, limit)
+    print(f'{report["processes"]} process snapshots')
+    print(f'{"calls":>10} {"total s":>10} {"mean ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"max ms":>9}  statement')
+    for row in report['queries']:
+        print(f'{row["calls"]:>10} {row["total"]:>10.3f} {row["mean"] * 1000:>9.2f} {row["p95"] * 1000:>9.2f} '
+              f'{row["p99"] * 1000:>9.2f} {row["max"] * 1000:>9.2f}  {row["fingerprint"][:120]}')
+
+
 @app.cli.command()
 def deploy():
     """Run deployment tasks."""
@@ -72,6 +212,9 @@ def deploy():
     # ensure all users are following themselves
     User.add_self_follows()
 
+    # start the worker metrics from zero
+    metrics().reset()
+
 if __name__ == '__main__':
     with app.app_context():
         Role.insert_roles()
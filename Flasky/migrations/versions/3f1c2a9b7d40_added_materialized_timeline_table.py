@@ -0,0 +1,43 @@
+"""Added materialized timeline table
+
+Revision ID: 3f1c2a9b7d40
+Revises: c43bd49e7cfa
+Create Date: 2026-10-16 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d40'
+down_revision = 'c43bd49e7cfa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('timeline',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.create_index('ix_timeline_user_id_timestamp', ['user_id', 'timestamp', 'post_id'], unique=False)
+
+    # backfill the timeline from the existing follows and posts
+    op.execute(
+        'INSERT INTO timeline (user_id, post_id, timestamp) '
+        'SELECT follows.follower_id, posts.id, posts.timestamp '
+        'FROM posts JOIN follows ON follows.followed_id = posts.author_id'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.drop_index('ix_timeline_user_id_timestamp')
+
+    op.drop_table('timeline')
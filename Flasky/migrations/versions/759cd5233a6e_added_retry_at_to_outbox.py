@@ -0,0 +1,26 @@
+"""Added retry_at to the mail outbox
+
+Revision ID: 759cd5233a6e
+Revises: b4d2e8a6c913
+Create Date: 2026-10-17 00:13:12.507580
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '759cd5233a6e'
+down_revision = 'b4d2e8a6c913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('outbox', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('retry_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('outbox', schema=None) as batch_op:
+        batch_op.drop_column('retry_at')
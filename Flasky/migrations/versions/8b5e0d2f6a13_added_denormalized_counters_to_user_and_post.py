@@ -0,0 +1,51 @@
+"""Added denormalized counters to User and Post models
+
+Revision ID: 8b5e0d2f6a13
+Revises: 3f1c2a9b7d40
+Create Date: 2026-10-16 11:02:17.540391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b5e0d2f6a13'
+down_revision = '3f1c2a9b7d40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('post_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('following_count', sa.Integer(), server_default='0', nullable=False))
+
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('comments_count', sa.Integer(), server_default='0', nullable=False))
+
+    # backfill the counters from the existing rows
+    op.execute(
+        'UPDATE users SET '
+        'post_count = (SELECT count(*) FROM posts WHERE posts.author_id = users.id), '
+        'comment_count = (SELECT count(*) FROM comments WHERE comments.author_id = users.id), '
+        'follower_count = (SELECT count(*) FROM follows WHERE follows.followed_id = users.id), '
+        'following_count = (SELECT count(*) FROM follows WHERE follows.follower_id = users.id)'
+    )
+    op.execute(
+        'UPDATE posts SET '
+        'comments_count = (SELECT count(*) FROM comments WHERE comments.post_id = posts.id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_column('comments_count')
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('following_count')
+        batch_op.drop_column('follower_count')
+        batch_op.drop_column('comment_count')
+        batch_op.drop_column('post_count')
@@ -0,0 +1,46 @@
+"""Added composite indexes for the listing queries
+
+Revision ID: a7c3e9f1b254
+Revises: 5e8b1c3d7a92
+Create Date: 2026-10-16 18:22:05.614927
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9f1b254'
+down_revision = '5e8b1c3d7a92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.create_index('ix_posts_timestamp_id', ['timestamp', 'id'], unique=False)
+        batch_op.create_index('ix_posts_author_id_timestamp_id', ['author_id', 'timestamp', 'id'], unique=False)
+
+    with op.batch_alter_table('follows', schema=None) as batch_op:
+        batch_op.create_index('ix_follows_followed_id_timestamp', ['followed_id', 'timestamp', 'follower_id'],
+                              unique=False)
+        batch_op.create_index('ix_follows_follower_id_timestamp', ['follower_id', 'timestamp', 'followed_id'],
+                              unique=False)
+
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.create_index('ix_comments_timestamp_id', ['timestamp', 'id'], unique=False)
+        batch_op.create_index('ix_comments_post_id_timestamp_id', ['post_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.drop_index('ix_comments_post_id_timestamp_id')
+        batch_op.drop_index('ix_comments_timestamp_id')
+
+    with op.batch_alter_table('follows', schema=None) as batch_op:
+        batch_op.drop_index('ix_follows_follower_id_timestamp')
+        batch_op.drop_index('ix_follows_followed_id_timestamp')
+
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_posts_author_id_timestamp_id')
+        batch_op.drop_index('ix_posts_timestamp_id')
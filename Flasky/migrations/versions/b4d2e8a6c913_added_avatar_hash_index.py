@@ -0,0 +1,26 @@
+"""Added an index on users.avatar_hash
+
+Revision ID: b4d2e8a6c913
+Revises: a7c3e9f1b254
+Create Date: 2026-10-17 09:41:27.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4d2e8a6c913'
+down_revision = 'a7c3e9f1b254'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_users_avatar_hash'), ['avatar_hash'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_users_avatar_hash'))
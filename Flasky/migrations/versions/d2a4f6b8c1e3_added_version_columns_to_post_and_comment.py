@@ -0,0 +1,32 @@
+"""Added version columns to Post and Comment models
+
+Revision ID: d2a4f6b8c1e3
+Revises: 8b5e0d2f6a13
+Create Date: 2026-10-16 14:27:05.118264
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a4f6b8c1e3'
+down_revision = '8b5e0d2f6a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_column('version')
+
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -2,11 +2,14 @@ import json
 import re
 import unittest
 from base64 import b64encode
+from datetime import datetime, timedelta, timezone
 
+import sqlalchemy as sa
 from flask import url_for
 
 from app import db, create_app
-from app.models import Role, User, Post, Comment
+from app.models import Role, User, Post, Comment, Follow, Permissions, token_versions
+from tests.utils import count_queries
 
 
 class APITestCase(unittest.TestCase):
@@ -86,6 +89,101 @@ class APITestCase(unittest.TestCase):
             headers=self.get_api_headers(token, ''))
         self.assertEqual(response.status_code, 200)
 
+    def test_token_claims(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(username='tima', email='tim@gramil.com', password='cat123', confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+        token = u.generate_auth_token()
+        db.session.expunge_all()
+
+        with count_queries() as counter:
+            response = self.client.get(url_for('api.get_user', id=u.id),
+                                       headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(counter.count, 1)
+
+        token_user = User.verify_auth_token(token)
+        self.assertEqual(token_user.id, u.id)
+        self.assertTrue(token_user.can(Permissions.WRITE.value))
+        self.assertFalse(token_user.is_administrator())
+
+        r = Role.query.filter_by(name='User').first()
+        u = db.session.get(User, u.id)
+        r.remove_permission(Permissions.WRITE.value)
+        db.session.commit()
+        response = self.client.get(url_for('api.get_user', id=u.id),
+                                   headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 401)
+
+        token = u.generate_auth_token()
+        self.assertIsNotNone(User.verify_auth_token(token))
+        u.username = 'timur'
+        db.session.commit()
+        self.assertIsNotNone(User.verify_auth_token(token))
+        u.password = 'dog123'
+        db.session.commit()
+        self.assertIsNone(User.verify_auth_token(token))
+        self.assertIsNotNone(User.verify_auth_token(u.generate_auth_token()))
+
+    def test_token_revoked_by_other_workers(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(username='tima', email='tim@gramil.com', password='cat123', confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+        token = u.generate_auth_token()
+        self.assertIsNotNone(User.verify_auth_token(token))
+
+        # another worker demotes the user: no events run in this process,
+        # the change is seen once the cached stamp expires
+        moderator = Role.query.filter_by(name='Moderator').first()
+        db.session.execute(sa.update(User).where(User.id == u.id).values(role_id=moderator.id))
+        db.session.commit()
+        self.assertIsNotNone(User.verify_auth_token(token))
+        token_versions().clear()
+        self.assertIsNone(User.verify_auth_token(token))
+
+        # a worker that never saw the token still checks the database
+        token = db.session.get(User, u.id).generate_auth_token()
+        token_versions().clear()
+        self.assertIsNotNone(User.verify_auth_token(token))
+        db.session.execute(sa.delete(Follow).where(Follow.follower_id == u.id))
+        db.session.execute(sa.delete(User).where(User.id == u.id))
+        db.session.commit()
+        token_versions().clear()
+        self.assertIsNone(User.verify_auth_token(token))
+        response = self.client.post(url_for('api.new_post'), data=json.dumps({'body': 'orphan'}),
+                                    headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 401)
+
+    def test_conditional_get_after_delete(self):
+        # deleting a row on a later page must still change the first page's ETag
+        self.app.config.update(FLASKY_COMMENTS_PER_PAGE=1, FLASKY_POSTS_PER_PAGE=1)
+        r = Role.query.filter_by(name='User').first()
+        u = User(username='tima', email='tim@gramil.com', password='cat123', confirmed=True, role=r)
+        now = datetime.now(timezone.utc)
+        old_post = Post(body='old', author=u, timestamp=now - timedelta(days=1))
+        post = Post(body='first', author=u)
+        older = Comment(body='older', author=u, post=post, timestamp=now - timedelta(days=1))
+        db.session.add_all([Post(body='oldest', author=u, timestamp=now - timedelta(days=2)), old_post, post,
+                            Comment(body='oldest', author=u, post=post, timestamp=now - timedelta(days=2)),
+                            older])
+        db.session.commit()
+        db.session.add(Comment(body='newer', author=u, post=post))
+        db.session.commit()
+        headers = self.get_api_headers(u.generate_auth_token(), '')
+
+        for url, doomed in ((url_for('api.get_comments'), older),
+                            (url_for('api.get_user_followed_posts', id=u.id), old_post)):
+            response = self.client.get(url, headers=headers)
+            etag = response.headers['ETag']
+            count = response.get_json()['count']
+            db.session.delete(doomed)
+            db.session.commit()
+            response = self.client.get(url, headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(response.get_json()['count'], count - 1)
+
     def test_anonymous(self):
         response = self.client.get(
             '/api/v1/posts/',
@@ -206,3 +304,117 @@ class APITestCase(unittest.TestCase):
         json_response = json.loads(response.get_data(as_text=True))
         self.assertIsNotNone(json_response.get('comments'))
         self.assertEqual(json_response.get('count', 0), 2)
+
+    def test_keyset_pagination(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(username='tima', email='tim@gramil.com', password='cat123', confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+        now = datetime.now(timezone.utc)
+        posts = [Post(body=f'post {i}', author=u, timestamp=now - timedelta(minutes=i % 7))
+                 for i in range(25)]
+        db.session.add_all(posts)
+        db.session.commit()
+        expected = [p.id for p in sorted(posts, key=lambda p: (p.timestamp, p.id), reverse=True)]
+
+        seen = []
+        url = url_for('api.get_user_posts', id=u.id)
+        pages = []
+        while url:
+            response = self.client.get(url, headers=self.get_api_headers('tim@gramil.com', 'cat123'))
+            self.assertEqual(response.status_code, 200)
+            json_response = response.get_json()
+            self.assertEqual(json_response['count'], 25)
+            seen.extend(int(p['url'].rsplit('/', 1)[1]) for p in json_response['posts'])
+            pages.append(json_response)
+            url = json_response['next']
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['prev'])
+        self.assertIn('after=', pages[0]['next'])
+
+        response = self.client.get(pages[2]['prev'], headers=self.get_api_headers('tim@gramil.com', 'cat123'))
+        self.assertEqual(response.get_json()['posts'], pages[1]['posts'])
+
+        response = self.client.get(url_for('api.get_user_posts', id=u.id, after='not-a-cursor'),
+                                   headers=self.get_api_headers('tim@gramil.com', 'cat123'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_post_comments_pagination_urls(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(username='tima', email='tim@gramil.com', password='cat123', confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+        post = Post(body='body of the post', author=u)
+        db.session.add(post)
+        db.session.add_all([Comment(body=f'comment {i}', author=u, post=post) for i in range(25)])
+        db.session.commit()
+
+        response = self.client.get(url_for('api.get_post_comments', id=post.id),
+                                   headers=self.get_api_headers('tim@gramil.com', 'cat123'))
+        json_response = response.get_json()
+        self.assertEqual(len(json_response['comments']), 20)
+        self.assertTrue(json_response['next'].startswith(f'/api/v1/posts/{post.id}/comments/'))
+
+        response = self.client.get(json_response['next'], headers=self.get_api_headers('tim@gramil.com', 'cat123'))
+        self.assertEqual(len(response.get_json()['comments']), 5)
+
+    def test_posts_stream(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(username='tima', email='tim@gramil.com', password='cat123', confirmed=True, role=r)
+        db.session.add(u)
+        db.session.add_all([Post(body=f'post {i}', author=u) for i in range(3)])
+        db.session.commit()
+
+        response = self.client.get(url_for('api.get_posts', stream=1),
+                                   headers=self.get_api_headers('tim@gramil.com', 'cat123'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['body'] for line in lines], ['post 0', 'post 1', 'post 2'])
+
+        headers = self.get_api_headers('tim@gramil.com', 'cat123')
+        headers['Accept'] = 'application/x-ndjson'
+        response = self.client.get(url_for('api.get_posts'), headers=headers)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 3)
+
+    def test_conditional_get(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(username='tima', email='tim@gramil.com', password='cat123', confirmed=True, role=r)
+        post = Post(body='first', author=u)
+        db.session.add_all([post, Comment(body='nice', author=u, post=post)])
+        db.session.commit()
+        headers = self.get_api_headers(u.generate_auth_token(), '')
+
+        for url in (url_for('api.get_post', id=post.id), url_for('api.get_posts'),
+                    url_for('api.get_comments'), url_for('api.get_user', id=u.id),
+                    url_for('api.get_user_posts', id=u.id), url_for('api.get_post_comments', id=post.id)):
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            response = self.client.get(url, headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.headers['ETag'], etag)
+            self.assertEqual(response.get_data(), b'')
+
+        url = url_for('api.get_comments')
+        response = self.client.get(url, headers=headers)
+        self.assertIsNotNone(response.last_modified)
+        with count_queries() as counter:
+            self.client.get(url, headers=dict(headers, **{'If-None-Match': response.headers['ETag']}))
+        self.assertEqual(counter.count, 2)
+
+        url = url_for('api.get_post', id=post.id)
+        etag = self.client.get(url, headers=headers).headers['ETag']
+        post.body = 'second'
+        db.session.commit()
+        response = self.client.get(url, headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['body'], 'second')
+
+        etag = response.headers['ETag']
+        db.session.add(Comment(body='again', author=u, post=post))
+        db.session.commit()
+        response = self.client.get(url, headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.get_json()['comments_count'], 2)
@@ -1,8 +1,19 @@
+import json
+import os
 import re
+import tempfile
+import time
 import unittest
+from base64 import b64encode
+from unittest import mock
 
 from app import db, create_app
-from app.models import Role, User
+from app.api.authentication import auth
+from app.models import Role, User, Post, Comment
+from app.fragments import fragment_cache
+from app.pagecache import page_cache
+from app.sampler import stack_sampler
+from config import TestingConfig
 
 
 class FlaskClientTestCase(unittest.TestCase):
@@ -52,3 +63,183 @@ class FlaskClientTestCase(unittest.TestCase):
         response = self.client.get('/auth/logout', follow_redirects=True)
         self.assertEqual(response.status_code, 200)
         self.assertTrue('You have been logged out.' in response.get_data(as_text=True))
+
+    def test_fragment_cache(self):
+        u = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        post = Post(body='first version', author=u)
+        db.session.add(post)
+        db.session.commit()
+
+        self.assertIn('first version', self.client.get('/').get_data(as_text=True))
+        self.assertIn('first version', self.client.get('/').get_data(as_text=True))
+        self.assertEqual((fragment_cache().hits, fragment_cache().misses), (1, 1))
+
+        post.body = 'second version'
+        db.session.commit()
+        data = self.client.get('/').get_data(as_text=True)
+        self.assertIn('second version', data)
+        self.assertNotIn('first version', data)
+
+        db.session.add(Comment(body='nice', author=u, post=post))
+        db.session.commit()
+        self.assertIn('1 Comments', self.client.get('/').get_data(as_text=True))
+
+        self.client.post('/auth/login', data={'email': 'john@example.com', 'password': 'cat'})
+        self.assertIn('Edit</span>', self.client.get('/').get_data(as_text=True))
+        self.assertEqual(fragment_cache().misses, 4)
+
+    def test_page_cache(self):
+        self.app.config['FLASKY_PAGE_CACHE'] = True
+        cache = page_cache().cache
+        u = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        db.session.add(Post(body='first post', author=u))
+        db.session.commit()
+
+        first = self.client.get('/?page=1')
+        second = self.client.get('/?page=1')
+        self.assertEqual(first.get_data(), second.get_data())
+        self.assertIn('first post', second.get_data(as_text=True))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.client.get('/')
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        db.session.add(Post(body='second post', author=u))
+        db.session.commit()
+        self.assertIn('second post', self.client.get('/?page=1').get_data(as_text=True))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+        self.client.post('/auth/login', data={'email': 'john@example.com', 'password': 'cat'})
+        response = self.client.get('/?page=1')
+        self.assertIn('Log Out', response.get_data(as_text=True))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_local_avatars(self):
+        self.app.config['FLASKY_LOCAL_AVATARS'] = True
+        self.app.config['FLASKY_AVATAR_DIR'] = tempfile.mkdtemp()
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        self.client.post('/auth/login', data={'email': 'john@example.com', 'password': 'cat'})
+
+        url = u.gravatar(size=64)
+        self.assertTrue(url.endswith(f'/avatar/{u.avatar_hash}?s=64'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertTrue(response.get_data().startswith(b'\x89PNG'))
+        self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+        self.assertTrue(os.path.exists(os.path.join(self.app.config['FLASKY_AVATAR_DIR'],
+                                                    f'{u.avatar_hash}-64.png')))
+        self.assertEqual(self.client.get('/avatar/not-a-hash').status_code, 404)
+
+        # sizes snap to the fixed set, hashes nobody owns are never written
+        self.assertEqual(self.client.get(f'/avatar/{u.avatar_hash}?s=50').get_data(), response.get_data())
+        response = self.client.get(f'/avatar/{"0" * 32}?s=9999')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_data().startswith(b'\x89PNG'))
+        self.assertEqual(sorted(os.listdir(self.app.config['FLASKY_AVATAR_DIR'])), [f'{u.avatar_hash}-64.png'])
+
+        self.app.config['FLASKY_AVATAR_CACHE_FILES'] = 2
+        for size in (18, 32, 40):
+            self.client.get(u.gravatar(size=size))
+        self.assertLessEqual(len(os.listdir(self.app.config['FLASKY_AVATAR_DIR'])), 2)
+
+    def test_metrics(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        directory = tempfile.mkdtemp()
+        with mock.patch.multiple(TestingConfig, FLASKY_METRICS=True, FLASKY_METRICS_DIR=directory):
+            app = create_app('testing')
+        with app.app_context():
+            db.create_all()
+            Role.insert_roles()
+            client = app.test_client()
+            # an exited worker: its counters still count, its gauges no longer do
+            with open(os.path.join(directory, 'metrics-999999999.json'), 'w') as f:
+                json.dump({'pid': 999999999,
+                           'histograms': [],
+                           'counters': [['flasky_requests_total',
+                                         [['endpoint', 'main.index'], ['method', 'GET'], ['status', 200]], 5]],
+                           'gauges': [['flasky_mail_queue_depth', [], 7]]}, f)
+            client.get('/')
+            client.get('/')
+            client.get('/no-such-page')
+            response = client.get('/metrics')
+            db.drop_all()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        self.assertIn('# TYPE flasky_request_duration_seconds histogram', text)
+        self.assertIn('flasky_requests_total{endpoint="main.index",method="GET",status="200"} 7', text)
+        self.assertIn('flasky_requests_total{endpoint="none",method="GET",status="404"} 1', text)
+        self.assertIn('flasky_request_duration_seconds_count{endpoint="main.index",method="GET"} 2', text)
+        self.assertIn('flasky_request_duration_seconds_bucket{endpoint="main.index",method="GET",le="+Inf"} 2',
+                      text)
+        self.assertRegex(text, r'flasky_request_queries_sum\{endpoint="main.index"\} [1-9]')
+        self.assertRegex(text, r'flasky_request_db_seconds_sum\{endpoint="main.index"\} 0\.\d*[1-9]')
+        self.assertIn('flasky_template_render_seconds_count{template="index.html"} 2', text)
+        self.assertIn('flasky_mail_queue_depth 0', text)
+
+    def test_stack_sampler(self):
+        def slow():
+            time.sleep(0.05)
+            return 'done'
+
+        self.app.add_url_rule('/slow', 'slow', slow)
+        self.app.add_url_rule('/api-slow', 'api_slow', auth.login_required(slow))
+        self.app.config['FLASKY_PROFILE_DIR'] = tempfile.mkdtemp()
+        self.app.config['FLASKY_PROFILE_INTERVAL'] = 0.001
+        sampler = stack_sampler()
+        sampler.directory = self.app.config['FLASKY_PROFILE_DIR']
+        headers = {self.app.config['FLASKY_PROFILE_HEADER']: '1'}
+
+        # the header is ignored unless an administrator sends it
+        self.client.get('/slow', headers=headers)
+        self.assertEqual(sampler.endpoints(), {})
+
+        admin_role = Role.query.filter_by(name='Administrator').first()
+        db.session.add(User(email='john@example.com', username='john', password='cat',
+                            confirmed=True, role=admin_role))
+        db.session.commit()
+
+        # API credentials count too, once they have been checked
+        def basic(password):
+            return {'Authorization': 'Basic ' + b64encode(f'john@example.com:{password}'.encode()).decode()}
+
+        self.assertEqual(self.client.get('/api-slow', headers={**headers, **basic('dog')}).status_code, 401)
+        self.assertEqual(sampler.endpoints(), {})
+        self.assertEqual(self.client.get('/api-slow', headers={**headers, **basic('cat')}).status_code, 200)
+        self.assertTrue(sampler.collapsed('api_slow'))
+
+        self.client.post('/auth/login', data={'email': 'john@example.com', 'password': 'cat'})
+        self.client.get('/slow', headers=headers)
+        stacks = sampler.collapsed('slow')
+        self.assertTrue(stacks)
+        self.assertTrue(any(stack.endswith('tests.test_client:FlaskClientTestCase.test_stack_sampler.<locals>.slow')
+                            for stack in stacks))
+        self.assertTrue(os.path.exists(sampler.path('slow')))
+        for _ in range(100):
+            if sampler._thread is None:
+                break
+            time.sleep(0.01)
+        self.assertIsNone(sampler._thread)
+
+        count = sum(sampler.collapsed('slow').values())
+        self.client.get('/slow')
+        self.assertEqual(sum(sampler.collapsed('slow').values()), count)
+        # opening a window takes the CSRF token the GET hands out, and is capped
+        self.app.config['WTF_CSRF_ENABLED'] = True
+        self.assertEqual(self.client.post('/admin/profile', data={'seconds': 60}).status_code, 400)
+        token = self.client.get('/admin/profile').get_json()['csrf_token']
+        response = self.client.post('/admin/profile', data={'seconds': 10 ** 6, 'csrf_token': token})
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.assertGreater(response.get_json()['window_until'], time.time())
+        self.assertLessEqual(response.get_json()['window_until'],
+                             time.time() + self.app.config['FLASKY_PROFILE_MAX_WINDOW'])
+        self.client.get('/slow')
+        self.assertGreater(sum(sampler.collapsed('slow').values()), count)
+        self.assertIn('slow', self.client.get('/admin/profile').get_json()['endpoints'])
+
+        sampler.reset()
+        self.assertEqual(sampler.endpoints(), {})
+        self.assertFalse(os.path.exists(sampler.window_path))
+        self.assertEqual(sampler.window_until(), 0.0)
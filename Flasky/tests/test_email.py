@@ -0,0 +1,159 @@
+import socketserver
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from flask_mail import Message
+
+from app import db, create_app, mail
+from app.email import send_email, mail_pool, drain_outbox
+from app.models import Role, User, Outbox
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.messages += 1
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.connections = 0
+        self.messages = 0
+
+
+class EmailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.smtp = SMTPServer()
+        threading.Thread(target=self.smtp.serve_forever, daemon=True).start()
+        self.app = create_app('testing')
+        self.app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=self.smtp.server_address[1],
+                               MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False,
+                               FLASKY_MAIL_SENDER='flasky@example.com', FLASKY_MAIL_WORKERS=1,
+                               FLASKY_MAIL_IDLE_TIMEOUT=5)
+        mail.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        mail_pool().close()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.smtp.shutdown()
+        self.smtp.server_close()
+
+    def test_send_email_reuses_connection(self):
+        user = User(email='john@example.com', username='john', password='cat')
+        for _ in range(5):
+            send_email(user.email, 'Confirm Your Account', 'auth/email/confirm', user=user, token='t')
+        self.assertEqual(mail_pool().queue_depth, 0)
+        db.session.commit()
+        mail_pool().join()
+        self.assertEqual(self.smtp.messages, 5)
+        self.assertEqual(self.smtp.connections, 1)
+        stats = mail_pool().stats()
+        self.assertEqual((stats['sent'], stats['failed'], stats['queue_depth']), (5, 0, 0))
+
+    def test_spill_when_queue_is_full(self):
+        pool = mail_pool()
+        pool.queue.maxsize = 1
+        self.app.config.update(FLASKY_MAIL_QUEUE_TIMEOUT=0, FLASKY_MAIL_WORKERS=0)
+        pool.submit(Message('queued', sender='flasky@example.com', recipients=['a@example.com']))
+        pool.submit(Message('spilled', sender='flasky@example.com', recipients=['b@example.com']))
+        self.assertEqual(pool.stats()['spilled'], 1)
+        self.assertEqual(pool.stats()['queue_depth'], 1)
+        self.assertEqual(self.smtp.messages, 1)
+
+    def test_rollback_discards_mail(self):
+        user = User(email='john@example.com', username='john', password='cat')
+        send_email(user.email, 'Confirm Your Account', 'auth/email/confirm', user=user, token='t')
+        with self.assertLogs(self.app.logger, 'WARNING') as logs:
+            db.session.rollback()
+        self.assertIn('Discarded 1 email(s) to john@example.com', logs.output[0])
+        db.session.commit()
+
+        db.session.add(user)
+        send_email(user.email, 'Confirm Your Account', 'auth/email/confirm', user=user, token='t')
+        with self.assertLogs(self.app.logger, 'WARNING'):
+            db.session.remove()
+        self.assertEqual(mail_pool().stats()['sent'], 0)
+
+    def test_send_email_outside_transaction(self):
+        self.assertFalse(db.session().in_transaction())
+        send_email('john@example.com', 'Hello', 'auth/email/confirm', user=None, token='t')
+        mail_pool().join()
+        self.assertEqual(self.smtp.messages, 1)
+
+    def test_registration_is_one_transaction(self):
+        self.app.config['FLASKY_MAIL_OUTBOX'] = True
+        user = User(email='john@example.com', username='john', password='cat')
+        db.session.add(user)
+        db.session.flush()
+        send_email(user.email, 'Confirm Your Account', 'auth/email/confirm', user=user,
+                   token=user.generate_confirmation_token())
+        db.session.rollback()
+        self.assertEqual(User.query.count(), 0)
+        self.assertEqual(Outbox.query.count(), 0)
+
+    def test_outbox(self):
+        self.app.config['FLASKY_MAIL_OUTBOX'] = True
+        user = User(email='john@example.com', username='john', password='cat')
+        db.session.add(user)
+        for _ in range(3):
+            send_email(user.email, 'Confirm Your Account', 'auth/email/confirm', user=user, token='t')
+        db.session.commit()
+        self.assertEqual(Outbox.pending_count(), 3)
+        self.assertEqual(self.smtp.messages, 0)
+
+        self.assertEqual(drain_outbox(2), (2, 0))
+        self.assertEqual(drain_outbox(2), (1, 0))
+        self.assertEqual(drain_outbox(2), (0, 0))
+        self.assertEqual(Outbox.pending_count(), 0)
+        self.assertEqual(self.smtp.messages, 3)
+        self.assertEqual(self.smtp.connections, 2)
+
+        send_email(user.email, 'Confirm Your Account', 'auth/email/confirm', user=user, token='t')
+        db.session.commit()
+        self.smtp.shutdown()
+        self.smtp.server_close()
+        self.assertEqual(drain_outbox(2), (0, 1))
+        row = Outbox.query.filter(Outbox.sent_at.is_(None)).one()
+        self.assertEqual(row.attempts, 1)
+        self.assertIsNotNone(row.last_error)
+
+        # the failed row backs off instead of being claimed again at once
+        self.assertEqual(drain_outbox(2), (0, 0))
+        first_delay = row.retry_at - row.timestamp
+        row.retry_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+        db.session.commit()
+        self.assertEqual(drain_outbox(2), (0, 1))
+        self.assertEqual(row.attempts, 2)
+        self.assertGreater(row.retry_at - row.timestamp, first_delay)
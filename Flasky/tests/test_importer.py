@@ -0,0 +1,160 @@
+import io
+import json
+import unittest
+from base64 import b64encode
+from unittest import mock
+
+import sqlalchemy as sa
+from flask import url_for
+
+from app import db, create_app
+from app.importer import UserImporter, import_users
+from app.models import Role, User, Follow, Timeline
+from config import TestingConfig
+
+CSV = '''email,username,password,name,role,confirmed
+susan@example.com,susan,dog,Susan,,true
+david@example.com,david,bird,,Moderator,false
+admin@example.com,admin,root,,,1
+'''
+
+
+class UserImportTestCase(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.multiple(TestingConfig, FLASKY_ADMIN='admin@example.com'):
+            self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_csv(self):
+        report = import_users(io.StringIO(CSV), 'csv', chunk_size=2)
+        self.assertEqual(report, {'imported': 3, 'failed': 0, 'errors': []})
+        susan = User.query.filter_by(username='susan').first()
+        self.assertTrue(susan.verify_password('dog'))
+        self.assertTrue(susan.confirmed)
+        self.assertEqual(susan.name, 'Susan')
+        self.assertEqual(susan.role.name, 'User')
+        self.assertEqual(susan.avatar_hash, susan.gravatar_hash())
+        self.assertTrue(susan.is_following(susan))
+        self.assertEqual((susan.follower_count, susan.following_count), (1, 1))
+        david = User.query.filter_by(username='david').first()
+        self.assertEqual(david.role.name, 'Moderator')
+        self.assertFalse(david.confirmed)
+        self.assertTrue(User.query.filter_by(username='admin').first().is_administrator())
+
+        counters = db.session.execute(sa.select(User.id, User.follower_count, User.following_count)
+                                      .order_by(User.id)).all()
+        User.recount()
+        self.assertEqual(counters, db.session.execute(sa.select(User.id, User.follower_count,
+                                                                User.following_count).order_by(User.id)).all())
+        self.assertEqual(Timeline.check(), {'missing': 0, 'extra': 0, 'stale': 0})
+
+    def test_errors(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        lines = [
+            {'email': 'susan@example.com', 'username': 'susan', 'password': 'dog'},
+            {'email': 'susan@example.com', 'username': 'susan2', 'password': 'dog'},
+            {'email': 'john@example.com', 'username': 'john2', 'password': 'dog'},
+            {'email': 'mary@example.com', 'username': 'john', 'password': 'dog'},
+            {'email': 'not an email', 'username': 'bob', 'password': 'dog'},
+            {'email': 'bob@example.com', 'username': '1bob', 'password': 'dog'},
+            {'email': 'bob@example.com', 'username': 'bob', 'password': 'dog', 'role': 'Owner'},
+            {'email': 'bob@example.com', 'username': 'bob'},
+            ['bob@example.com'],
+            {'email': 'bob@example.com', 'username': 'bob', 'password': 'dog', 'role': ['Moderator']},
+            {'email': 'bob@example.com', 'username': 'bob', 'password': 'dog', 'name': 42},
+            {'email': 'bob@example.com', 'username': 'bob', 'password': 'dog', 'about_me': {'text': 'hi'}},
+            {'email': 'bob@example.com', 'username': 'bob', 'password': 'dog', 'confirmed': {}},
+            {'email': 'bob@example.com', 'username': 'bob', 'password': 'dog', 'confirmed': 'maybe'},
+        ]
+        stream = io.StringIO('\n'.join(json.dumps(line) for line in lines) + '\n{broken\n')
+        report = import_users(stream, 'ndjson', chunk_size=4)
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual(report['failed'], 14)
+        self.assertEqual([(error['line'], error['message'].split(':')[0]) for error in report['errors']], [
+            (2, 'duplicate email'),
+            (3, 'email already registered'),
+            (4, 'username already in use'),
+            (5, 'invalid email'),
+            (6, 'usernames must have only letters, numbers, dots or underscores'),
+            (7, 'unknown role Owner'),
+            (8, 'password is required'),
+            (9, 'record is not an object'),
+            (10, 'role must be a string'),
+            (11, 'name must be a string'),
+            (12, 'about_me must be a string'),
+            (13, 'confirmed must be true or false'),
+            (14, 'confirmed must be true or false'),
+            (15, 'record is not an object'),
+        ])
+        self.assertEqual(User.query.count(), 2)
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count()).select_from(Follow)), 2)
+
+    def test_concurrent_writer(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        lines = [
+            {'email': 'susan@example.com', 'username': 'susan', 'password': 'dog'},
+            {'email': 'john@example.com', 'username': 'john2', 'password': 'dog'},
+            {'email': 'mary@example.com', 'username': 'mary', 'password': 'dog'},
+        ]
+        # john registered between the check and the INSERT
+        with mock.patch.object(UserImporter, 'taken', return_value=(set(), set())):
+            report = import_users(io.StringIO('\n'.join(json.dumps(line) for line in lines)), 'ndjson')
+        self.assertEqual(report, {'imported': 2, 'failed': 1, 'errors': [
+            {'line': 2, 'message': 'email or username already registered'}]})
+        self.assertEqual(sorted(db.session.scalars(sa.select(User.username))), ['john', 'mary', 'susan'])
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count()).select_from(Follow)), 3)
+
+    def test_password_pool(self):
+        report = import_users(io.StringIO(CSV), 'csv', workers=2)
+        self.assertEqual(report['imported'], 3)
+        self.assertTrue(User.query.filter_by(username='david').first().verify_password('bird'))
+
+    def test_api(self):
+        admin_role = Role.query.filter_by(name='Administrator').first()
+        admin = User(email='john@example.com', username='john', password='cat', confirmed=True, role=admin_role)
+        user = User(email='mary@example.com', username='mary', password='dog', confirmed=True)
+        db.session.add_all([admin, user])
+        db.session.commit()
+
+        def headers(email, password, content_type):
+            return {'Authorization': 'Basic ' + b64encode(f'{email}:{password}'.encode()).decode(),
+                    'Accept': 'application/json', 'Content-Type': content_type}
+
+        response = self.client.post(url_for('api.import_users'), data=CSV,
+                                    headers=headers('mary@example.com', 'dog', 'text/csv'))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(url_for('api.import_users'), data=CSV,
+                                    headers=headers('john@example.com', 'cat', 'application/json'))
+        self.assertEqual(response.status_code, 400)
+        # requests hash the passwords themselves instead of starting a process pool
+        with mock.patch('app.importer.ProcessPoolExecutor') as pool:
+            response = self.client.post(url_for('api.import_users'), data=CSV,
+                                        headers=headers('john@example.com', 'cat', 'text/csv; charset=utf-8'))
+        pool.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'imported': 3, 'failed': 0, 'errors': []})
+        self.assertEqual(User.query.count(), 5)
+
+        ndjson = '\n'.join(json.dumps(line) for line in [
+            {'email': 'bob@example.com', 'username': 'bob', 'password': 'dog', 'name': ['Bob']},
+            {'email': 'ann@example.com', 'username': 'ann', 'password': 'dog', 'confirmed': True},
+        ])
+        response = self.client.post(url_for('api.import_users'), data=ndjson,
+                                    headers=headers('john@example.com', 'cat', 'application/x-ndjson'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'imported': 1, 'failed': 1,
+                                               'errors': [{'line': 1, 'message': 'name must be a string'}]})
+        self.assertTrue(User.query.filter_by(username='ann').first().confirmed)
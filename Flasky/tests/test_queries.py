@@ -0,0 +1,169 @@
+import json
+import os
+import tempfile
+import unittest
+from base64 import b64encode
+from unittest import mock
+
+from app import db, create_app
+from app.models import Role, User, Post, Comment
+from app.querystats import dump_all, fingerprint, query_profiler
+from config import TestingConfig
+from tests.utils import QueryCountMixin, count_queries
+
+
+class QueryCountTestCase(QueryCountMixin, unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+        admin_role = Role.query.filter_by(name='Administrator').first()
+        self.admin = User(email='john@example.com', username='john', password='cat',
+                          confirmed=True, role=admin_role)
+        db.session.add(self.admin)
+        db.session.commit()
+        authors = [User(email=f'user{i}@example.com', username=f'user{i}', password='cat',
+                        confirmed=True) for i in range(12)]
+        db.session.add_all(authors)
+        db.session.commit()
+        for author in authors:
+            self.admin.follow(author)
+            author.follow(self.admin)
+            db.session.add(Post(body=f'post by **{author.username}**', author=author))
+        db.session.commit()
+        self.post = Post.query.first()
+        for author in authors:
+            comment = Comment(body=f'comment by {author.username}')
+            db.session.add(comment)
+            comment.author = author
+            comment.post = self.post
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self):
+        self.client.post('/auth/login', data={'email': 'john@example.com', 'password': 'cat'})
+
+    @staticmethod
+    def get_api_headers(email, password) -> dict[str, str]:
+        return {
+            'Authorization': 'Basic ' + b64encode((email + ':' + password).encode('utf-8')).decode(),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    def test_html_listings(self):
+        self.login()
+        self.assertQueryCountConstant('/', 'FLASKY_POSTS_PER_PAGE')
+        self.assertQueryCountConstant('/user/john', 'FLASKY_POSTS_PER_PAGE')
+        self.assertQueryCountConstant(f'/post/{self.post.id}', 'FLASKY_COMMENTS_PER_PAGE')
+        self.assertQueryCountConstant('/moderate', 'FLASKY_COMMENTS_PER_PAGE')
+        self.assertQueryCountConstant('/followers/john', 'FLASKY_FOLLOWERS_PER_PAGE')
+        self.assertQueryCountConstant('/followed_by/john', 'FLASKY_FOLLOWERS_PER_PAGE')
+        self.client.set_cookie('show_followed', '1')
+        self.assertQueryCountConstant('/', 'FLASKY_POSTS_PER_PAGE')
+
+    def test_api_listings(self):
+        headers = self.get_api_headers('john@example.com', 'cat')
+        self.assertQueryCountConstant('/api/v1/comments/', 'FLASKY_COMMENTS_PER_PAGE', headers=headers)
+        self.assertQueryCountConstant(f'/api/v1/posts/{self.post.id}/comments/', 'FLASKY_COMMENTS_PER_PAGE',
+                                      headers=headers)
+        self.assertQueryCountConstant(f'/api/v1/users/{self.admin.id}/timeline/', 'FLASKY_POSTS_PER_PAGE',
+                                      headers=headers)
+
+    def test_count_queries(self):
+        with count_queries() as counter:
+            User.query.all()
+        self.assertEqual(counter.count, 1)
+
+
+class QueryProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with mock.patch.multiple(TestingConfig, FLASKY_QUERY_SAMPLE_RATE=1.0,
+                                 FLASKY_QUERY_PROFILE_DIR=self.tmp.name):
+            self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.tmp.cleanup()
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint("SELECT * FROM users WHERE id IN (?, ?, ?)\n AND name = 'o''neil' LIMIT 10"),
+                         'SELECT * FROM users WHERE id IN (...) AND name = ? LIMIT ?')
+        self.assertEqual(fingerprint('INSERT INTO t (a, b) VALUES (?, ?), (?, ?), (?, ?)'),
+                         'INSERT INTO t (a, b) VALUES (?, ?), ...')
+        self.assertEqual(fingerprint('SELECT users_1.id FROM users AS users_1'),
+                         'SELECT users_1.id FROM users AS users_1')
+
+    def test_profiler(self):
+        for ids in ([1], [1, 2], [1, 2, 3]):
+            User.query.filter(User.id.in_(ids)).all()
+        # another worker that sampled one query in ten
+        with open(os.path.join(self.tmp.name, 'queries-1.json'), 'w') as f:
+            json.dump({'rate': 0.1, 'queries': {'SELECT ?': {'count': 3, 'total': 0.3, 'max': 0.2,
+                                                               'samples': [0.05, 0.05, 0.2]}}}, f)
+        report = query_profiler().report()
+        self.assertEqual(report['processes'], 2)
+        rows = {row['fingerprint']: row for row in report['queries']}
+        users = [row for key, row in rows.items() if key.startswith('SELECT users.id') and 'IN (...)' in key]
+        self.assertEqual(len(users), 1)
+        self.assertEqual(users[0]['calls'], 3)
+        self.assertEqual(rows['SELECT ?']['calls'], 30)
+        self.assertAlmostEqual(rows['SELECT ?']['total'], 3.0)
+        self.assertEqual(rows['SELECT ?']['p50'], 0.05)
+        self.assertEqual(rows['SELECT ?']['max'], 0.2)
+        self.assertEqual(report['queries'][0]['fingerprint'], 'SELECT ?')
+        # queries outside requests, as in CLI commands, leave no snapshot behind
+        dump_all()
+        self.assertFalse(os.path.exists(query_profiler().path))
+
+        u = User(email='john@example.com', username='john', password='cat', confirmed=True,
+                 role=Role.query.filter_by(name='Administrator').first())
+        db.session.add(u)
+        db.session.commit()
+        self.client.post('/auth/login', data={'email': 'john@example.com', 'password': 'cat'})
+        response = self.client.get('/admin/queries?sort=calls&limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()['queries']), 2)
+        self.assertEqual(response.get_json()['queries'][0]['fingerprint'], 'SELECT ?')
+        self.assertEqual(self.client.get('/admin/queries?sort=body').status_code, 400)
+        dump_all()
+        self.assertTrue(os.path.exists(query_profiler().path))
+
+        query_profiler().reset()
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_disabled(self):
+        with mock.patch.multiple(TestingConfig, FLASKY_QUERY_SAMPLE_RATE=0):
+            app = create_app('testing')
+        with app.app_context():
+            db.create_all()
+            User.query.all()
+            self.assertEqual(query_profiler().report()['queries'], [])
+            db.drop_all()
+
+    def test_slow_queries_logged_unsampled(self):
+        with mock.patch.multiple(TestingConfig, FLASKY_QUERY_SAMPLE_RATE=0, FLASKY_SLOW_DB_QUERY_TIME=1e-9):
+            app = create_app('testing')
+        with app.app_context():
+            db.create_all()
+            with self.assertLogs(app.logger, 'WARNING') as logs:
+                User.query.all()
+            self.assertTrue(logs.output[0].split(':', 2)[2].startswith('Slow query: SELECT users.id'))
+            self.assertEqual(query_profiler().report()['queries'], [])
+            db.drop_all()
@@ -0,0 +1,110 @@
+import re
+import unittest
+from base64 import b64encode
+
+from sqlalchemy import event
+
+from app import db, create_app
+from app.models import Role, User, Post, Comment
+from app.pagination import encode_cursor
+
+FULL_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+        admin_role = Role.query.filter_by(name='Administrator').first()
+        self.admin = User(email='john@example.com', username='john', password='cat',
+                          confirmed=True, role=admin_role)
+        authors = [User(email=f'user{i}@example.com', username=f'user{i}', password='cat',
+                        confirmed=True) for i in range(4)]
+        db.session.add_all([self.admin] + authors)
+        db.session.commit()
+        for author in authors:
+            self.admin.follow(author)
+            author.follow(self.admin)
+            db.session.add(Post(body=f'post by {author.username}', author=author))
+        db.session.add(Post(body='post by john', author=self.admin))
+        db.session.commit()
+        self.post = Post.query.filter_by(author=self.admin).first()
+        for author in authors:
+            db.session.add(Comment(body=f'comment by {author.username}', author=author, post=self.post))
+        db.session.commit()
+        self.cursor = encode_cursor((self.post.timestamp, self.post.id))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self):
+        self.client.post('/auth/login', data={'email': 'john@example.com', 'password': 'cat'})
+
+    @staticmethod
+    def get_api_headers(email, password) -> dict[str, str]:
+        return {
+            'Authorization': 'Basic ' + b64encode((email + ':' + password).encode('utf-8')).decode(),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    def capture_selects(self, url: str, **kwargs) -> list[tuple]:
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            response = self.client.get(url, **kwargs)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+        self.assertEqual(response.status_code, 200, url)
+        return statements
+
+    def assertIndexedPlans(self, url: str, **kwargs):
+        tables = set(db.metadata.tables)
+        statements = self.capture_selects(url, **kwargs)
+        with db.engine.connect() as connection:
+            for statement, parameters in statements:
+                plan = [row[3] for row in connection.exec_driver_sql(
+                    'EXPLAIN QUERY PLAN ' + statement, parameters)]
+                for step in plan:
+                    scan = FULL_SCAN.match(step)
+                    self.assertFalse(scan and scan.group(1) in tables,
+                                     f'{url} scans a whole table:\n{statement}\n{plan}')
+                    self.assertNotIn('USE TEMP B-TREE', step,
+                                     f'{url} sorts without an index:\n{statement}\n{plan}')
+
+    def test_html_listings(self):
+        self.login()
+        for args in ('', f'?after={self.cursor}', f'?before={self.cursor}', '?page=-1', '?page=2'):
+            self.assertIndexedPlans('/' + args)
+            self.assertIndexedPlans('/user/john' + args)
+            self.assertIndexedPlans('/user/user0' + args)
+            self.assertIndexedPlans(f'/post/{self.post.id}' + args)
+            self.assertIndexedPlans('/moderate' + args)
+        self.assertIndexedPlans('/followers/john')
+        self.assertIndexedPlans('/followed_by/john')
+        self.assertIndexedPlans('/followers/john?page=2')
+        self.assertIndexedPlans('/followed_by/john?page=2')
+        self.client.set_cookie('show_followed', '1')
+        self.assertIndexedPlans('/')
+        self.assertIndexedPlans('/?page=2')
+
+    def test_api_listings(self):
+        # /api/v1/posts/ streams the whole table in id order, a full scan is its job
+        headers = self.get_api_headers('john@example.com', 'cat')
+        for args in ('', f'?after={self.cursor}', '?page=2'):
+            self.assertIndexedPlans('/api/v1/comments/' + args, headers=headers)
+            self.assertIndexedPlans(f'/api/v1/posts/{self.post.id}/comments/' + args, headers=headers)
+            self.assertIndexedPlans(f'/api/v1/users/{self.admin.id}/posts/' + args, headers=headers)
+            self.assertIndexedPlans(f'/api/v1/users/{self.admin.id}/timeline/' + args, headers=headers)
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app import db, create_app
+from app.models import Role, User, Post
+from config import TestingConfig
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        primary = 'sqlite:///' + os.path.join(self.tmp.name, 'primary.sqlite')
+        replica = 'sqlite:///' + os.path.join(self.tmp.name, 'replica.sqlite')
+        with mock.patch.multiple(TestingConfig, SQLALCHEMY_DATABASE_URI=primary,
+                                 SQLALCHEMY_BINDS={'replica0': replica}):
+            self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.metadata.create_all(db.engines['replica0'])
+        Role.insert_roles()
+        with db.engines['replica0'].begin() as connection:
+            connection.execute(Role.__table__.insert(), [
+                {'name': role.name, 'default': role.default, 'permissions': role.permissions}
+                for role in Role.query.all()])
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        for engine in db.engines.values():
+            engine.dispose()
+        self.app_context.pop()
+        # bind metadata is registered on the shared db object, not per app
+        db.metadatas.pop('replica0', None)
+        self.tmp.cleanup()
+
+    def test_reads_go_to_replica_until_the_user_writes(self):
+        u = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        db.session.add(Post(body='only on the primary', author=u))
+        db.session.commit()
+        with db.engines['replica0'].begin() as connection:
+            connection.execute(User.__table__.insert(), [
+                {column.key: getattr(u, column.key) for column in User.__table__.columns}])
+        db.session.remove()
+
+        self.assertNotIn('only on the primary', self.client.get('/').get_data(as_text=True))
+
+        self.client.post('/auth/login', data={'email': 'john@example.com', 'password': 'cat'})
+        self.client.post('/', data={'body': 'a new post'})
+        data = self.client.get('/').get_data(as_text=True)
+        self.assertIn('a new post', data)
+        self.assertIn('only on the primary', data)
+
+        with self.client.session_transaction() as session:
+            session['_primary_until'] = 0
+        db.session.remove()
+        self.assertNotIn('a new post', self.client.get('/').get_data(as_text=True))
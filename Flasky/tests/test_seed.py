@@ -0,0 +1,84 @@
+import unittest
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+
+from app import db, create_app
+from app.models import User, Post, Comment, Follow, Timeline
+from app.rendering import POST_TAGS, COMMENT_TAGS, render_markdown
+from app.seed import Seeder
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def seed(seed: int) -> dict:
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        with Seeder(seed, batch_size=100, workers=1, now=NOW, corpus_size=50) as seeder:
+            seeder.run(users=40, posts=300, comments=500, follows=5)
+        rows = {model.__tablename__: [tuple(row) for row in db.session.execute(
+            sa.select(*(column for column in model.__table__.c if column.key != 'password_hash'))
+            .order_by(*model.__table__.primary_key))]
+            for model in (User, Follow, Post, Comment)}
+        db.session.remove()
+        db.drop_all()
+    return rows
+
+
+class SeederTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_deterministic(self):
+        first = seed(42)
+        self.assertEqual(first, seed(42))
+        self.assertNotEqual(first['posts'], seed(43)['posts'])
+
+    def test_consistent(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        with Seeder(1, batch_size=100, workers=1, corpus_size=50) as seeder:
+            seeder.run(users=30, posts=200, comments=400)
+        self.assertEqual(seeder.counts, {'users': 30, 'follows': seeder.counts['follows'],
+                                         'posts': 200, 'comments': 400, 'timeline': Timeline.query.count()})
+        self.assertEqual(User.query.count(), 31)
+        self.assertTrue(User.query.filter_by(username=u.username).first().verify_password('cat'))
+        self.assertTrue(User.query.filter(User.id != u.id).first().verify_password('password'))
+
+        for post in Post.query.all():
+            self.assertEqual(post.html_body, render_markdown(post.body, POST_TAGS))
+            self.assertGreaterEqual(post.timestamp, post.author.moment_since)
+        for comment in Comment.query.all():
+            self.assertEqual(comment.html_body, render_markdown(comment.body, COMMENT_TAGS))
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count()).select_from(Follow)
+                                           .where(Follow.follower_id == Follow.followed_id)), 31)
+
+        counters = db.session.execute(sa.select(User.id, User.post_count, User.comment_count,
+                                                User.follower_count, User.following_count)
+                                      .order_by(User.id)).all()
+        comments_counts = db.session.execute(sa.select(Post.id, Post.comments_count).order_by(Post.id)).all()
+        User.recount()
+        Post.recount()
+        db.session.commit()
+        self.assertEqual(counters, db.session.execute(sa.select(User.id, User.post_count, User.comment_count,
+                                                                User.follower_count, User.following_count)
+                                                      .order_by(User.id)).all())
+        self.assertEqual(comments_counts, db.session.execute(sa.select(Post.id, Post.comments_count)
+                                                             .order_by(Post.id)).all())
+        self.assertEqual(Timeline.check(), {'missing': 0, 'extra': 0, 'stale': 0})
+
+    def test_render_pool(self):
+        with Seeder(1, workers=2, corpus_size=20) as seeder:
+            bodies = seeder.bodies(10, POST_TAGS, (8, 20), (1, 3))
+        for body, html in bodies:
+            self.assertEqual(html, render_markdown(body, POST_TAGS))
@@ -0,0 +1,138 @@
+import io
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+import sqlalchemy as sa
+from sqlalchemy import event
+
+from app import db, create_app
+from app.activity import last_seen_buffer
+from app.importer import import_users
+from app.models import Role, User, Post
+from app.rendering import POST_TAGS, renderer
+from app.sqlite import write_engine
+from config import TestingConfig
+
+
+class SQLiteTuningTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        uri = 'sqlite:///' + os.path.join(self.tmp.name, 'flasky.sqlite')
+        with mock.patch.multiple(TestingConfig, SQLALCHEMY_DATABASE_URI=uri, FLASKY_SQLITE_TUNING=True):
+            self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        for engine in db.engines.values():
+            engine.dispose()
+        if write_engine() is not None:
+            write_engine().dispose()
+        self.app_context.pop()
+        self.tmp.cleanup()
+
+    def test_pragmas(self):
+        with db.engine.connect() as connection:
+            self.assertEqual(connection.exec_driver_sql('PRAGMA journal_mode').scalar(), 'wal')
+            self.assertEqual(connection.exec_driver_sql('PRAGMA synchronous').scalar(), 1)
+            self.assertEqual(connection.exec_driver_sql('PRAGMA busy_timeout').scalar(), 5000)
+            self.assertEqual(connection.exec_driver_sql('PRAGMA mmap_size').scalar(), 256 * 1024 * 1024)
+
+    def test_memory_database_is_left_alone(self):
+        app = create_app('testing')
+        self.assertNotIn('sqlite_writer', app.extensions)
+
+    def test_session_writes_use_the_writer(self):
+        writer = write_engine()
+        self.assertEqual(writer.pool.size(), 1)
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        begins = []
+
+        def on_begin(connection):
+            begins.append(connection)
+
+        event.listen(writer, 'begin', on_begin)
+        try:
+            self.assertIs(db.session.get_bind(), db.engine)
+            db.session.add(Post(body='first post', author=u))
+            db.session.flush()
+            self.assertIs(db.session.get_bind(), writer)
+            db.session.commit()
+            self.assertEqual(len(begins), 1)
+            self.assertIs(db.session.get_bind(), db.engine)
+            self.assertEqual(Post.query.count(), 1)
+        finally:
+            event.remove(writer, 'begin', on_begin)
+
+    def test_background_writes_use_the_writer(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.add(Post(body='first post', author=u))
+        db.session.commit()
+        post = Post.query.first()
+        begins = []
+
+        def on_begin(connection):
+            begins.append(connection)
+
+        event.listen(write_engine(), 'begin', on_begin)
+        try:
+            last_seen_buffer().touch(u.id, datetime.now(timezone.utc))
+            self.assertEqual(last_seen_buffer().flush(), 1)
+            renderer().run(Post.__table__, post.id, post.body, POST_TAGS)
+            self.assertEqual(len(begins), 2)
+        finally:
+            event.remove(write_engine(), 'begin', on_begin)
+
+    def test_import_checks_on_the_writer(self):
+        statements = []
+
+        def on_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', on_execute)
+        try:
+            report = import_users(io.StringIO('email,username,password\nsusan@example.com,susan,dog\n'), 'csv')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', on_execute)
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual(statements, [])
+
+    def test_concurrent_writers(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        user_id = u.id
+        errors = []
+
+        def write(n: int):
+            with self.app.app_context():
+                try:
+                    for i in range(10):
+                        author = db.session.get(User, user_id)
+                        db.session.add(Post(body=f'post {n}-{i}', author=author))
+                        db.session.commit()
+                except sa.exc.OperationalError as e:
+                    errors.append(e)
+                finally:
+                    db.session.remove()
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(Post.query.count(), 80)
+        db.session.expire_all()
+        self.assertEqual(db.session.get(User, user_id).post_count, 80)
@@ -3,7 +3,9 @@ import time
 import unittest
 
 from app import db, create_app
-from app.models import User, Permissions, AnonymousUser, Role, Follow
+from app.models import User, Permissions, AnonymousUser, Role, Follow, Post, Timeline, Comment, \
+    user_load, user_cache
+from tests.utils import count_queries
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -172,3 +174,180 @@ class UserModelTestCase(unittest.TestCase):
         self.assertTrue(u2.is_followed_by(u1))
         timestamp_after = datetime.datetime.utcnow()
         self.assertTrue(timestamp_before <= f.timestamp <= timestamp_after)
+
+    def test_timeline(self):
+        u1 = User(email='tim@1.gmail.com', username='pass1', password='cat')
+        u2 = User(email='tim@2.gmail.com', username='pass2', password='cat')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        p1 = Post(body='first', author=u2)
+        db.session.add(p1)
+        db.session.commit()
+        self.assertEqual(u1.timeline_posts.all(), [])
+        self.assertEqual(u2.timeline_posts.all(), [p1])
+
+        u1.follow(u2)
+        db.session.commit()
+        self.assertEqual(u1.timeline_posts.all(), [p1])
+
+        p2 = Post(body='second', author=u2)
+        db.session.add(p2)
+        db.session.commit()
+        self.assertEqual(u1.timeline_posts.order_by(Timeline.timestamp.desc()).all(), [p2, p1])
+        self.assertEqual(set(u1.timeline_posts.all()), set(u1.followed_posts.all()))
+
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(u1.timeline_posts.all(), [])
+        self.assertEqual(Timeline.check(), {'missing': 0, 'extra': 0, 'stale': 0})
+
+    def test_timeline_rebuild(self):
+        u1 = User(email='tim@1.gmail.com', username='pass1', password='cat')
+        u2 = User(email='tim@2.gmail.com', username='pass2', password='cat')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u1.follow(u2)
+        db.session.add(Post(body='first', author=u2))
+        db.session.commit()
+        db.session.execute(db.delete(Timeline).where(Timeline.user_id == u1.id))
+        db.session.commit()
+        self.assertEqual(Timeline.check()['missing'], 1)
+        self.assertEqual(Timeline.rebuild(), 2)
+        self.assertEqual(Timeline.check(), {'missing': 0, 'extra': 0, 'stale': 0})
+
+    def test_counters(self):
+        u1 = User(email='tim@1.gmail.com', username='pass1', password='cat')
+        u2 = User(email='tim@2.gmail.com', username='pass2', password='cat')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u1.follow(u2)
+        post = Post(body='first', author=u2)
+        db.session.add(post)
+        db.session.commit()
+        c1 = Comment(body='nice', author=u1, post=post)
+        c2 = Comment(body='thanks', author=u2, post=post)
+        db.session.add_all([c1, c2])
+        db.session.commit()
+        self.assertEqual((u2.post_count, u2.comment_count, u2.follower_count, u2.following_count), (1, 1, 2, 1))
+        self.assertEqual((u1.post_count, u1.comment_count, u1.follower_count, u1.following_count), (0, 1, 1, 2))
+        self.assertEqual(post.comments_count, 2)
+
+        db.session.delete(c1)
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual((u1.comment_count, u1.following_count, u2.follower_count), (0, 1, 1))
+
+        db.session.execute(db.update(User).values(post_count=42))
+        db.session.commit()
+        User.recount()
+        Post.recount()
+        db.session.commit()
+        self.assertEqual((u1.post_count, u2.post_count), (0, 1))
+        self.assertEqual(post.comments_count, 1)
+
+    def test_user_loader_cache(self):
+        u = User(email='tim@1.gmail.com', username='pass1', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        user_id = u.id
+        db.session.remove()
+
+        self.assertEqual(user_load(str(user_id)).username, 'pass1')
+        db.session.remove()
+        with count_queries() as counter:
+            cached = user_load(str(user_id))
+            self.assertEqual(cached.username, 'pass1')
+            self.assertTrue(cached.can(Permissions.WRITE.value))
+        self.assertEqual(counter.count, 0)
+        self.assertEqual((user_cache().hits, user_cache().misses), (1, 1))
+
+        cached.ping()
+        self.assertEqual(user_cache().stats()['size'], 1)
+        cached.confirmed = True
+        db.session.commit()
+        self.assertEqual(user_cache().stats()['size'], 0)
+        db.session.remove()
+        self.assertTrue(user_load(str(user_id)).confirmed)
+
+        role = Role.query.filter_by(name='User').first()
+        role.add_permission(Permissions.MODERATE.value)
+        db.session.commit()
+        self.assertEqual(user_cache().stats()['size'], 0)
+
+    def test_last_seen_buffer(self):
+        u1 = User(email='tim@1.gmail.com', username='pass1', password='cat')
+        u2 = User(email='tim@2.gmail.com', username='pass2', password='cat')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        buffer = self.app.extensions['last_seen']
+        before = db.session.scalar(db.select(User.last_seen).where(User.id == u1.id))
+
+        time.sleep(0.01)
+        u1.ping()
+        u2.ping()
+        self.assertEqual(buffer.pending_count, 2)
+        self.assertEqual(db.session.scalar(db.select(User.last_seen).where(User.id == u1.id)), before)
+
+        with count_queries() as counter:
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(counter.count, 1)
+        after = db.session.scalar(db.select(User.last_seen).where(User.id == u1.id))
+        self.assertTrue(after > before)
+
+        u1.ping()
+        self.assertEqual(buffer.pending_count, 0)
+        self.app.config['FLASKY_LAST_SEEN_MIN_INTERVAL'] = 0
+        self.app.config['FLASKY_LAST_SEEN_BATCH_SIZE'] = 2
+        u1.ping()
+        self.assertEqual(buffer.pending_count, 1)
+        u2.ping()
+        self.assertEqual(buffer.pending_count, 0)
+        self.assertEqual(buffer._written, {})
+
+        # an idle worker still writes its pending users once the interval is up
+        self.app.config['FLASKY_LAST_SEEN_BATCH_SIZE'] = 100
+        self.app.config['FLASKY_LAST_SEEN_FLUSH_INTERVAL'] = 0.05
+        buffer.flush()
+        u1.ping()
+        self.assertEqual(buffer.pending_count, 1)
+        for _ in range(100):
+            if buffer.pending_count == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(buffer.pending_count, 0)
+        self.assertGreater(db.session.scalar(db.select(User.last_seen).where(User.id == u1.id)), after)
+
+    def test_async_render(self):
+        renderer = self.app.extensions['renderer']
+        renderer.enabled = True
+        u = User(email='john@example.com', username='john', password='cat')
+        post = Post(body='*hello*', author=u)
+        db.session.add(post)
+        db.session.flush()
+        self.assertEqual(post.html_body, '')
+        db.session.commit()
+        self.assertTrue(renderer.join(timeout=5))
+        db.session.refresh(post)
+        self.assertEqual(post.html_body, '<p><em>hello</em></p>')
+
+        renderer.max_queue = 0
+        comment = Comment(body='**thanks**', author=u, post=post)
+        db.session.add(comment)
+        db.session.commit()
+        self.assertEqual(comment.html_body, '<strong>thanks</strong>')
+        stats = renderer.stats()
+        self.assertEqual((stats['rendered'], stats['inline'], stats['queue_depth']), (2, 1, 0))
+
+    def test_render_cache(self):
+        renderer = self.app.extensions['renderer']
+        u = User(email='john@example.com', username='john', password='cat')
+        p1 = Post(body='*hello*', author=u)
+        p2 = Post(body='*hello*', author=u)
+        self.assertEqual(p1.html_body, p2.html_body)
+        self.assertEqual((renderer.rendered, renderer.cache.hits), (1, 1))
+
+        c = Comment(body='*hello*', author=u, post=p1)
+        self.assertEqual(c.html_body, '<em>hello</em>')
+        self.assertEqual((renderer.rendered, renderer.cache.hits), (2, 1))
+        self.assertEqual(renderer.stats()['cache']['size'], 2)
@@ -0,0 +1,46 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app import db
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    event.listen(db.engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', counter)
+
+
+class QueryCountMixin:
+    def assertQueryCountConstant(self, url: str, config_key: str, sizes=(2, 10), **kwargs):
+        counts = {}
+        original = self.app.config[config_key]
+        self.client.get(url, **kwargs)
+        try:
+            for size in sizes:
+                self.app.config[config_key] = size
+                with count_queries() as counter:
+                    response = self.client.get(url, **kwargs)
+                self.assertEqual(response.status_code, 200, url)
+                counts[size] = counter.count
+        finally:
+            self.app.config[config_key] = original
+        self.assertEqual(len(set(counts.values())), 1,
+                         f'{url} issues a page size dependent number of queries: {counts}')
+        return counts[sizes[0]]